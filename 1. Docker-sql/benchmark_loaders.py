@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Compare insert throughput of DataFrame.to_sql, cursor.executemany and
+COPY FROM STDIN (CSV and binary) on a local Parquet file.
+
+    python benchmark_loaders.py --user=pipeline_user --password=pipeline_pass \
+        --host=localhost --port=5432 --db=pipeline_db
+"""
+
+import argparse
+from time import time
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from ingest_data import FLOWS_DIR  # noqa: F401  (makes copy_loader importable)
+from copy_loader import copy_dataframe
+
+
+def prepare_table(engine, df, table_name):
+    df.head(n=0).to_sql(name=table_name, con=engine, if_exists='replace', index=False)
+
+
+def load_to_sql(engine, df, table_name):
+    df.to_sql(name=table_name, con=engine, if_exists='append', index=False, chunksize=100000)
+
+
+def load_executemany(engine, df, table_name):
+    columns = ", ".join(f'"{c}"' for c in df.columns)
+    placeholders = ", ".join(["%s"] * len(df.columns))
+    # Convert NaN/NaT to None so psycopg2 sends NULL
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.executemany(f'INSERT INTO "{table_name}" ({columns}) VALUES ({placeholders})', list(rows))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def load_copy(copy_format):
+    def load(engine, df, table_name):
+        conn = engine.raw_connection()
+        try:
+            with conn.cursor() as cur:
+                for start in range(0, len(df), 100000):
+                    copy_dataframe(cur, df.iloc[start:start + 100000], table_name, fmt=copy_format)
+            conn.commit()
+        finally:
+            conn.close()
+    return load
+
+
+LOADERS = {
+    'to_sql': load_to_sql,
+    'executemany': load_executemany,
+    'copy_csv': load_copy('csv'),
+    'copy_binary': load_copy('binary'),
+}
+
+
+def main(params):
+    engine = create_engine(
+        f'postgresql+psycopg2://{params.user}:{params.password}@{params.host}:{params.port}/{params.db}'
+    )
+    df = pd.read_parquet(params.file)
+    if params.rows:
+        df = df.head(params.rows)
+    print(f"Benchmarking {len(df)} rows from {params.file}")
+
+    results = []
+    for name in params.methods:
+        table_name = f"bench_{name}"
+        prepare_table(engine, df, table_name)
+        start_time = time()
+        LOADERS[name](engine, df, table_name)
+        elapsed = time() - start_time
+        results.append((name, elapsed, len(df) / elapsed if elapsed > 0 else 0))
+        print(f"{name:<12} {elapsed:8.2f}s {results[-1][2]:>12,.0f} rows/s")
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{table_name}"')
+
+    baseline = dict((name, rate) for name, _, rate in results).get('to_sql')
+    if baseline:
+        print("\nSpeed-up vs to_sql:")
+        for name, _, rate in results:
+            print(f"{name:<12} {rate / baseline:6.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Postgres loaders on a Parquet file')
+
+    parser.add_argument('--user', required=True, help='user name for postgres')
+    parser.add_argument('--password', required=True, help='password for postgres')
+    parser.add_argument('--host', required=True, help='host for postgres')
+    parser.add_argument('--port', required=True, help='port for postgres')
+    parser.add_argument('--db', required=True, help='database name for postgres')
+    parser.add_argument('--file', default='data/green_tripdata_2021-01.parquet', help='parquet file to load')
+    parser.add_argument('--rows', type=int, default=0, help='only load the first N rows (0 = all)')
+    parser.add_argument('--methods', nargs='+', choices=list(LOADERS), default=list(LOADERS), help='loaders to compare')
+
+    args = parser.parse_args()
+
+    main(args)
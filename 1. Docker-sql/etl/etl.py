@@ -1,22 +1,26 @@
+import sys
+import argparse
+from pathlib import Path
+from time import time
+
+import numpy as np
 import pandas as pd
 import psycopg2
+from psycopg2.extras import execute_values
 
-df = pd.read_csv("/data/social_media_data_1000.csv")
-df.columns = df.columns.str.strip()
-df = df.dropna()
-df['Post_Date'] = pd.to_datetime(df['Post_Date'])
-
-# connect to Postgres
-conn = psycopg2.connect(
-    host = "db",
-    dbname = "pipeline_db",
-    user = "pipeline_user",
-    password = "7762117689"
-)
-cur = conn.cursor()
+# copy_loader lives next to the Dagster flows; the image copies it into /app.
+FLOWS_DIR = Path(__file__).resolve().parent.parent.parent / "2. Workflow-orchestration" / "flows"
+if FLOWS_DIR.is_dir():
+    sys.path.append(str(FLOWS_DIR))
+
+from copy_loader import copy_dataframe  # noqa: E402
+
+COLUMNS = ["Post_ID", "User_ID", "Age", "Gender", "Post_Content", "Likes", "Shares", "Comments", "Post_Date"]
+# Unquoted identifiers are lower-case in Postgres
+DB_COLUMNS = [c.lower() for c in COLUMNS]
+TABLE_NAME = "social_media_posts"
 
-# Create table if not exists
-cur.execute( """
+CREATE_TABLE_SQL = """
 CREATE TABLE IF NOT EXISTS social_media_posts (
     Post_ID INT PRIMARY KEY,
     User_ID INT,
@@ -28,19 +32,130 @@ CREATE TABLE IF NOT EXISTS social_media_posts (
     Comments INT,
     Post_Date TIMESTAMP
 );
-""")
-
-# Insert data 
-for _, row in df.iterrows():
-    cur.execute(
-        """
-        INSERT INTO social_media_posts (Post_ID, User_ID, Age, Gender, Post_Content, Likes, Shares, Comments, Post_Date)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """,
-        (row["Post_ID"], row["User_ID"], row["Age"], row["Gender"], row["Post_Content"], row["Likes"], row["Shares"], row["Comments"], row["Post_Date"])
+"""
+
+INSERT_SQL = f"INSERT INTO {TABLE_NAME} ({', '.join(DB_COLUMNS)}) VALUES %s"
+
+# Re-runs update the existing post instead of aborting on the primary key
+UPSERT_SQL = " ON CONFLICT (post_id) DO UPDATE SET " + ", ".join(
+    f"{c} = EXCLUDED.{c}" for c in DB_COLUMNS if c != "post_id"
+)
+
+
+def read_posts(path):
+    df = pd.read_csv(path)
+    df.columns = df.columns.str.strip()
+    df = df.dropna()
+    df['Post_Date'] = pd.to_datetime(df['Post_Date'])
+    return df[COLUMNS]
+
+
+def synthetic_posts(total_rows, chunk_rows=1_000_000, seed=42):
+    """Yield a synthetic social-media frame of `total_rows` rows, chunk by chunk."""
+    rng = np.random.default_rng(seed)
+    contents = np.array(["Loving the weather today!", "Just finished a great book.", "New recipe night", "Weekend trip photos"])
+    for start in range(0, total_rows, chunk_rows):
+        n = min(chunk_rows, total_rows - start)
+        yield pd.DataFrame({
+            "Post_ID": np.arange(start + 1, start + n + 1),
+            "User_ID": rng.integers(1, 100_000, n),
+            "Age": rng.integers(18, 70, n),
+            "Gender": rng.choice(np.array(["Male", "Female", "Other"]), n),
+            "Post_Content": rng.choice(contents, n),
+            "Likes": rng.integers(0, 1_000, n),
+            "Shares": rng.integers(0, 200, n),
+            "Comments": rng.integers(0, 300, n),
+            "Post_Date": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 365 * 86_400, n), unit="s"),
+        })
+
+
+def write_execute_values(cur, df, page_size, upsert):
+    # Vectorized conversion of the whole frame to plain Python tuples (no per-row Series)
+    rows = list(df.astype(object).itertuples(index=False, name=None))
+    sql = INSERT_SQL + (UPSERT_SQL if upsert else "")
+    execute_values(cur, sql, rows, page_size=page_size)
+
+
+def write_copy(cur, df, page_size, upsert):
+    target = TABLE_NAME
+    if upsert:
+        # COPY cannot resolve conflicts itself: load into a temp table, then merge
+        cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {TABLE_NAME}_load (LIKE {TABLE_NAME}) ON COMMIT DELETE ROWS")
+        target = f"{TABLE_NAME}_load"
+    for start in range(0, len(df), page_size):
+        copy_dataframe(cur, df.iloc[start:start + page_size], target, columns=DB_COLUMNS)
+    if upsert:
+        cur.execute(
+            f"INSERT INTO {TABLE_NAME} ({', '.join(DB_COLUMNS)}) "
+            f"SELECT {', '.join(DB_COLUMNS)} FROM {target}" + UPSERT_SQL
+        )
+
+
+WRITERS = {
+    "copy": write_copy,
+    "execute_values": write_execute_values,
+}
+
+
+def load(conn, frames, method, page_size, upsert):
+    """Write every frame with the chosen batched writer; one commit per frame."""
+    writer = WRITERS[method]
+    total_rows = 0
+    start_time = time()
+    with conn.cursor() as cur:
+        for df in frames:
+            if upsert:
+                # ON CONFLICT DO UPDATE cannot touch the same post twice in one statement:
+                # keep only the last version of each Post_ID in the frame
+                df = df.drop_duplicates("Post_ID", keep="last")
+            writer(cur, df, page_size, upsert)
+            conn.commit()
+            total_rows += len(df)
+    elapsed = time() - start_time
+    rows_per_sec = total_rows / elapsed if elapsed > 0 else 0
+    print(f"{method} (page size {page_size}, upsert={upsert}): {total_rows} rows in {elapsed:.2f}s ({rows_per_sec:,.0f} rows/s)")
+    return total_rows
+
+
+def main(params):
+    # connect to Postgres
+    conn = psycopg2.connect(
+        host = params.host,
+        dbname = params.db,
+        user = params.user,
+        password = params.password
     )
 
-conn.commit()
-cur.close()
-conn.close()
-print("ETL job finished!")
\ No newline at end of file
+    # Create table if not exists
+    with conn.cursor() as cur:
+        cur.execute(CREATE_TABLE_SQL)
+    conn.commit()
+
+    if params.synthetic_rows:
+        frames = synthetic_posts(params.synthetic_rows)
+    else:
+        frames = [read_posts(params.csv)]
+
+    try:
+        load(conn, frames, params.method, params.page_size, params.upsert)
+    finally:
+        conn.close()
+    print("ETL job finished!")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load the social media CSV into Postgres')
+
+    parser.add_argument('--csv', default='/data/social_media_data_1000.csv', help='path of the social media CSV')
+    parser.add_argument('--host', default='db', help='host for postgres')
+    parser.add_argument('--db', default='pipeline_db', help='database name for postgres')
+    parser.add_argument('--user', default='pipeline_user', help='user name for postgres')
+    parser.add_argument('--password', default='7762117689', help='password for postgres')
+    parser.add_argument('--method', choices=list(WRITERS), default='copy', help='batched writer to use')
+    parser.add_argument('--page_size', type=int, default=10000, help='rows sent per COPY / execute_values page')
+    parser.add_argument('--upsert', action='store_true', help='update existing posts (ON CONFLICT) instead of failing on re-runs')
+    parser.add_argument('--synthetic_rows', type=int, default=0, help='load N synthetic rows instead of the CSV (e.g. 10000000)')
+
+    args = parser.parse_args()
+
+    main(args)
@@ -1,61 +1,377 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import os
+import sys
 import argparse
+import bisect
+import re
+import resource
+from dataclasses import dataclass, field
+from pathlib import Path
 from time import time
-import pandas as pd
+import pyarrow.parquet as pq
 from sqlalchemy import create_engine
 
+# Shared helpers (copy_loader, ...) live next to the Dagster flows. Inside the
+# ingest image they are copied into /app; from a checkout, import them in place.
+FLOWS_DIR = Path(__file__).resolve().parent.parent / "2. Workflow-orchestration" / "flows"
+if FLOWS_DIR.is_dir():
+    sys.path.append(str(FLOWS_DIR))
+
+from copy_loader import copy_arrow  # noqa: E402
+from download_cache import DownloadCache  # noqa: E402
+from taxi_schema import LayoutCache, conform, get_schema, schema_for_file  # noqa: E402
+from taxi_quality import (  # noqa: E402
+    LOAD_AUDIT_TABLE,
+    BatchQualityChecker,
+    QualityReport,
+    ensure_load_audit_table,
+    load_zone_ids,
+    read_load_audit,
+    record_load,
+    verify_row_count,
+)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (ru_maxrss is KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Resume state, one row per target table: the next row to load, as a row group
+# index and a row offset inside that row group of the source Parquet file.
+CHECKPOINT_TABLE = "ingest_checkpoints"
+
+
+@dataclass
+class Checkpoint:
+    table_name: str
+    source_sha256: str
+    row_group: int = 0
+    row_offset: int = 0
+    rows_loaded: int = 0
+    completed: bool = False
+    # Data-quality counters of the committed batches; stored in load_audit with every checkpoint
+    source_url: str = ""
+    quality: QualityReport = field(default_factory=QualityReport)
+
+    @property
+    def source_file(self):
+        return self.source_url.rsplit('/', 1)[-1]
+
+    @property
+    def partition(self):
+        """The month of the file ("YYYY-MM", like the Dagster loads), or its name without the month."""
+        month = re.search(r"\d{4}-\d{2}", self.source_file)
+        return month.group(0) if month else Path(self.source_file).stem
+
+
+class RowGroupIndex:
+    """Maps between absolute row numbers of a Parquet file and (row group, offset) positions."""
+
+    def __init__(self, metadata):
+        self.starts = [0]
+        for i in range(metadata.num_row_groups):
+            self.starts.append(self.starts[-1] + metadata.row_group(i).num_rows)
+
+    @property
+    def num_rows(self):
+        return self.starts[-1]
+
+    def row_number(self, row_group, row_offset):
+        return self.starts[row_group] + row_offset
+
+    def position(self, row_number):
+        """(row group, offset) of row_number; the end of a row group is the start of the next one."""
+        row_group = bisect.bisect_right(self.starts, row_number) - 1
+        return row_group, row_number - self.starts[row_group]
+
+
+def ensure_checkpoint_table(cur):
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} ("
+        "table_name text PRIMARY KEY, source_url text, source_sha256 text, "
+        "row_group integer NOT NULL, row_offset bigint NOT NULL, rows_loaded bigint NOT NULL, "
+        "completed boolean NOT NULL DEFAULT false, updated_at timestamptz NOT NULL DEFAULT now())"
+    )
+
+
+def read_checkpoint(cur, table_name, source_sha256):
+    """The saved checkpoint of table_name, or None if there is none, it is for another file version, or the table is gone."""
+    cur.execute(
+        f"SELECT source_sha256, row_group, row_offset, rows_loaded, completed FROM {CHECKPOINT_TABLE} "
+        "WHERE table_name = %s",
+        (table_name,),
+    )
+    row = cur.fetchone()
+    if row is None or row[0] != source_sha256:
+        return None
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f'"{table_name}"',))
+    if not cur.fetchone()[0]:
+        return None
+    return Checkpoint(table_name, *row)
+
+
+def save_checkpoint(cur, checkpoint):
+    """
+    Update the checkpoint and the load_audit row of the table inside the
+    caller's transaction (both commit with the rows they describe).
+    """
+    cur.execute(
+        f"UPDATE {CHECKPOINT_TABLE} SET row_group = %s, row_offset = %s, rows_loaded = %s, completed = %s, "
+        "updated_at = now() WHERE table_name = %s",
+        (checkpoint.row_group, checkpoint.row_offset, checkpoint.rows_loaded, checkpoint.completed,
+         checkpoint.table_name),
+    )
+    record_load(
+        cur, checkpoint.table_name, checkpoint.partition, checkpoint.rows_loaded, checkpoint.quality,
+        source=checkpoint.source_file,
+    )
+
+
+def create_table(cur, table_name, schema):
+    """(Re)create the table with the column types of the schema registry; nothing is inferred from the data."""
+    cur.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    cur.execute(f'CREATE TABLE "{table_name}" ({schema.column_defs()})')
+
+
+def start_or_resume(engine, table_name, schema, url, source_sha256, restart=False):
+    """
+    Return the checkpoint to continue from. Without a usable checkpoint (first
+    run, new file version, table dropped, or --restart) the table is recreated
+    and the checkpoint reset to row group 0 in the same transaction.
+    """
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            ensure_checkpoint_table(cur)
+            ensure_load_audit_table(cur)
+            # Two loaders of the same table never interleave their batches
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (table_name,))
+            checkpoint = None if restart else read_checkpoint(cur, table_name, source_sha256)
+            if checkpoint is None:
+                print(f"Creating table schema for '{table_name}'...")
+                create_table(cur, table_name, schema)
+                cur.execute(
+                    f"INSERT INTO {CHECKPOINT_TABLE} "
+                    "(table_name, source_url, source_sha256, row_group, row_offset, rows_loaded) "
+                    "VALUES (%s, %s, %s, 0, 0, 0) ON CONFLICT (table_name) DO UPDATE SET "
+                    "source_url = EXCLUDED.source_url, source_sha256 = EXCLUDED.source_sha256, row_group = 0, "
+                    "row_offset = 0, rows_loaded = 0, completed = false, updated_at = now()",
+                    (table_name, url, source_sha256),
+                )
+                # The audit rows of the dropped table no longer describe anything
+                cur.execute(f"DELETE FROM {LOAD_AUDIT_TABLE} WHERE table_name = %s", (table_name,))
+                checkpoint = Checkpoint(table_name, source_sha256, source_url=url)
+                save_checkpoint(cur, checkpoint)
+                print("Table schema created successfully.")
+            elif checkpoint.completed:
+                print(f"'{table_name}' already holds all {checkpoint.rows_loaded} rows of this file version.")
+            else:
+                print(
+                    f"Resuming '{table_name}' at row group {checkpoint.row_group}, offset {checkpoint.row_offset} "
+                    f"({checkpoint.rows_loaded} rows already committed)."
+                )
+            if not checkpoint.source_url:
+                # Resumed: continue the quality counters of the batches already committed
+                checkpoint.source_url = url
+                audit = read_load_audit(cur, table_name, checkpoint.partition)
+                if audit is not None:
+                    checkpoint.quality = audit[1]
+        conn.commit()
+    finally:
+        conn.close()
+    return checkpoint
+
+
+def copy_batch(conn, batch, schema, copy_format, checkpoint, index, checker):
+    """
+    Run the data-quality checks on one Arrow batch (already conformed to the registry schema),
+    insert it through COPY FROM STDIN, advance the checkpoint past it and commit both together.
+    """
+    end = index.row_number(checkpoint.row_group, checkpoint.row_offset) + batch.num_rows
+    checker.check(batch)
+    with conn.cursor() as cur:
+        copy_arrow(
+            cur, batch, checkpoint.table_name, [name.lower() for name in schema.column_names], fmt=copy_format
+        )
+        checkpoint.row_group, checkpoint.row_offset = index.position(end)
+        checkpoint.rows_loaded += batch.num_rows
+        checkpoint.completed = end >= index.num_rows
+        save_checkpoint(cur, checkpoint)
+    conn.commit()
+
+
+def mark_completed(conn, checkpoint):
+    """Flag the checkpoint as completed (files without rows never reach it through copy_batch)."""
+    if checkpoint.completed:
+        return
+    checkpoint.completed = True
+    with conn.cursor() as cur:
+        save_checkpoint(cur, checkpoint)
+    conn.commit()
+
+
+def ingest_full(engine, parquet_name, schema, layout, copy_format, checkpoint, chunksize=100000):
+    """Read the whole Parquet file into memory, then insert it in chunks from the checkpoint on."""
+    # Read parquet file
+    print(f"Reading parquet file: {parquet_name}...")
+    parquet_file = pq.ParquetFile(parquet_name)
+    index = RowGroupIndex(parquet_file.metadata)
+    table = conform(parquet_file.read(columns=list(layout.mapping)), schema, layout)
+    print("Parquet file read into an Arrow table.")
+
+    # Insert data into the table
+    print(f"Inserting data into table '{checkpoint.table_name}'...")
+    start = index.row_number(checkpoint.row_group, checkpoint.row_offset)
+    checker = BatchQualityChecker(schema, load_zone_ids(), checkpoint.quality)
+    conn = engine.raw_connection()
+    try:
+        for offset in range(start, table.num_rows, chunksize):
+            copy_batch(conn, table.slice(offset, chunksize), schema, copy_format, checkpoint, index, checker)
+        mark_completed(conn, checkpoint)
+    finally:
+        conn.close()
+    return table.num_rows - start
+
+
+def ingest_streaming(engine, parquet_name, schema, layout, batch_size, copy_format, checkpoint):
+    """
+    Read the Parquet file one record batch at a time, starting at the row group
+    of the checkpoint, and insert each batch as soon as it is read, so memory is
+    bounded by batch_size, not file size.
+    """
+    parquet_file = pq.ParquetFile(parquet_name)
+    index = RowGroupIndex(parquet_file.metadata)
+    print(
+        f"Streaming parquet file: {parquet_name} "
+        f"({parquet_file.metadata.num_rows} rows, {parquet_file.num_row_groups} row groups, "
+        f"batch size {batch_size})..."
+    )
+
+    print(f"Inserting data into table '{checkpoint.table_name}'...")
+    total_rows = 0
+    skip = checkpoint.row_offset  # rows of the first row group committed by an earlier run
+    checker = BatchQualityChecker(schema, load_zone_ids(), checkpoint.quality)
+    conn = engine.raw_connection()
+    try:
+        batches = parquet_file.iter_batches(
+            batch_size=batch_size,
+            row_groups=list(range(checkpoint.row_group, parquet_file.num_row_groups)),
+            columns=list(layout.mapping),
+        )
+        for batch_number, batch in enumerate(batches, start=1):
+            if skip:
+                batch, skip = batch.slice(min(skip, batch.num_rows)), max(skip - batch.num_rows, 0)
+                if batch.num_rows == 0:
+                    continue
+            batch_start = time()
+            copy_batch(conn, conform(batch, schema, layout), schema, copy_format, checkpoint, index, checker)
+            elapsed = time() - batch_start
+
+            total_rows += batch.num_rows
+            rows_per_sec = batch.num_rows / elapsed if elapsed > 0 else float('inf')
+            print(
+                f"Batch {batch_number}: {batch.num_rows} rows in {elapsed:.2f}s "
+                f"({rows_per_sec:,.0f} rows/s), total {total_rows}, "
+                f"checkpoint row group {checkpoint.row_group} offset {checkpoint.row_offset}, "
+                f"peak RSS {peak_rss_mb():.1f} MB"
+            )
+        mark_completed(conn, checkpoint)
+    finally:
+        conn.close()
+    return total_rows
+
+
+def verify_load(engine, checkpoint):
+    """
+    Compare the rows recorded in load_audit with pg_class.reltuples after an
+    ANALYZE of the table (a fixed-size sample, not a COUNT(*) over every row).
+    """
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            check = verify_row_count(
+                cur, f'"{checkpoint.table_name}"', checkpoint.rows_loaded, analyze=[f'"{checkpoint.table_name}"']
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    status = "OK" if check.matches else "MISMATCH"
+    print(f"Row count check {status}: {check.catalog_rows} rows in pg_class.reltuples, {check.audit_rows} loaded.")
+    print(f"Data quality: {checkpoint.quality.summary()}")
+    return check
+
 
 def main(params):
-    user = params.user
-    password = params.password
-    host = params.host 
-    port = params.port 
-    db = params.db
-    table_name = params.table_name
     url = params.url
-    
+
     print("Starting data ingestion process...")
 
-    if url.endswith('.parquet'):
-        csv_name = 'output.parquet'
-    else:
+    if not url.endswith('.parquet'):
         print("URL does not point to a parquet file. Exiting.")
         return
 
-    # Download the file
+    # Download the file (re-runs reuse the cached copy if the server says it is unchanged).
+    # The cached copy cannot be evicted by another process while it is being ingested.
     print(f"Downloading data from {url}...")
-    os.system(f"wget {url} -O {csv_name}")
-    print("Download complete.")
+    cache = DownloadCache(params.cache_dir, max_bytes=int(params.cache_max_gb * 1024**3))
+    with cache.use(url) as fetched:
+        print(f"Download complete ({fetched.status}, {fetched.bytes_downloaded} bytes downloaded, {fetched.size} bytes cached).")
+        ingest_file(params, fetched)
+
+
+def ingest_file(params, fetched):
+    """Load the cached parquet file `fetched` into params.table_name, resuming from its checkpoint."""
+    user = params.user
+    password = params.password
+    host = params.host
+    port = params.port
+    db = params.db
+    table_name = params.table_name
+    url = params.url
+    parquet_name = fetched.path
+
+    # Column types come from the schema registry; the file's column layout is
+    # resolved once per file version (sha256) and cached next to the downloads.
+    schema = get_schema(params.taxi) if params.taxi else schema_for_file(url.rsplit('/', 1)[-1])
+    layouts = LayoutCache(Path(params.cache_dir) / "layouts")
+    layout = layouts.get(schema, fetched.sha256, lambda: pq.read_schema(parquet_name).names)
+    if layout.missing or layout.extra:
+        print(f"Layout for {schema.name}: missing columns {layout.missing} (NULL), ignored columns {layout.extra}")
 
     # Create database engine
     print("Creating database engine...")
-    engine = create_engine(f'postgresql://{user}:{password}@{host}:{port}/{db}')
+    engine = create_engine(f'postgresql+psycopg2://{user}:{password}@{host}:{port}/{db}')
     print("Database engine created.")
 
-    # Read parquet file
-    print(f"Reading parquet file: {csv_name}...")
-    df = pd.read_parquet(csv_name)
-    print("Parquet file read into DataFrame.")
-
-    # Create table schema
-    print(f"Creating table schema for '{table_name}'...")
-    df.head(n=0).to_sql(name=table_name, con=engine, if_exists='replace')
-    print("Table schema created successfully.")
-
-    # Insert data into the table
-    print(f"Inserting data into table '{table_name}'...")
     start_time = time()
-    
+
     # Use a try-except block to catch potential errors during insertion
     try:
-        df.to_sql(name=table_name, con=engine, if_exists='append', chunksize=100000)
+        # Every batch commits together with its checkpoint: after a failure, the
+        # same command continues from the last committed batch.
+        checkpoint = start_or_resume(engine, table_name, schema, url, fetched.sha256 or "", params.restart)
+        if checkpoint.completed:
+            verify_load(engine, checkpoint)
+            return
+        if params.streaming:
+            total_rows = ingest_streaming(
+                engine, parquet_name, schema, layout, params.batch_size, params.copy_format, checkpoint
+            )
+        else:
+            total_rows = ingest_full(engine, parquet_name, schema, layout, params.copy_format, checkpoint)
         end_time = time()
-        print(f"Finished inserting data. Time taken: {end_time - start_time:.2f} seconds.")
+        elapsed = end_time - start_time
+        print(
+            f"Finished inserting data. Time taken: {elapsed:.2f} seconds "
+            f"({total_rows / elapsed if elapsed > 0 else 0:,.0f} rows/s, peak RSS {peak_rss_mb():.1f} MB)."
+        )
+        verify_load(engine, checkpoint)
     except Exception as e:
         print(f"An error occurred during data insertion: {e}")
+        print("Batches committed so far are kept; run the same command again to resume.")
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -68,7 +384,14 @@ if __name__ == '__main__':
     parser.add_argument('--db', required=True, help='database name for postgres')
     parser.add_argument('--table_name', required=True, help='name of the table where we will write the results to')
     parser.add_argument('--url', required=True, help='url of the parquet file')
+    parser.add_argument('--taxi', choices=['green', 'yellow', 'fhv'], help='schema of the file (default: from the file name prefix)')
+    parser.add_argument('--streaming', action='store_true', help='read and insert the parquet file one record batch at a time')
+    parser.add_argument('--batch_size', type=int, default=100000, help='rows per record batch in streaming mode')
+    parser.add_argument('--cache_dir', default='download_cache', help='directory of the local download cache')
+    parser.add_argument('--cache_max_gb', type=float, default=10, help='size cap of the download cache (least recently used files are evicted)')
+    parser.add_argument('--copy_format', choices=['csv', 'binary'], default='csv', help='COPY FROM STDIN format used to insert each batch')
+    parser.add_argument('--restart', action='store_true', help=f'ignore the checkpoint in {CHECKPOINT_TABLE} and reload the table from scratch')
 
     args = parser.parse_args()
 
-    main(args)
\ No newline at end of file
+    main(args)
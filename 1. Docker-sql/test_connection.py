@@ -1,6 +1,9 @@
 import pandas as pd
 from sqlalchemy import create_engine, text
 
+from ingest_data import FLOWS_DIR  # noqa: F401  (makes taxi_quality importable)
+from taxi_quality import LOAD_AUDIT_TABLE, QualityReport, RowCountCheck, catalog_row_estimate
+
 # --- Database Connection Details ---
 # Make sure these match your docker-compose.yml settings
 user = 'pipeline_user'
@@ -12,8 +15,10 @@ table_name = 'green_taxi_trips'
 
 def test_database_connection():
     """
-    Connects to the PostgreSQL database, checks for the table,
-    and counts the number of rows.
+    Connects to the PostgreSQL database, checks for the table, and compares
+    the row count recorded by ingest_data.py (load_audit) with the planner's
+    estimate in pg_class.reltuples. Nothing scans the table, so the test takes
+    the same time however many rows were loaded.
     """
     print("--- Starting Database Connection Test ---")
     try:
@@ -41,13 +46,25 @@ def test_database_connection():
 
             print(f"✅ Table '{table_name}' found.")
             
-            # Query to count the number of rows
-            query_count = text(f"SELECT COUNT(1) FROM {table_name};")
-            result_count = connection.execute(query_count)
-            row_count = result_count.scalar()
-            
-            print(f"📊 Number of rows in table '{table_name}': {row_count}")
+            # Row counts come from the catalog and the load audit, not from COUNT(*)
+            cursor = connection.connection.cursor()
+            catalog_rows = catalog_row_estimate(cursor, f'"{table_name}"')
+            audit_exists = connection.execute(text(f"SELECT to_regclass('{LOAD_AUDIT_TABLE}') IS NOT NULL")).scalar()
+            audit = connection.execute(
+                text(f"SELECT partition, row_count, quality FROM {LOAD_AUDIT_TABLE} WHERE table_name = :table"),
+                {"table": table_name},
+            ).fetchall() if audit_exists else []
+            audit_rows = sum(row_count for _, row_count, _ in audit) if audit else None
+
+            print(f"📊 Rows in table '{table_name}': {catalog_rows} (pg_class.reltuples), {audit_rows} (load_audit)")
+            for partition, _, quality in audit:
+                print(f"   {partition}: {QualityReport.from_dict(quality).summary()}")
+            if catalog_rows is None:
+                print("   -> The table has never been analyzed; run ANALYZE to refresh the estimate.")
+            elif audit_rows is not None and not RowCountCheck(table_name, audit_rows, catalog_rows).matches:
+                print("⚠️ The catalog estimate and load_audit disagree; the table may have changed after the load.")
 
+            row_count = audit_rows if audit_rows is not None else catalog_rows or 0
             if row_count > 0:
                 print("\n🎉 TEST SUCCESSFUL: Data has been loaded into the table.")
             else:
@@ -0,0 +1,111 @@
+"""
+So sánh hai cách gán unique_row_id/filename khi nạp một tháng taxi:
+
+- before: staging -> UPDATE toàn bộ staging -> INSERT ... SELECT *
+- after:  staging -> INSERT ... SELECT md5(...), filename, ... (một lần ghi)
+
+    python bench_row_hash.py --taxi yellow --file yellow_tripdata_2021-01.csv.gz
+
+Dùng các biến môi trường POSTGRES_* giống job Dagster. Mọi thứ chạy trong
+một transaction và được ROLLBACK ở cuối, database không bị thay đổi.
+"""
+import argparse
+import gzip
+import os
+import time
+from pathlib import Path
+
+import psycopg2
+
+from postgres_taxi import load_taxi_file
+from taxi_schema import get_schema
+
+
+class _PrintLog:
+    def info(self, msg):
+        print(msg)
+
+    def warning(self, msg):
+        print(f"WARNING: {msg}")
+
+
+def _timed(cursor, sql, params=None):
+    started = time.perf_counter()
+    cursor.execute(sql, params)
+    return time.perf_counter() - started, cursor.rowcount
+
+
+def main(params):
+    taxi = params.taxi
+    schema = get_schema(taxi)
+    # Cùng biểu thức hash với câu merge của pipeline
+    hash_expr = schema.row_hash_sql()
+    filename = Path(params.file).name.removesuffix(".gz")
+    table_name = f"public.{taxi}_tripdata"
+
+    conn = psycopg2.connect(
+        host=os.environ["POSTGRES_HOST"],
+        port=os.environ.get("POSTGRES_PORT", "5432"),
+        dbname=os.environ["POSTGRES_DB"],
+        user=os.environ["POSTGRES_USER"],
+        password=os.environ["POSTGRES_PASSWORD"],
+    )
+    results = {}
+    try:
+        with conn.cursor() as cur:
+            # Nạp tháng bằng chính code của pipeline; các dòng của tháng (lọc theo
+            # filename) sau đó được chép vào staging riêng của từng chiến lược.
+            # Bỏ kiểm tra chất lượng, load_audit và ANALYZE: chúng không thuộc
+            # phần được so sánh.
+            opener = gzip.open if params.file.endswith(".gz") else open
+            with opener(params.file, "rb") as stream:
+                load_taxi_file(conn, taxi, Path(filename), _PrintLog(), stream=stream, verify=False)
+
+            columns = ",".join(schema.column_names)
+
+            for strategy in ("before", "after"):
+                target = f"bench_{taxi}_{strategy}"
+                scratch = f"bench_{taxi}_staging_{strategy}"
+                cur.execute(f"CREATE TABLE {target} (LIKE {table_name} INCLUDING ALL)")
+                cur.execute(f"CREATE TABLE {scratch} (LIKE {table_name})")
+                cur.execute(f"ALTER TABLE {scratch} ALTER COLUMN unique_row_id DROP NOT NULL")
+                cur.execute(
+                    f"INSERT INTO {scratch} ({columns}) SELECT {columns} FROM {table_name} WHERE filename = %s",
+                    (filename,),
+                )
+
+                update_seconds, updated = 0.0, 0
+                if strategy == "before":
+                    update_seconds, updated = _timed(
+                        cur, f"UPDATE {scratch} SET unique_row_id = {hash_expr}, filename = %s", (filename,)
+                    )
+                    merge_seconds, merged = _timed(
+                        cur, f"INSERT INTO {target} SELECT * FROM {scratch} ON CONFLICT (unique_row_id) DO NOTHING"
+                    )
+                else:
+                    merge_seconds, merged = _timed(
+                        cur,
+                        f"INSERT INTO {target} (unique_row_id, filename, {columns}) "
+                        f"SELECT {hash_expr}, %s, {columns} FROM {scratch} "
+                        "ON CONFLICT (unique_row_id) DO NOTHING",
+                        (filename,),
+                    )
+                results[strategy] = (update_seconds, merge_seconds, updated, merged)
+    finally:
+        conn.rollback()
+        conn.close()
+
+    print(f"\n{filename}")
+    print(f"{'strategy':<8} {'update (s)':>10} {'merge (s)':>10} {'total (s)':>10} {'rows rewritten':>15} {'rows merged':>12}")
+    for strategy, (update_seconds, merge_seconds, updated, merged) in results.items():
+        print(
+            f"{strategy:<8} {update_seconds:>10.2f} {merge_seconds:>10.2f} "
+            f"{update_seconds + merge_seconds:>10.2f} {updated:>15} {merged:>12}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Before/after timing of the unique_row_id computation")
+    parser.add_argument("--taxi", choices=["green", "yellow"], default="yellow")
+    parser.add_argument("--file", required=True, help="month file (.csv or .csv.gz) in the DataTalksClub layout")
+    main(parser.parse_args())
@@ -0,0 +1,183 @@
+"""
+IO manager lưu output của op/asset dạng cột thay vì pickle.
+
+- DataFrame pandas và list các bản ghi (dict) được ghi thành Arrow IPC
+  (mặc định) hoặc Parquet (`file_format="parquet"`), đọc lại bằng memory map:
+  op phía sau không phải unpickle toàn bộ object.
+- Nội dung được lưu một lần trong kho `objects/<sha256>.<ext>` (khóa theo hash
+  nội dung). Mỗi output chỉ là một file con trỏ JSON nhỏ, nên cùng một kết quả
+  sinh lại ở run sau (hoặc ở partition khác) không chiếm thêm dung lượng.
+- Đường dẫn con trỏ theo partition:
+  `runs/<run_id>/<step_key>/<output>[/<mapping_key>|<partition>].json` cho op,
+  `assets/<asset_key>/<partition>.json` cho asset.
+- Object không chuyển được sang Arrow (kiểu lẫn lộn, Path, None, ...) vẫn được
+  pickle, nhưng cũng đi qua kho khóa theo hash.
+
+List bản ghi có khóa không đồng đều (vd. sản phẩm không có `brand`) vẫn lưu
+dạng cột: cột nào thiếu ở một số bản ghi có thêm cột ẩn `__present__<tên>`,
+để khi đọc lại bản ghi đó không có khóa thay vì có giá trị None. List chỉ
+được lưu dạng cột khi đọc lại giống hệt list gốc, kể cả kiểu Python của từng
+giá trị: Arrow đổi một cột lẫn int và float thành float, tuple thành list, ...
+nên những list như vậy được pickle.
+"""
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dagster import ConfigurableIOManager, InputContext, MetadataValue, OutputContext
+
+PRESENT_PREFIX = "__present__"
+EXTENSIONS = {"arrow": ".arrow", "parquet": ".parquet", "pickle": ".pkl"}
+
+
+# =====================================================================================
+# CHUYỂN ĐỔI - DataFrame / list bản ghi <-> Arrow Table
+# =====================================================================================
+def records_to_table(records: list) -> pa.Table:
+    """List các dict -> Table; khóa vắng mặt ở một số bản ghi được đánh dấu bằng cột __present__."""
+    # Table.from_pylist chỉ lấy khóa của bản ghi đầu tiên: gom khóa của mọi bản ghi
+    columns = list(dict.fromkeys(key for record in records for key in record))
+    table = pa.table({key: pa.array([record.get(key) for record in records]) for key in columns})
+    sparse = [key for key in columns if any(key not in record for record in records)]
+    for key in sparse:
+        table = table.append_column(
+            PRESENT_PREFIX + key, pa.array([key in record for record in records], pa.bool_())
+        )
+    return table
+
+
+def table_to_records(table: pa.Table) -> list:
+    masks = {name[len(PRESENT_PREFIX):]: table.column(name).to_pylist()
+             for name in table.column_names if name.startswith(PRESENT_PREFIX)}
+    records = table.drop_columns([PRESENT_PREFIX + key for key in masks]).to_pylist()
+    for key, present in masks.items():
+        for record, is_present in zip(records, present):
+            if not is_present:
+                del record[key]
+    return records
+
+
+def _identical(a, b) -> bool:
+    """So sánh như ==, nhưng kiểu của từng giá trị (kể cả lồng nhau) cũng phải giống."""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_identical(value, b[key]) for key, value in a.items())
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_identical(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) and a != a:
+        return b != b  # NaN
+    return a == b
+
+
+def to_arrow(obj):
+    """(kind, Table) nếu obj lưu được dạng cột, ngược lại (None, None)."""
+    try:
+        if isinstance(obj, pd.DataFrame):
+            return "dataframe", pa.Table.from_pandas(obj)
+        if isinstance(obj, list) and all(isinstance(record, dict) for record in obj):
+            table = records_to_table(obj)
+            if _identical(table_to_records(table), obj):
+                return "records", table
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, TypeError):
+        pass
+    return None, None
+
+
+def from_arrow(kind: str, table: pa.Table):
+    return table.to_pandas() if kind == "dataframe" else table_to_records(table)
+
+
+# =====================================================================================
+# IO MANAGER
+# =====================================================================================
+class ColumnarIOManager(ConfigurableIOManager):
+    """Output dạng Arrow/Parquet đọc bằng mmap, kho object khóa theo hash nội dung."""
+    base_dir: Optional[str] = None  # mặc định $DAGSTER_HOME/storage/columnar
+    file_format: str = "arrow"  # "arrow" (IPC, đọc zero-copy) hoặc "parquet" (nén zstd)
+
+    @property
+    def _root(self) -> Path:
+        return Path(self.base_dir) if self.base_dir else Path(os.environ["DAGSTER_HOME"]) / "storage" / "columnar"
+
+    def _pointer_path(self, context: OutputContext) -> Path:
+        if context.has_asset_key:
+            partition = context.partition_key if context.has_partition_key else "__all__"
+            return self._root.joinpath("assets", *context.asset_key.path, f"{partition}.json")
+        *parts, last = context.get_identifier()
+        return self._root.joinpath("runs", *parts, f"{last}.json")
+
+    # ----------------------------------------------------------------- write
+    def _write_object(self, kind: str, table: Optional[pa.Table], obj) -> tuple:
+        """Ghi vào kho objects; trả về (tên object, sha256, số byte, đã tồn tại hay chưa)."""
+        objects_dir = self._root / "objects"
+        objects_dir.mkdir(parents=True, exist_ok=True)
+        storage = "pickle" if table is None else self.file_format
+        tmp = objects_dir / f".tmp-{os.getpid()}-{id(obj)}{EXTENSIONS[storage]}"
+        if storage == "arrow":
+            with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        elif storage == "parquet":
+            pq.write_table(table, tmp, compression="zstd")
+        else:
+            with open(tmp, "wb") as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        digest = hashlib.sha256(kind.encode())
+        with open(tmp, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        name = f"{sha256}{EXTENSIONS[storage]}"
+        size = tmp.stat().st_size
+        existed = (objects_dir / name).exists()
+        if existed:
+            tmp.unlink()
+        else:
+            tmp.replace(objects_dir / name)
+        return name, sha256, size, existed
+
+    def handle_output(self, context: OutputContext, obj) -> None:
+        kind, table = to_arrow(obj)
+        name, sha256, size, existed = self._write_object(kind or "pickle", table, obj)
+
+        pointer = self._pointer_path(context)
+        pointer.parent.mkdir(parents=True, exist_ok=True)
+        tmp = pointer.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"object": name, "kind": kind or "pickle"}))
+        tmp.replace(pointer)
+
+        metadata = {
+            "path": MetadataValue.path(str(pointer)),
+            "object": name,
+            "content_hash": sha256,
+            "bytes": size,
+            "deduplicated": existed,
+            "storage": kind or "pickle",
+        }
+        if table is not None:
+            metadata["rows"] = table.num_rows
+        context.add_output_metadata(metadata)
+
+    # ------------------------------------------------------------------ read
+    def load_input(self, context: InputContext):
+        pointer = json.loads(self._pointer_path(context.upstream_output).read_text())
+        path = self._root / "objects" / pointer["object"]
+        if pointer["kind"] == "pickle":
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        if path.suffix == ".parquet":
+            table = pq.read_table(path, memory_map=True)
+        else:
+            # Buffer của table trỏ thẳng vào vùng mmap, không copy khi đọc
+            table = pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+        return from_arrow(pointer["kind"], table)
+
+
+columnar_io_manager = ColumnarIOManager()
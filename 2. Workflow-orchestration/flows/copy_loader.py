@@ -0,0 +1,282 @@
+"""
+Bulk loader dùng `COPY ... FROM STDIN` của PostgreSQL.
+
+DataFrame (pandas) hoặc RecordBatch/Table (Arrow) được serialize thành một
+buffer CSV hoặc binary COPY ngay trong bộ nhớ rồi stream thẳng qua
+`cursor.copy_expert`, không bao giờ ghi ra file tạm.
+
+Module này được dùng chung bởi các flow Dagster và các script trong
+`1. Docker-sql` (ingest_data.py, etl/etl.py).
+"""
+import io
+import struct
+
+import numpy as np
+from psycopg2 import sql
+
+# Header và trailer của định dạng binary COPY
+# (https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4)
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+
+# Số microsecond giữa 1970-01-01 (epoch của numpy) và 2000-01-01 (epoch của Postgres)
+_PG_EPOCH_OFFSET_US = 946_684_800_000_000
+
+# dtype numpy -> (kiểu Postgres, định dạng big-endian trong binary COPY)
+# Khớp với kiểu mà `DataFrame.to_sql` tạo ra cho cùng dtype.
+_FIXED_WIDTH_TYPES = {
+    "bool": ("boolean", "?"),
+    "int16": ("smallint", ">i2"),
+    "int32": ("integer", ">i4"),
+    "int64": ("bigint", ">i8"),
+    "float32": ("real", ">f4"),
+    "float64": ("double precision", ">f8"),
+}
+_TIMESTAMP_TYPE = ("timestamp", ">i8")
+_NULL_FIELD = struct.pack(">i", -1)
+
+
+def _table_identifier(table):
+    """'schema.table' hoặc 'table' -> sql.Identifier đã được quote."""
+    return sql.Identifier(*table.split("."))
+
+
+def copy_statement(table, columns, fmt="csv", header=False):
+    """Sinh câu lệnh `COPY table (cols) FROM STDIN` cho định dạng csv/binary."""
+    if fmt not in ("csv", "binary"):
+        raise ValueError(f"Unsupported COPY format: {fmt}")
+    options = [sql.SQL("FORMAT {}").format(sql.SQL(fmt))]
+    if header and fmt == "csv":
+        options.append(sql.SQL("HEADER true"))
+    column_list = sql.SQL("")
+    if columns:
+        column_list = sql.SQL(" ({})").format(sql.SQL(", ").join(map(sql.Identifier, columns)))
+    return sql.SQL("COPY {}{} FROM STDIN WITH ({})").format(
+        _table_identifier(table), column_list, sql.SQL(", ").join(options)
+    )
+
+
+def copy_stream(cursor, table, columns, fileobj, fmt="csv", header=False):
+    """
+    Stream một file-like object (text hoặc bytes) qua COPY FROM STDIN.
+    Trả về số dòng Postgres báo đã nạp.
+    """
+    cursor.copy_expert(copy_statement(table, columns, fmt, header).as_string(cursor), fileobj)
+    return cursor.rowcount
+
+
+# =====================================================================================
+# SERIALIZE - DataFrame / Arrow -> buffer trong bộ nhớ
+# =====================================================================================
+def _frame_with_index(df, index):
+    if not index:
+        return df
+    return df.reset_index(names=df.index.name or "index")
+
+
+def dataframe_to_csv_buffer(df):
+    """DataFrame -> buffer CSV không header; NULL được ghi thành trường rỗng."""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep="")
+    buffer.seek(0)
+    return buffer
+
+
+def arrow_to_csv_buffer(data):
+    """RecordBatch/Table -> buffer CSV, serialize bằng writer C++ của pyarrow."""
+    import pyarrow.csv as pa_csv
+
+    buffer = io.BytesIO()
+    pa_csv.write_csv(data, buffer, write_options=pa_csv.WriteOptions(include_header=False))
+    buffer.seek(0)
+    return buffer
+
+
+def _binary_type(dtype):
+    """dtype -> (kiểu Postgres, định dạng numpy); cột không cố định độ rộng là text."""
+    if isinstance(dtype, np.dtype) and np.issubdtype(dtype, np.datetime64):
+        return _TIMESTAMP_TYPE
+    return _FIXED_WIDTH_TYPES.get(str(dtype), ("text", None))
+
+
+def _fixed_width_values(series, fmt):
+    values = series.to_numpy()
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype("datetime64[us]").view("i8") - _PG_EPOCH_OFFSET_US
+    return values.astype(np.dtype(fmt), copy=False)
+
+
+def _encode_cells(series):
+    """Mã hóa từng ô của một cột thành bytes (độ dài + giá trị) cho binary COPY."""
+    fmt = _binary_type(series.dtype)[1]
+    nulls = series.isna().to_numpy()
+    if fmt is not None:
+        width = np.dtype(fmt).itemsize
+        cells = np.empty(len(series), dtype=[("len", ">i4"), ("value", fmt)])
+        cells["len"] = width
+        cells["value"] = 0
+        cells["value"][~nulls] = _fixed_width_values(series[~nulls], fmt)
+        raw = cells.tobytes()
+        step = 4 + width
+        encoded = [raw[i:i + step] for i in range(0, len(raw), step)]
+    else:
+        encoded = []
+        for value in series.to_numpy(dtype=object):
+            data = str(value).encode("utf-8")
+            encoded.append(struct.pack(">i", len(data)) + data)
+    for position in np.flatnonzero(nulls):
+        encoded[position] = _NULL_FIELD
+    return encoded
+
+
+def dataframe_to_binary_buffer(df):
+    """
+    DataFrame -> buffer binary COPY.
+
+    Nếu mọi cột đều có độ rộng cố định và không có NULL, cả frame được đóng gói
+    một lần bằng một structured array của numpy. Ngược lại, từng ô được mã hóa
+    theo cột rồi ghép theo dòng.
+    """
+    buffer = io.BytesIO()
+    buffer.write(PGCOPY_HEADER)
+    n_fields = struct.pack(">h", len(df.columns))
+
+    fixed = [_binary_type(dtype)[1] for dtype in df.dtypes]
+    if len(df) and all(fixed) and not df.isna().to_numpy().any():
+        layout = [("n_fields", ">i2")]
+        for position, fmt in enumerate(fixed):
+            layout += [(f"len_{position}", ">i4"), (f"value_{position}", fmt)]
+        rows = np.empty(len(df), dtype=layout)
+        rows["n_fields"] = len(df.columns)
+        for position, (column, fmt) in enumerate(zip(df.columns, fixed)):
+            rows[f"len_{position}"] = np.dtype(fmt).itemsize
+            rows[f"value_{position}"] = _fixed_width_values(df[column], fmt)
+        buffer.write(rows.tobytes())
+    else:
+        columns = [_encode_cells(df[column]) for column in df.columns]
+        for cells in zip(*columns):
+            buffer.write(n_fields)
+            buffer.write(b"".join(cells))
+
+    buffer.write(PGCOPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+
+# =====================================================================================
+# SERIALIZE - Arrow -> binary COPY (vector hóa bằng numpy)
+# =====================================================================================
+def _arrow_binary_type(arrow_type):
+    """Kiểu Arrow -> (kiểu Postgres, định dạng numpy); kiểu khác được gửi dưới dạng text."""
+    import pyarrow as pa
+
+    if pa.types.is_timestamp(arrow_type):
+        return _TIMESTAMP_TYPE
+    if pa.types.is_boolean(arrow_type):
+        return _FIXED_WIDTH_TYPES["bool"]
+    if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type):
+        return _FIXED_WIDTH_TYPES.get(np.dtype(arrow_type.to_pandas_dtype()).name, ("text", None))
+    return ("text", None)
+
+
+def _arrow_payload(array):
+    """
+    Một cột Arrow -> (bytes giá trị của các ô khác NULL nối liền, độ dài từng ô,
+    mặt nạ NULL). Ô NULL có độ dài 0 trong payload.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    nulls = array.is_null().to_numpy(zero_copy_only=False)
+    fmt = _arrow_binary_type(array.type)[1]
+    if fmt is not None:
+        if pa.types.is_timestamp(array.type):
+            values = pc.fill_null(array.cast(pa.timestamp("us")).cast(pa.int64()), 0).to_numpy()
+            values = values - _PG_EPOCH_OFFSET_US
+        else:
+            values = pc.fill_null(array, False if pa.types.is_boolean(array.type) else 0)
+            values = values.to_numpy(zero_copy_only=False)
+        width = np.dtype(fmt).itemsize
+        packed = values.astype(np.dtype(fmt), copy=False).view(np.uint8).reshape(len(array), width)
+        return packed[~nulls].ravel(), np.where(nulls, 0, width), nulls
+
+    # Text: dùng thẳng buffer offsets/data của large_string
+    strings = array.cast(pa.large_string())
+    _, offsets_buffer, data_buffer = strings.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=np.int64)[strings.offset:strings.offset + len(strings) + 1]
+    data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer is not None else np.empty(0, np.uint8)
+    return data[offsets[0]:offsets[-1]], np.diff(offsets), nulls
+
+
+def arrow_to_binary_buffer(data):
+    """
+    RecordBatch/Table -> buffer binary COPY.
+
+    Mỗi cột được mã hóa một lần thành payload liền mạch; vị trí của từng ô trong
+    buffer kết quả được tính bằng cumsum, rồi payload được rải vào đúng chỗ
+    bằng một phép gán theo chỉ số của numpy, không có vòng lặp theo dòng.
+    """
+    n_rows = data.num_rows
+    columns = [_arrow_payload(column) for column in data.columns]
+    row_sizes = np.full(n_rows, 2, dtype=np.int64)
+    for _, lengths, _ in columns:
+        row_sizes += 4 + lengths
+    row_starts = np.cumsum(row_sizes) - row_sizes
+
+    out = np.empty(int(row_sizes.sum()), dtype=np.uint8)
+    n_fields = np.frombuffer(struct.pack(">h", len(columns)), dtype=np.uint8)
+    out[row_starts[:, None] + np.arange(2)] = n_fields
+    position = row_starts + 2
+    for payload, lengths, nulls in columns:
+        prefix = np.where(nulls, -1, lengths).astype(">i4").view(np.uint8).reshape(n_rows, 4)
+        out[position[:, None] + np.arange(4)] = prefix
+        position = position + 4
+        if len(payload):
+            source_starts = np.cumsum(lengths) - lengths
+            out[np.repeat(position - source_starts, lengths) + np.arange(len(payload))] = payload
+        position = position + lengths
+
+    buffer = io.BytesIO()
+    buffer.write(PGCOPY_HEADER)
+    buffer.write(out.tobytes())
+    buffer.write(PGCOPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+
+# =====================================================================================
+# LOAD - API chính
+# =====================================================================================
+def copy_dataframe(cursor, df, table, columns=None, fmt="csv", index=False):
+    """
+    Nạp một DataFrame vào `table` bằng COPY FROM STDIN.
+
+    `columns` là tên cột trong bảng đích (mặc định: tên cột của DataFrame).
+    Với `fmt="binary"`, kiểu cột trong bảng phải khớp dtype của DataFrame
+    (xem _FIXED_WIDTH_TYPES; cột khác được gửi dưới dạng text).
+    Trả về số dòng đã nạp.
+    """
+    df = _frame_with_index(df, index)
+    columns = list(columns) if columns is not None else [str(c) for c in df.columns]
+    if fmt == "binary":
+        buffer = dataframe_to_binary_buffer(df)
+    else:
+        buffer = dataframe_to_csv_buffer(df)
+    return copy_stream(cursor, table, columns, buffer, fmt=fmt)
+
+
+def copy_arrow(cursor, data, table, columns=None, fmt="csv"):
+    """
+    Nạp một Arrow RecordBatch/Table vào `table` bằng COPY FROM STDIN.
+
+    Với `fmt="binary"`, buffer được dựng trực tiếp từ các buffer Arrow (không
+    qua pandas) và kiểu cột trong bảng phải khớp kiểu Arrow (xem _arrow_binary_type).
+    """
+    columns = list(columns) if columns is not None else list(data.schema.names)
+    if fmt == "binary":
+        buffer = arrow_to_binary_buffer(data)
+    else:
+        buffer = arrow_to_csv_buffer(data)
+    return copy_stream(cursor, table, columns, buffer, fmt=fmt)
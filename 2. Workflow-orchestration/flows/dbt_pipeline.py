@@ -1,13 +1,21 @@
 # dbt_pipeline.py
 
+import hashlib
+import json
 import os
+import shutil
 from pathlib import Path
+from typing import List, Sequence
 
-from dagster import Config, OpExecutionContext, job, op
+from dagster import Config, Failure, MetadataValue, OpExecutionContext, job, op
 from dagster_dbt import DbtCliResource
 
 # Trỏ đến thư mục dự án dbt mà bạn đã copy vào ở bước chuẩn bị
 dbt_project_dir = Path(__file__).resolve().parent / "dbt_project"
+# Manifest của lần build/run thành công gần nhất, dùng cho selector `state:modified+`
+dbt_state_dir = dbt_project_dir / "state"
+# Hash của packages.yml + package-lock.yml ứng với dbt_packages/ đang cài
+deps_stamp_path = dbt_project_dir / "dbt_packages" / ".deps_stamp"
 
 # =============================================================================
 # CONFIGURATION - Tương đương mục `inputs` của Kestra
@@ -15,6 +23,151 @@ dbt_project_dir = Path(__file__).resolve().parent / "dbt_project"
 class DbtConfig(Config):
     # Cho phép người dùng chọn lệnh, mặc định là "build"
     dbt_command: str = "build"
+    # Các tháng pickup ("YYYY-MM") vừa được nạp lại; fact_trips và
+    # dm_monthly_zone_revenue (incremental) chỉ tính lại các tháng này.
+    # Để trống: các model incremental tự tính lại từ tháng mới nhất đã có.
+    changed_months: List[str] = []
+    # Biến dbt `is_test_run`: true thì model staging chỉ lấy 100 dòng mỗi lần chạy
+    # (mặc định của dbt project, để thử nhanh); đặt false để nạp đủ dữ liệu
+    is_test_run: bool = True
+    # Selector dbt, vd. "source:staging.green_tripdata+" (để trống = cả project)
+    select: str = ""
+    # Thêm `state:modified+` so với manifest của lần chạy thành công trước
+    state_modified: bool = False
+    # Số thread dbt (0 = theo profiles.yml)
+    threads: int = 0
+    # Luôn chạy `dbt deps`, kể cả khi package không đổi
+    force_deps: bool = False
+
+
+# =============================================================================
+# HELPERS
+# =============================================================================
+def packages_hash() -> str:
+    digest = hashlib.sha256()
+    for name in ("packages.yml", "package-lock.yml"):
+        path = dbt_project_dir / name
+        digest.update(name.encode())
+        if path.exists():
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def deps_up_to_date() -> bool:
+    """dbt_packages/ đã được cài từ đúng packages.yml/package-lock.yml hiện tại."""
+    return deps_stamp_path.exists() and deps_stamp_path.read_text().strip() == packages_hash()
+
+
+def model_timings(run_results: dict) -> List[dict]:
+    """Thời gian chạy của từng node trong run_results.json, chậm nhất trước."""
+    timings = []
+    for result in run_results.get("results", []):
+        timings.append({
+            "node": result["unique_id"],
+            "status": result.get("status"),
+            "seconds": round(result.get("execution_time") or 0.0, 2),
+            "rows_affected": (result.get("adapter_response") or {}).get("rows_affected"),
+        })
+    return sorted(timings, key=lambda t: t["seconds"], reverse=True)
+
+
+def timings_to_markdown(timings: List[dict]) -> str:
+    lines = ["| node | status | seconds | rows affected |", "|---|---|---|---|"]
+    for t in timings:
+        rows = "" if t["rows_affected"] is None else t["rows_affected"]
+        lines.append(f"| {t['node']} | {t['status']} | {t['seconds']:.2f} | {rows} |")
+    return "\n".join(lines)
+
+
+def run_dbt(
+    context,
+    dbt: DbtCliResource,
+    dbt_command: str = "build",
+    select: str = "",
+    changed_months: Sequence[str] = (),
+    is_test_run: bool = True,
+    state_modified: bool = False,
+    threads: int = 0,
+    force_deps: bool = False,
+) -> dict:
+    """
+    Chạy `dbt deps` (chỉ khi package thay đổi) rồi `dbt <dbt_command>`, giới
+    hạn vào phần đồ thị được chọn. Trả về metadata (thời gian của từng model
+    trong run_results.json); raise Failure kèm metadata nếu dbt lỗi.
+
+    Dùng chung cho `dbt_cli_op` và các asset dbt trong taxi_assets.py.
+    """
+    # Asset không phải @dbt_assets: không truyền context để dagster-dbt không
+    # đi tìm manifest của asset
+    cli_context = None if context.has_assets_def else context
+
+    # 1. Chạy `dbt deps` để cài đặt các package cần thiết
+    if force_deps or not deps_up_to_date():
+        context.log.info("Running `dbt deps`...")
+        deps_invocation = dbt.cli(["deps"], context=cli_context)
+        deps_invocation.wait()
+        deps_stamp_path.parent.mkdir(parents=True, exist_ok=True)
+        deps_stamp_path.write_text(packages_hash())
+        context.log.info("`dbt deps` finished.")
+    else:
+        context.log.info("Skipping `dbt deps`: packages.yml and package-lock.yml are unchanged.")
+
+    # 2. Chạy lệnh chính (ví dụ: "build", "debug")
+    dbt_args = dbt_command.split()
+    selectors = select.split()
+    if state_modified:
+        if (dbt_state_dir / "manifest.json").exists():
+            selectors.append("state:modified+")
+            dbt_args += ["--state", os.fspath(dbt_state_dir)]
+        elif selectors:
+            context.log.info("No saved dbt state yet; running the explicit selection only.")
+        else:
+            context.log.info("No saved dbt state yet; running the whole project.")
+    if selectors:
+        dbt_args += ["--select", " ".join(selectors)]
+    if threads:
+        dbt_args += ["--threads", str(threads)]
+    dbt_vars = {"is_test_run": is_test_run}
+    if changed_months:
+        context.log.info(f"Incremental models limited to months: {', '.join(changed_months)}")
+        dbt_vars["changed_months"] = list(changed_months)
+    if is_test_run:
+        context.log.info("is_test_run=true: staging models keep only 100 rows per run")
+    dbt_args += ["--vars", json.dumps(dbt_vars)]
+    context.log.info(f"Running `dbt {' '.join(dbt_args)}`...")
+
+    # Khởi chạy lệnh chính của dbt và chờ hoàn tất
+    run_invocation = dbt.cli(dbt_args, context=cli_context, raise_on_error=False)
+    run_invocation.wait()
+
+    metadata = {"dbt_args": " ".join(dbt_args)}
+    try:
+        run_results = run_invocation.get_artifact("run_results.json")
+    except FileNotFoundError:
+        run_results = None  # vd. `dbt debug` không sinh run_results.json
+    if run_results:
+        timings = model_timings(run_results)
+        metadata.update({
+            "dbt_elapsed_seconds": round(run_results.get("elapsed_time", 0.0), 2),
+            "dbt_nodes": len(timings),
+            "dbt_nodes_failed": sum(t["status"] in ("error", "fail") for t in timings),
+            "dbt_model_timings": MetadataValue.md(timings_to_markdown(timings)),
+        })
+        for t in timings[:5]:
+            context.log.info(f"{t['node']}: {t['seconds']:.2f}s ({t['status']})")
+
+    if not run_invocation.is_successful():
+        raise Failure(f"`dbt {dbt_command}` failed", metadata=metadata)
+
+    # Lưu manifest làm mốc cho lần chạy `state:modified+` tiếp theo
+    manifest_path = run_invocation.target_path / "manifest.json"
+    if dbt_args[0] in ("build", "run") and manifest_path.exists():
+        dbt_state_dir.mkdir(exist_ok=True)
+        shutil.copy(manifest_path, dbt_state_dir / "manifest.json")
+
+    context.log.info(f"`dbt {dbt_command}` finished.")
+    return metadata
+
 
 # =============================================================================
 # OP (TASK) - Tác vụ thực thi dbt
@@ -25,49 +178,45 @@ class DbtConfig(Config):
 )
 def dbt_cli_op(context: OpExecutionContext, config: DbtConfig):
     """
-    Op này sẽ chạy `dbt deps` sau đó là lệnh được cung cấp trong config.
+    Op này chạy `dbt deps` (chỉ khi package thay đổi) rồi lệnh trong config,
+    giới hạn vào phần đồ thị được chọn. Thời gian của từng model trong
+    run_results.json được gắn vào metadata của op.
     """
     # Lấy dbt resource đã được cấu hình trong job
     dbt: DbtCliResource = context.resources.dbt
-
-    # 1. Chạy `dbt deps` để cài đặt các package cần thiết
-    context.log.info("Running `dbt deps`...")
-    deps_invocation = dbt.cli(["deps"], context=context)
-    deps_invocation.wait()
-    context.log.info("`dbt deps` finished.")
-
-    # 2. Chạy lệnh chính từ config (ví dụ: "build", "debug")
-    dbt_command_str = config.dbt_command
-    context.log.info(f"Running `dbt {dbt_command_str}`...")
-    
-    # Khởi chạy lệnh chính của dbt và chờ hoàn tất
-    run_invocation = dbt.cli([dbt_command_str], context=context)
-    run_result = run_invocation.wait()
-    # Nếu dbt trả về log dòng cuối, ghi lại để tiện theo dõi
-    if run_result and hasattr(run_result, "raw_output"):
-        context.log.debug(run_result.raw_output)
-    
-    context.log.info(f"`dbt {dbt_command_str}` finished.")
+    metadata = run_dbt(
+        context,
+        dbt,
+        dbt_command=config.dbt_command,
+        select=config.select,
+        changed_months=config.changed_months,
+        is_test_run=config.is_test_run,
+        state_modified=config.state_modified,
+        threads=config.threads,
+        force_deps=config.force_deps,
+    )
+    context.add_output_metadata(metadata)
 
 
 # =============================================================================
 # JOB - Kết nối các op và cấu hình resource
 # =============================================================================
+# Đây là nơi cấu hình DbtCliResource, tương đương mục `profiles` của Kestra
+dbt_resource = DbtCliResource(
+    project_dir=os.fspath(dbt_project_dir),
+    profiles_dir=os.fspath(dbt_project_dir),
+    target=os.getenv("DBT_TARGET", "dev"),
+)
+
+
 @job(
     name="dbt_transformations_job",
     description="Một job để chạy các phép biến đổi dữ liệu bằng dbt.",
     # resource_defs định nghĩa và cấu hình các resource cần thiết cho job
-    resource_defs={
-        # Đây là nơi cấu hình DbtCliResource, tương đương mục `profiles` của Kestra
-        "dbt": DbtCliResource(
-            project_dir=os.fspath(dbt_project_dir),
-            profiles_dir=os.fspath(dbt_project_dir),
-            target=os.getenv("DBT_TARGET", "dev"),
-        )
-    },
+    resource_defs={"dbt": dbt_resource},
 )
 def dbt_pipeline():
     """
     Pipeline này chỉ có một bước duy nhất là thực thi dbt.
     """
-    dbt_cli_op()
\ No newline at end of file
+    dbt_cli_op()
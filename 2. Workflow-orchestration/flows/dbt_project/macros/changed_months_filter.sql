@@ -0,0 +1,40 @@
+{#
+    This macro returns a predicate restricting `column` to the pickup months that
+    changed since the last run of an incremental model.
+
+    The months come from the `changed_months` var ("YYYY-MM", as a list or a
+    comma-separated string), e.g. --vars '{"changed_months": ["2021-01"]}'.
+    Without the var, the last month already present in the model
+    (`this_month_column` in {{ this }}) and everything after it is recomputed.
+    Only values up to now count towards that month: TLC files contain a few
+    future-dated pickups, which would otherwise pin the lower bound to a
+    month no new data ever lands in.
+#}
+
+{% macro changed_months_filter(column, this_month_column) -%}
+
+    {%- set months = var('changed_months', []) -%}
+    {%- if months is string -%}
+        {%- set months = months.split(',') | map('trim') | reject('equalto', '') | list -%}
+    {%- endif -%}
+
+    {%- if months | length > 0 -%}
+    (
+        {%- for month in months %}
+        {%- if not modules.re.match('^[0-9]{4}-[0-9]{2}$', month) -%}
+            {{ exceptions.raise_compiler_error("changed_months must be YYYY-MM values, got '" ~ month ~ "'") }}
+        {%- endif %}
+        ({{ column }} >= cast('{{ month }}-01' as timestamp)
+            and {{ column }} < {{ dbt.dateadd('month', 1, "cast('" ~ month ~ "-01' as timestamp)") }})
+        {%- if not loop.last %} or{% endif %}
+        {%- endfor %}
+    )
+    {%- else -%}
+    {{ column }} >= (
+        {%- set plausible = "case when " ~ this_month_column ~ " <= " ~ dbt.current_timestamp() ~ " then " ~ this_month_column ~ " end" %}
+        select coalesce({{ dbt.date_trunc("month", "max(" ~ plausible ~ ")") }}, cast('1900-01-01' as timestamp))
+        from {{ this }}
+    )
+    {%- endif -%}
+
+{%- endmacro %}
@@ -0,0 +1,35 @@
+{#
+    Additive measures of the revenue rollups.
+
+    from_trips=true aggregates fact_trips rows; otherwise it re-aggregates a
+    finer rollup (sums of sums). Averages are not stored: they are derived at
+    query time from the *_sum and *_trips columns, so every rollup can be
+    rolled up again without losing precision.
+#}
+
+{% macro rollup_measures(from_trips=false) -%}
+    {%- set measures = [
+        ('revenue_fare', 'fare_amount'),
+        ('revenue_extra', 'extra'),
+        ('revenue_mta_tax', 'mta_tax'),
+        ('revenue_tip_amount', 'tip_amount'),
+        ('revenue_tolls_amount', 'tolls_amount'),
+        ('revenue_ehail_fee', 'ehail_fee'),
+        ('revenue_improvement_surcharge', 'improvement_surcharge'),
+        ('revenue_total_amount', 'total_amount'),
+        ('passenger_count_sum', 'passenger_count'),
+        ('trip_distance_sum', 'trip_distance'),
+    ] -%}
+    {%- for name, column in measures %}
+    sum({{ column if from_trips else name }}) as {{ name }},
+    {%- endfor %}
+    {%- if from_trips %}
+    count(tripid) as total_trips,
+    count(passenger_count) as passenger_count_trips,
+    count(trip_distance) as trip_distance_trips
+    {%- else %}
+    sum(total_trips) as total_trips,
+    sum(passenger_count_trips) as passenger_count_trips,
+    sum(trip_distance_trips) as trip_distance_trips
+    {%- endif %}
+{%- endmacro %}
@@ -1,7 +1,17 @@
-{{ config(materialized='table') }}
+{{
+    config(
+        materialized='incremental',
+        unique_key='revenue_month',
+        incremental_strategy='delete+insert'
+    )
+}}
 
 with trips_data as (
     select * from {{ ref('fact_trips') }}
+    {% if is_incremental() %}
+    -- re-aggregate whole months only: delete+insert replaces every row of each revenue_month
+    where {{ changed_months_filter('pickup_datetime', 'revenue_month') }}
+    {% endif %}
 )
     select 
     -- Revenue grouping 
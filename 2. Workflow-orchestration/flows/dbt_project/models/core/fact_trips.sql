@@ -1,6 +1,14 @@
+{# delete+insert on the pickup month: a recomputed month replaces every row of that month,
+   so trips that vanished from a reloaded file are dropped too #}
 {{
     config(
-        materialized='table'
+        materialized='incremental',
+        unique_key="date_trunc('month', pickup_datetime)",
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['tripid']},
+            {'columns': ['pickup_datetime']},
+        ]
     )
 }}
 
@@ -8,11 +16,18 @@ with green_tripdata as (
     select *, 
         'Green' as service_type
     from {{ ref('stg_green_tripdata') }}
+    {% if is_incremental() %}
+    -- only the pickup months loaded since the last run
+    where {{ changed_months_filter('pickup_datetime', 'pickup_datetime') }}
+    {% endif %}
 ), 
 yellow_tripdata as (
     select *, 
         'Yellow' as service_type
     from {{ ref('stg_yellow_tripdata') }}
+    {% if is_incremental() %}
+    where {{ changed_months_filter('pickup_datetime', 'pickup_datetime') }}
+    {% endif %}
 ), 
 trips_unioned as (
     select * from green_tripdata
@@ -0,0 +1,28 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key='revenue_month',
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['revenue_month', 'service_type']},
+            {'columns': ['revenue_day']},
+        ]
+    )
+}}
+
+with daily_zone as (
+    select * from {{ ref('rollup_daily_zone_revenue') }}
+    {% if is_incremental() %}
+    where {{ changed_months_filter('revenue_month', 'revenue_month') }}
+    {% endif %}
+)
+select
+    revenue_day,
+    revenue_month,
+    service_type,
+    revenue_borough,
+    payment_type,
+    payment_type_description,
+    {{ rollup_measures() }}
+from daily_zone
+group by 1, 2, 3, 4, 5, 6
@@ -0,0 +1,32 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key='revenue_month',
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['revenue_month', 'service_type']},
+            {'columns': ['revenue_day']},
+        ]
+    )
+}}
+
+-- Finest rollup: pickup day x pickup zone x service x payment type.
+-- Every coarser rollup is built from this one, never from fact_trips.
+with trips_data as (
+    select * from {{ ref('fact_trips') }}
+    {% if is_incremental() %}
+    -- whole pickup months only: delete+insert replaces every row of each revenue_month
+    where {{ changed_months_filter('pickup_datetime', 'revenue_month') }}
+    {% endif %}
+)
+select
+    {{ dbt.date_trunc("day", "pickup_datetime") }} as revenue_day,
+    {{ dbt.date_trunc("month", "pickup_datetime") }} as revenue_month,
+    service_type,
+    pickup_borough as revenue_borough,
+    pickup_zone as revenue_zone,
+    payment_type,
+    payment_type_description,
+    {{ rollup_measures(from_trips=true) }}
+from trips_data
+group by 1, 2, 3, 4, 5, 6, 7
@@ -1,15 +1,29 @@
+{# delete+insert on the pickup month: a recomputed month replaces every row of that month,
+   so trips that vanished from a reloaded file are dropped too #}
 {{
     config(
-        materialized='view'
+        materialized='incremental',
+        unique_key="date_trunc('month', pickup_datetime)",
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['tripid'], 'unique': True},
+            {'columns': ['pickup_datetime']},
+        ]
     )
 }}
 
 with tripdata as 
 (
+  -- dedup within the batch only: a batch holds whole pickup months, so every
+  -- (vendorid, pickup) group is complete. Raw index on (lpep_pickup_datetime, vendorid)
+  -- is created by the Dagster load; unique_row_id makes the kept row deterministic.
   select *,
-    row_number() over(partition by vendorid, lpep_pickup_datetime) as rn
+    row_number() over(partition by lpep_pickup_datetime, vendorid order by unique_row_id) as rn
   from {{ source('staging','green_tripdata') }}
   where vendorid is not null 
+  {% if is_incremental() %}
+    and {{ changed_months_filter('lpep_pickup_datetime', 'pickup_datetime') }}
+  {% endif %}
 )
 select
     -- identifiers
@@ -1,11 +1,29 @@
-{{ config(materialized='view') }}
+{# delete+insert on the pickup month: a recomputed month replaces every row of that month,
+   so trips that vanished from a reloaded file are dropped too #}
+{{
+    config(
+        materialized='incremental',
+        unique_key="date_trunc('month', pickup_datetime)",
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['tripid'], 'unique': True},
+            {'columns': ['pickup_datetime']},
+        ]
+    )
+}}
  
 with tripdata as 
 (
+  -- dedup within the batch only: a batch holds whole pickup months, so every
+  -- (vendorid, pickup) group is complete. Raw index on (tpep_pickup_datetime, vendorid)
+  -- is created by the Dagster load; unique_row_id makes the kept row deterministic.
   select *,
-    row_number() over(partition by vendorid, tpep_pickup_datetime) as rn
+    row_number() over(partition by tpep_pickup_datetime, vendorid order by unique_row_id) as rn
   from {{ source('staging','yellow_tripdata') }}
   where vendorid is not null 
+  {% if is_incremental() %}
+    and {{ changed_months_filter('tpep_pickup_datetime', 'pickup_datetime') }}
+  {% endif %}
 )
 select
    -- identifiers
@@ -0,0 +1,393 @@
+"""
+Cache file tải về trên đĩa local, khóa theo URL.
+
+- Mỗi URL ứng với một object `objects/<sha256(url)>` cùng file metadata
+  `<key>.json` (ETag, Last-Modified, kích thước, sha256 nội dung, lần dùng cuối).
+- Lần fetch sau gửi GET có điều kiện (If-None-Match / If-Modified-Since):
+  304 -> dùng bản cache; 200 -> tải lại. Bản cache luôn được kiểm tra kích
+  thước (và sha256 nếu `verify_checksum=True`) trước khi trả về.
+- Lần tải dở dang được giữ ở `<key>.part` và nối tiếp bằng header Range
+  (If-Range để không ghép nhầm hai phiên bản khác nhau của file).
+- Tổng dung lượng (object và `.part`) bị giới hạn bởi `max_bytes`, vượt quá
+  thì xóa các object lâu không dùng nhất (LRU). File `.part` không được ghi
+  thêm trong `part_max_age_seconds` bị xóa trước.
+- Thư mục cache được dùng chung giữa nhiều process (executor multiprocess của
+  Dagster, backfill, ingest_data.py): tải và xóa một key được khóa bằng
+  `fcntl.flock` trên `<key>.lock`, ngoài khóa giữa các luồng trong process.
+  Bên đọc dùng `with cache.use(url) as fetched:`, giữ khóa chia sẻ trên
+  `<key>.read` trong suốt khối with, nên object đang được đọc không bị xóa.
+
+Chỉ phụ thuộc `requests`; được dùng chung bởi các flow Dagster và
+`1. Docker-sql/ingest_data.py`.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khóa được giữa các luồng
+    fcntl = None
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class CacheStats:
+    """Bộ đếm cộng dồn của một DownloadCache."""
+    hits: int = 0
+    misses: int = 0
+    resumed: int = 0
+    evictions: int = 0
+    bytes_downloaded: int = 0
+    bytes_served_from_cache: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class FetchResult:
+    """Kết quả của một lần fetch: đường dẫn object và nó đến từ đâu."""
+    path: Path
+    status: str  # "hit" | "miss" | "resumed" | "stale" (server lỗi, dùng bản cũ)
+    bytes_downloaded: int
+    size: int
+    sha256: Optional[str] = None  # sha256 nội dung, định danh phiên bản của file
+
+
+class DownloadError(RuntimeError):
+    """Nội dung tải về không khớp với kích thước/checksum mong đợi."""
+
+
+def _sha256_file(path: Path, initial=None):
+    digest = initial or hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+
+class DownloadCache:
+    def __init__(
+        self,
+        root,
+        max_bytes: int = 10 * 1024**3,
+        verify_checksum: bool = False,
+        timeout: float = 60.0,
+        part_max_age_seconds: float = 24 * 3600.0,
+    ):
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.part_max_age_seconds = part_max_age_seconds
+        self.verify_checksum = verify_checksum
+        self.timeout = timeout
+        self.stats = CacheStats()
+        self._stats_lock = threading.Lock()
+        self._key_locks = {}
+        self._key_locks_guard = threading.Lock()
+        self._session = requests.Session()
+
+    # ---------------------------------------------------------------- layout
+    @staticmethod
+    def key_for(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def object_path(self, url: str) -> Path:
+        return self.objects_dir / self.key_for(url)
+
+    def _meta_path(self, key: str) -> Path:
+        return self.objects_dir / f"{key}.json"
+
+    def _part_path(self, key: str) -> Path:
+        return self.objects_dir / f"{key}.part"
+
+    def _lock_path(self, key: str) -> Path:
+        return self.objects_dir / f"{key}.lock"
+
+    def _read_lock_path(self, key: str) -> Path:
+        return self.objects_dir / f"{key}.read"
+
+    def _read_meta(self, key: str) -> Optional[dict]:
+        try:
+            return json.loads(self._meta_path(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key: str, meta: dict) -> None:
+        tmp = self._meta_path(key).with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(meta))
+        tmp.replace(self._meta_path(key))
+
+    @staticmethod
+    @contextmanager
+    def _flock(path: Path, shared: bool = False, blocking: bool = True):
+        """
+        flock loại trừ (hoặc chia sẻ nếu `shared`) trên file `path`. Yield False nếu
+        `blocking=False` và file đang bị khóa ở nơi khác. File khóa có thể bị
+        xóa khi key bị evict, nên sau khi khóa được phải kiểm tra nó vẫn là file
+        đang nằm ở `path`; nếu không thì mở lại và khóa lại.
+        """
+        if fcntl is None:
+            yield True
+            return
+        while True:
+            lock_file = open(path, "a")
+            try:
+                try:
+                    mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                    fcntl.flock(lock_file, mode | (0 if blocking else fcntl.LOCK_NB))
+                except BlockingIOError:
+                    yield False
+                    return
+                try:
+                    current = os.fstat(lock_file.fileno()).st_ino == os.stat(path).st_ino
+                except FileNotFoundError:
+                    current = False
+                if current:
+                    yield True
+                    return
+            finally:
+                lock_file.close()  # đóng file là nhả flock
+
+    @contextmanager
+    def _lock(self, key: str, blocking: bool = True):
+        """
+        Khóa `key` giữa các luồng và giữa các process. Yield False (không chờ)
+        nếu `blocking=False` và key đang bị giữ ở nơi khác.
+        """
+        with self._key_locks_guard:
+            thread_lock = self._key_locks.setdefault(key, threading.Lock())
+        if not thread_lock.acquire(blocking=blocking):
+            yield False
+            return
+        try:
+            with self._flock(self._lock_path(key), blocking=blocking) as locked:
+                yield locked
+        finally:
+            thread_lock.release()
+
+    def _count(self, **increments) -> None:
+        with self._stats_lock:
+            for name, value in increments.items():
+                setattr(self.stats, name, getattr(self.stats, name) + value)
+
+    # ----------------------------------------------------------------- fetch
+    @contextmanager
+    def use(self, url: str, expected_sha256: Optional[str] = None, log=None):
+        """
+        Như `fetch`, nhưng object không bị evict (bởi bất kỳ process nào) cho tới
+        khi ra khỏi khối with: khóa đọc được lấy trước khi fetch và giữ suốt khối.
+        """
+        with self._flock(self._read_lock_path(self.key_for(url)), shared=True):
+            yield self.fetch(url, expected_sha256, log)
+
+    def fetch(self, url: str, expected_sha256: Optional[str] = None, log=None) -> FetchResult:
+        """
+        Trả về bản local của `url`, chỉ tải lại khi bản cache không còn hợp lệ.
+        Object có thể bị process khác evict ngay sau khi trả về; đọc nó trong
+        `use()` nếu cần giữ nó.
+        """
+        key = self.key_for(url)
+        with self._lock(key):
+            result = self._fetch_locked(url, key, expected_sha256, log)
+        self._evict(keep=key, log=log)
+        if log:
+            log.info(
+                f"Download cache {result.status} for {url} "
+                f"({result.bytes_downloaded} bytes downloaded, {result.size} bytes on disk)"
+            )
+        return result
+
+    def _valid_cached(self, key: str, meta: Optional[dict], expected_sha256: Optional[str]) -> bool:
+        path = self.objects_dir / key
+        if meta is None or not path.exists() or path.stat().st_size != meta.get("size"):
+            return False
+        if expected_sha256 and meta.get("sha256") != expected_sha256:
+            return False
+        if self.verify_checksum:
+            return _sha256_file(path).hexdigest() == meta.get("sha256")
+        return True
+
+    def _hit(self, key: str, meta: dict, status: str = "hit") -> FetchResult:
+        meta["last_access"] = time.time()
+        self._write_meta(key, meta)
+        self._count(hits=1, bytes_served_from_cache=meta["size"])
+        return FetchResult(self.objects_dir / key, status, 0, meta["size"], meta.get("sha256"))
+
+    def _fetch_locked(self, url, key, expected_sha256, log) -> FetchResult:
+        meta = self._read_meta(key)
+        cached = self._valid_cached(key, meta, expected_sha256)
+
+        headers = {}
+        if cached:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+            if not headers:
+                # Server không cho validator: tin vào kích thước/checksum đã kiểm tra
+                return self._hit(key, meta)
+
+        part_path = self._part_path(key)
+        part_meta = (meta or {}).get("partial") or {}
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        validator = part_meta.get("etag") or part_meta.get("last_modified")
+        if not cached and offset and validator:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+
+        try:
+            response = self._session.get(url, headers=headers, stream=True, timeout=self.timeout)
+        except requests.RequestException as e:
+            if cached:
+                if log:
+                    log.warning(f"Could not revalidate {url} ({e}); serving the cached copy")
+                return self._hit(key, meta, status="stale")
+            raise
+
+        with response:
+            if cached and response.status_code == 304:
+                return self._hit(key, meta)
+            response.raise_for_status()
+
+            resumed = response.status_code == 206
+            if not resumed:
+                offset = 0
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            # Ghi lại validator của lần tải này để lần sau có thể nối tiếp
+            self._write_meta(key, {**(meta or {}), "url": url,
+                                   "partial": {"etag": etag, "last_modified": last_modified}})
+
+            digest = _sha256_file(part_path) if resumed else hashlib.sha256()
+            downloaded = 0
+            with open(part_path, "ab" if resumed else "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    downloaded += len(chunk)
+
+        size = offset + downloaded
+        self._count(misses=1, resumed=int(resumed), bytes_downloaded=downloaded)
+        expected_size = _expected_size(response)
+        if expected_size is not None and size != expected_size:
+            # Giữ lại .part để lần sau nối tiếp
+            raise DownloadError(f"{url}: got {size} bytes, expected {expected_size}")
+        sha256 = digest.hexdigest()
+        if expected_sha256 and sha256 != expected_sha256:
+            part_path.unlink(missing_ok=True)
+            raise DownloadError(f"{url}: sha256 {sha256} does not match {expected_sha256}")
+
+        part_path.replace(self.objects_dir / key)
+        self._write_meta(key, {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": size,
+            "sha256": sha256,
+            "last_access": time.time(),
+        })
+        return FetchResult(self.objects_dir / key, "resumed" if resumed else "miss", downloaded, size, sha256)
+
+    # -------------------------------------------------------------- eviction
+    @contextmanager
+    def _exclusive(self, key: str):
+        """Yield True nếu `key` không đang được fetch hoặc đọc ở đâu cả (không chờ)."""
+        with self._lock(key, blocking=False) as locked, \
+                self._flock(self._read_lock_path(key), blocking=False) as unused:
+            yield locked and unused
+
+    def _remove(self, key: str, keep_object: bool) -> None:
+        """Xóa `.part` của `key`, và cả object, metadata, file khóa nếu không `keep_object`."""
+        self._part_path(key).unlink(missing_ok=True)
+        if not keep_object:
+            # File khóa bị xóa khi đang bị giữ: bên đang chờ sẽ thấy inode đổi và mở lại (_flock)
+            for path in (self.objects_dir / key, self._meta_path(key), self._read_lock_path(key), self._lock_path(key)):
+                path.unlink(missing_ok=True)
+
+    def _evict(self, keep: str, log=None) -> None:
+        """
+        Giữ tổng dung lượng object + `.part` <= max_bytes: xóa các `.part` không
+        được ghi thêm trong part_max_age_seconds, rồi các object lâu không dùng
+        nhất. Bỏ qua key đang được fetch hoặc đang được đọc trong `use()`.
+        """
+        entries = []
+        for meta_path in self.objects_dir.glob("*.json"):
+            key = meta_path.stem
+            meta = self._read_meta(key) or {}
+            obj, part = _stat(self.objects_dir / key), _stat(self._part_path(key))
+            entries.append({
+                "key": key,
+                "last_access": meta.get("last_access", 0),
+                "size": obj.st_size if obj else None,
+                "part_size": part.st_size if part else 0,
+                "part_mtime": part.st_mtime if part else None,
+            })
+        total = sum((e["size"] or 0) + e["part_size"] for e in entries)
+
+        now = time.time()
+        for e in entries:
+            if e["key"] == keep or e["part_mtime"] is None or now - e["part_mtime"] <= self.part_max_age_seconds:
+                continue
+            with self._exclusive(e["key"]) as free:
+                if not free:
+                    continue
+                # Key chưa từng tải xong thì xóa luôn metadata của nó
+                self._remove(e["key"], keep_object=e["size"] is not None)
+            total -= e["part_size"]
+            e["part_size"] = 0
+            if log:
+                log.info(f"Download cache removed a stale partial download of {e['key'][:12]}")
+
+        for e in sorted(entries, key=lambda e: e["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if e["key"] == keep or e["size"] is None:
+                continue
+            with self._exclusive(e["key"]) as free:
+                if not free:
+                    continue  # đang được fetch hoặc đọc ở luồng/process khác
+                self._remove(e["key"], keep_object=False)
+            size = e["size"] + e["part_size"]
+            total -= size
+            self._count(evictions=1)
+            if log:
+                log.info(f"Download cache evicted {e['key'][:12]} ({size} bytes)")
+
+
+def _stat(path: Path):
+    """os.stat_result của `path`, None nếu file không tồn tại (vd. vừa bị process khác xóa)."""
+    try:
+        return path.stat()
+    except FileNotFoundError:
+        return None
+
+
+def _expected_size(response) -> Optional[int]:
+    """Tổng kích thước file theo Content-Range/Content-Length (None nếu không biết)."""
+    content_range = response.headers.get("Content-Range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    if response.headers.get("Content-Encoding"):
+        return None  # Content-Length là kích thước đã nén khi truyền
+    length = response.headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def cache_from_env(default_root) -> DownloadCache:
+    """DownloadCache cấu hình bởi DOWNLOAD_CACHE_DIR / DOWNLOAD_CACHE_MAX_GB."""
+    root = os.environ.get("DOWNLOAD_CACHE_DIR") or default_root
+    max_gb = float(os.environ.get("DOWNLOAD_CACHE_MAX_GB", "10"))
+    return DownloadCache(root, max_bytes=int(max_gb * 1024**3))
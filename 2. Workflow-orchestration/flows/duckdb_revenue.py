@@ -0,0 +1,372 @@
+"""
+Tính dm_monthly_zone_revenue bằng DuckDB ngay trên file Parquet, không cần nạp
+dữ liệu thô vào Postgres rồi chạy dbt.
+
+Các bước giống hệt các model dbt:
+
+- staging: stg_green_tripdata / stg_yellow_tripdata (bỏ vendorid NULL, khử
+  trùng lặp theo (pickup, vendorid) giữ dòng có unique_row_id nhỏ nhất, tripid
+  là surrogate key của dbt_utils),
+- dim_zones: từ seeds/taxi_zone_lookup.csv,
+- fact_trips: union green + yellow, inner join vùng đón/trả (bỏ borough Unknown),
+- dm_monthly_zone_revenue: group by vùng đón, tháng, service_type.
+
+DuckDB đọc Parquet song song theo row group và chạy các phép join/group by
+vector hóa trên `threads` luồng. Kết quả được ghi vào Postgres một lần bằng
+COPY (`copy_loader.copy_arrow`) vào bảng `duckdb_monthly_zone_revenue`, rồi
+được so với bảng dm_monthly_zone_revenue do dbt tạo ra.
+"""
+import os
+from pathlib import Path
+from typing import Dict, List
+
+import duckdb
+import pyarrow as pa
+from dagster import Config, Failure, MetadataValue, OpExecutionContext, ResourceParam, job, op
+
+from copy_loader import copy_arrow
+from dbt_pipeline import dbt_project_dir
+from postgres_taxi import PostgresConnectionResource, convert_taxi_file_to_parquet, taxi_db_resource
+from taxi_metrics import LoadMetrics
+from taxi_schema import get_schema
+
+TARGET_TABLE = "duckdb_monthly_zone_revenue"
+SEED_PATH = dbt_project_dir / "seeds" / "taxi_zone_lookup.csv"
+
+KEY_COLUMNS = ["revenue_zone", "revenue_month", "service_type"]
+METRIC_COLUMNS = [
+    "revenue_monthly_fare",
+    "revenue_monthly_extra",
+    "revenue_monthly_mta_tax",
+    "revenue_monthly_tip_amount",
+    "revenue_monthly_tolls_amount",
+    "revenue_monthly_ehail_fee",
+    "revenue_monthly_improvement_surcharge",
+    "revenue_monthly_total_amount",
+    "total_monthly_trips",
+    "avg_monthly_passenger_count",
+    "avg_monthly_trip_distance",
+]
+# numeric của Postgres là số chính xác; DECIMAL đủ rộng để tổng không bị làm tròn
+NUMERIC = "DECIMAL(38, 10)"
+
+# Thứ tự cột và kiểu như bảng dbt
+TARGET_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {{table}} (
+        revenue_zone text,
+        revenue_month timestamp,
+        service_type text,
+        {", ".join(f"{name} numeric" for name in METRIC_COLUMNS if name != "total_monthly_trips")},
+        total_monthly_trips bigint
+    );
+"""
+
+
+# =====================================================================================
+# SQL - Các model dbt viết lại cho DuckDB
+# =====================================================================================
+def _pg_text(column: str, column_type: str) -> str:
+    """
+    CAST(... AS text) giống Postgres: số thực có giá trị nguyên được in không
+    có ".0" (unique_row_id được hash từ text của các cột).
+    """
+    if column_type in ("DOUBLE", "FLOAT"):
+        return (
+            f"CASE WHEN {column} = trunc({column}) THEN CAST(CAST({column} AS BIGINT) AS VARCHAR) "
+            f"ELSE CAST({column} AS VARCHAR) END"
+        )
+    return f"CAST({column} AS VARCHAR)"
+
+
+def _row_hash_sql(taxi: str, column_types: Dict[str, str]) -> str:
+    """unique_row_id như lúc nạp vào bảng thô (TaxiSchema.row_hash_sql)."""
+    parts = " || ".join(
+        f"COALESCE({_pg_text(name, column_types.get(name.lower(), 'VARCHAR'))}, '')"
+        for name in get_schema(taxi).row_hash_columns
+    )
+    return f"md5({parts})"
+
+
+def _surrogate_key(*columns: str) -> str:
+    """dbt_utils.generate_surrogate_key."""
+    parts = " || '-' || ".join(
+        f"COALESCE(CAST({column} AS VARCHAR), '_dbt_utils_surrogate_key_null_')" for column in columns
+    )
+    return f"md5({parts})"
+
+
+def _payment_type_description(column: str) -> str:
+    return f"""CASE TRY_CAST({column} AS INTEGER)
+            WHEN 1 THEN 'Credit card' WHEN 2 THEN 'Cash' WHEN 3 THEN 'No charge'
+            WHEN 4 THEN 'Dispute' WHEN 5 THEN 'Unknown' WHEN 6 THEN 'Voided trip'
+            ELSE 'EMPTY' END"""
+
+
+def staging_sql(con, taxi: str, files: List[str]) -> str:
+    """
+    stg_<taxi>_tripdata trên các file Parquet. Nhận cả file đã chuyển theo
+    schema registry (id dạng text) lẫn file gốc của TLC (id dạng số).
+    """
+    schema = get_schema(taxi)
+    pickup, dropoff = schema.pickup_column, schema.dropoff_column
+    if taxi == "green":
+        trip_type, ehail_fee = "TRY_CAST(trip_type AS INTEGER)", f"CAST(ehail_fee AS {NUMERIC})"
+    else:
+        # yellow cabs are always street-hail
+        trip_type, ehail_fee = "1", f"CAST(0 AS {NUMERIC})"
+    file_list = ", ".join(f"'{path}'" for path in files)
+    column_types = {
+        name.lower(): column_type
+        for name, column_type, *_ in con.execute(
+            f"DESCRIBE SELECT * FROM read_parquet([{file_list}], union_by_name = true)"
+        ).fetchall()
+    }
+    return f"""
+        WITH tripdata AS (
+            SELECT *,
+                row_number() OVER (PARTITION BY {pickup}, vendorid ORDER BY unique_row_id) AS rn
+            FROM (
+                SELECT *, {_row_hash_sql(taxi, column_types)} AS unique_row_id
+                FROM read_parquet([{file_list}], union_by_name = true)
+            )
+            WHERE vendorid IS NOT NULL
+        )
+        SELECT
+            {_surrogate_key("vendorid", pickup)} AS tripid,
+            TRY_CAST(vendorid AS INTEGER) AS vendorid,
+            TRY_CAST(ratecodeid AS INTEGER) AS ratecodeid,
+            TRY_CAST(pulocationid AS INTEGER) AS pickup_locationid,
+            TRY_CAST(dolocationid AS INTEGER) AS dropoff_locationid,
+            CAST({pickup} AS TIMESTAMP) AS pickup_datetime,
+            CAST({dropoff} AS TIMESTAMP) AS dropoff_datetime,
+            CAST(store_and_fwd_flag AS VARCHAR) AS store_and_fwd_flag,
+            TRY_CAST(passenger_count AS INTEGER) AS passenger_count,
+            CAST(trip_distance AS {NUMERIC}) AS trip_distance,
+            {trip_type} AS trip_type,
+            CAST(fare_amount AS {NUMERIC}) AS fare_amount,
+            CAST(extra AS {NUMERIC}) AS extra,
+            CAST(mta_tax AS {NUMERIC}) AS mta_tax,
+            CAST(tip_amount AS {NUMERIC}) AS tip_amount,
+            CAST(tolls_amount AS {NUMERIC}) AS tolls_amount,
+            {ehail_fee} AS ehail_fee,
+            CAST(improvement_surcharge AS {NUMERIC}) AS improvement_surcharge,
+            CAST(total_amount AS {NUMERIC}) AS total_amount,
+            COALESCE(TRY_CAST(payment_type AS INTEGER), 0) AS payment_type,
+            {_payment_type_description("payment_type")} AS payment_type_description
+        FROM tripdata
+        WHERE rn = 1
+    """
+
+
+def build_revenue(con, files_by_taxi: Dict[str, List[str]], months: List[str]) -> pa.Table:
+    """Chạy staging -> dim_zones -> fact_trips -> dm trong DuckDB, trả về dm dạng Arrow."""
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE dim_zones AS
+        SELECT locationid, borough, zone, replace(service_zone, 'Boro', 'Green') AS service_zone
+        FROM read_csv('{SEED_PATH}', header = true, types = {{'locationid': 'DECIMAL(18, 0)'}})
+    """)
+    unioned = []
+    for taxi, files in files_by_taxi.items():
+        con.execute(f"CREATE OR REPLACE TEMP VIEW stg_{taxi}_tripdata AS {staging_sql(con, taxi, files)}")
+        unioned.append(f"SELECT *, '{taxi.capitalize()}' AS service_type FROM stg_{taxi}_tripdata")
+
+    month_filter = "TRUE"
+    if months:
+        month_filter = " OR ".join(
+            f"(pickup_datetime >= TIMESTAMP '{m}-01' AND pickup_datetime < TIMESTAMP '{m}-01' + INTERVAL 1 MONTH)"
+            for m in months
+        )
+    con.execute(f"""
+        CREATE OR REPLACE TEMP VIEW fact_trips AS
+        WITH trips_unioned AS ({" UNION ALL BY NAME ".join(unioned)}),
+        zones AS (SELECT * FROM dim_zones WHERE borough != 'Unknown')
+        SELECT t.*, pickup_zone.borough AS pickup_borough, pickup_zone.zone AS pickup_zone,
+            dropoff_zone.borough AS dropoff_borough, dropoff_zone.zone AS dropoff_zone
+        FROM trips_unioned t
+        INNER JOIN zones AS pickup_zone ON t.pickup_locationid = pickup_zone.locationid
+        INNER JOIN zones AS dropoff_zone ON t.dropoff_locationid = dropoff_zone.locationid
+        WHERE {month_filter}
+    """)
+    return con.execute("""
+        SELECT
+            pickup_zone AS revenue_zone,
+            date_trunc('month', pickup_datetime) AS revenue_month,
+            service_type,
+            sum(fare_amount) AS revenue_monthly_fare,
+            sum(extra) AS revenue_monthly_extra,
+            sum(mta_tax) AS revenue_monthly_mta_tax,
+            sum(tip_amount) AS revenue_monthly_tip_amount,
+            sum(tolls_amount) AS revenue_monthly_tolls_amount,
+            sum(ehail_fee) AS revenue_monthly_ehail_fee,
+            sum(improvement_surcharge) AS revenue_monthly_improvement_surcharge,
+            sum(total_amount) AS revenue_monthly_total_amount,
+            count(tripid) AS total_monthly_trips,
+            avg(passenger_count) AS avg_monthly_passenger_count,
+            avg(trip_distance) AS avg_monthly_trip_distance
+        FROM fact_trips
+        GROUP BY 1, 2, 3
+        ORDER BY 2, 3, 1
+    """).to_arrow_table()
+
+
+# =====================================================================================
+# POSTGRES - Ghi kết quả và so sánh với model dbt
+# =====================================================================================
+def _month_predicate(column: str, months: List[str]) -> str:
+    if not months:
+        return "TRUE"
+    return " OR ".join(
+        f"({column} >= '{m}-01'::timestamp AND {column} < '{m}-01'::timestamp + interval '1 month')" for m in months
+    )
+
+
+def write_revenue(conn, table: pa.Table, target: str, months: List[str]) -> int:
+    """Thay các tháng đã tính (hoặc cả bảng nếu không giới hạn tháng) bằng một lệnh COPY."""
+    with conn.cursor() as cursor:
+        cursor.execute(TARGET_DDL.format(table=target))
+        cursor.execute(f"DELETE FROM {target} WHERE {_month_predicate('revenue_month', months)};")
+        return copy_arrow(cursor, table, target, table.schema.names, fmt="csv")
+
+
+def compare_with_dbt(con, conn, table: pa.Table, dbt_table: str, months: List[str], tolerance: float) -> dict:
+    """
+    So kết quả DuckDB với bảng dbt trên cùng các tháng: số dòng chỉ có ở một
+    bên và chênh lệch tuyệt đối lớn nhất của từng cột số.
+
+    Chỉ có ý nghĩa khi dbt đã chạy các tháng này với `is_test_run=false` (như
+    các asset dbt trong taxi_assets.py): với `is_test_run=true` model staging
+    chỉ giữ 100 dòng mỗi lần chạy, còn DuckDB luôn đọc cả file.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {', '.join(KEY_COLUMNS)}, "
+            f"{', '.join(f'CAST({c} AS double precision)' for c in METRIC_COLUMNS)} "
+            f"FROM {dbt_table} WHERE {_month_predicate('revenue_month', months)}"
+        )
+        rows = cursor.fetchall()
+    expected = pa.Table.from_pylist(
+        [dict(zip(KEY_COLUMNS + METRIC_COLUMNS, row)) for row in rows],
+        schema=pa.schema(
+            [("revenue_zone", pa.string()), ("revenue_month", pa.timestamp("us")), ("service_type", pa.string())]
+            + [(c, pa.float64()) for c in METRIC_COLUMNS]
+        ),
+    )
+    con.register("duckdb_result", table)
+    con.register("dbt_result", expected)
+    join_on = " AND ".join(f"d.{c} IS NOT DISTINCT FROM e.{c}" for c in KEY_COLUMNS)
+    diffs = ", ".join(
+        f"max(abs(CAST(d.{c} AS DOUBLE) - e.{c})) AS {c}" for c in METRIC_COLUMNS
+    )
+    only = con.execute(f"""
+        SELECT count(*) FILTER (WHERE e.revenue_month IS NULL), count(*) FILTER (WHERE d.revenue_month IS NULL)
+        FROM duckdb_result d FULL OUTER JOIN dbt_result e ON {join_on}
+    """).fetchone()
+    max_diff = con.execute(
+        f"SELECT {diffs} FROM duckdb_result d INNER JOIN dbt_result e ON {join_on}"
+    ).fetchone()
+    max_diff = {c: (value or 0.0) for c, value in zip(METRIC_COLUMNS, max_diff)}
+    return {
+        "rows_only_in_duckdb": only[0],
+        "rows_only_in_dbt": only[1],
+        "max_abs_diff": max_diff,
+        "matches": only == (0, 0) and all(value <= tolerance for value in max_diff.values()),
+    }
+
+
+# =====================================================================================
+# CONFIGURATION
+# =====================================================================================
+class DuckDbRevenueConfig(Config):
+    taxis: List[str] = ["green", "yellow"]
+    # "YYYY-MM"; để trống = mọi file `<taxi>_tripdata_*.parquet` trong parquet_dir
+    months: List[str] = []
+    # Mặc định $DAGSTER_HOME/storage/parquet (nơi transfer_mode=parquet ghi file)
+    parquet_dir: str = ""
+    # Tháng chưa có Parquet thì tải và chuyển đổi trước (chỉ khi có `months`)
+    convert_missing: bool = True
+    threads: int = 0  # 0 = số CPU
+    target_table: str = TARGET_TABLE
+    compare_with_dbt: bool = True
+    fail_on_mismatch: bool = False
+    tolerance: float = 1e-6
+
+
+# =====================================================================================
+# OP & JOB
+# =====================================================================================
+@op(description="Tính dm_monthly_zone_revenue bằng DuckDB từ Parquet, ghi vào Postgres và so với dbt")
+def duckdb_monthly_zone_revenue(
+    context: OpExecutionContext,
+    config: DuckDbRevenueConfig,
+    db: ResourceParam[PostgresConnectionResource],
+):
+    parquet_dir = Path(config.parquet_dir or Path(os.environ["DAGSTER_HOME"]) / "storage" / "parquet")
+    files_by_taxi = {}
+    for taxi in config.taxis:
+        if config.months:
+            files = []
+            for month in config.months:
+                path = parquet_dir / f"{taxi}_tripdata_{month}.parquet"
+                if not path.exists() and config.convert_missing:
+                    path = convert_taxi_file_to_parquet(taxi, month, parquet_dir, log=context.log)
+                if path.exists():
+                    files.append(str(path))
+        else:
+            files = sorted(str(path) for path in parquet_dir.glob(f"{taxi}_tripdata_*.parquet"))
+        if files:
+            files_by_taxi[taxi] = files
+        else:
+            context.log.warning(f"No {taxi} Parquet files in {parquet_dir}")
+    if not files_by_taxi:
+        raise Failure(f"No Parquet files to read in {parquet_dir}")
+
+    metrics = LoadMetrics()
+    con = duckdb.connect()
+    con.execute(f"SET threads = {config.threads or os.cpu_count()}")
+    with metrics.stage("compute") as stage:
+        table = build_revenue(con, files_by_taxi, config.months)
+        stage.rows = table.num_rows
+    context.log.info(f"DuckDB computed {table.num_rows} revenue rows in {stage.seconds:.1f}s")
+
+    schema = os.getenv("DBT_SCHEMA", "public")
+    target = f"{schema}.{config.target_table}"
+    metadata = {
+        "files": MetadataValue.json({taxi: [Path(f).name for f in files] for taxi, files in files_by_taxi.items()}),
+        "rows": table.num_rows,
+        "target_table": target,
+    }
+    with db.get_connection() as conn:
+        with metrics.stage("write") as stage:
+            stage.rows = write_revenue(conn, table, target, config.months)
+        metadata.update(metrics.to_metadata())
+
+        if config.compare_with_dbt:
+            comparison = compare_with_dbt(
+                con, conn, table, f"{schema}.dm_monthly_zone_revenue", config.months, config.tolerance
+            )
+            metadata.update({
+                "matches_dbt": comparison["matches"],
+                "rows_only_in_duckdb": comparison["rows_only_in_duckdb"],
+                "rows_only_in_dbt": comparison["rows_only_in_dbt"],
+                "max_abs_diff": MetadataValue.json(comparison["max_abs_diff"]),
+            })
+            log = context.log.info if comparison["matches"] else context.log.warning
+            log(
+                f"Comparison with dbt: {comparison['rows_only_in_duckdb']} rows only in DuckDB, "
+                f"{comparison['rows_only_in_dbt']} only in dbt, max abs diff {comparison['max_abs_diff']}"
+            )
+            if not comparison["matches"] and config.fail_on_mismatch:
+                raise Failure(
+                    "DuckDB revenue does not match dm_monthly_zone_revenue "
+                    "(was dbt run with is_test_run=false for these months?)",
+                    metadata=metadata,
+                )
+    context.add_output_metadata(metadata)
+
+
+@job(
+    description="Phiên bản cục bộ của staging -> fact_trips -> dm_monthly_zone_revenue chạy bằng DuckDB trên Parquet.",
+    resource_defs={"db": taxi_db_resource},
+)
+def duckdb_revenue_pipeline():
+    duckdb_monthly_zone_revenue()
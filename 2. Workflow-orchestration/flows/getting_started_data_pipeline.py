@@ -1,18 +1,178 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import urlencode
+
 import requests
 import pandas as pd
-from dagster import op, job, In, Output, MetadataValue
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dagster import op, job, In, Field, DynamicOut, DynamicOutput, Output, MetadataValue
+
+from columnar_io import columnar_io_manager
+
+
+# =====================================================================================
+# HTTP CLIENT - Session dùng chung, retry/backoff, cache theo ETag
+# =====================================================================================
+class ETagCache:
+    """
+    Body JSON của các response có ETag, khóa theo URL đầy đủ (kể cả query).
+    Giữ trong bộ nhớ và, nếu có `root`, ghi ra `<root>/<sha256(url)>.json`
+    để các run sau gửi được If-None-Match.
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root else None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _path(self, url: str) -> Path:
+        return self.root / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def get(self, url: str):
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is None and self.root is not None:
+            try:
+                entry = json.loads(self._path(url).read_text())
+            except (OSError, ValueError):
+                return None
+            with self._lock:
+                self._entries[url] = entry
+        return entry
+
+    def put(self, url: str, etag: str, body) -> None:
+        entry = {"etag": etag, "body": body}
+        with self._lock:
+            self._entries[url] = entry
+        if self.root is not None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self._path(url).with_suffix(".json.tmp")
+            tmp.write_text(json.dumps(entry))
+            tmp.replace(self._path(url))
+
+
+class ProductApiClient:
+    """
+    Client cho API sản phẩm kiểu dummyjson (`/products?limit=&skip=`).
+
+    - Một requests.Session với pool tối đa `max_workers` connection, dùng chung
+      cho mọi trang.
+    - Retry với backoff lũy thừa cho lỗi kết nối, 429 và 5xx (tôn trọng Retry-After).
+    - GET có điều kiện: trang đã có ETag được gửi kèm If-None-Match, 304 thì
+      dùng lại body đã cache.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        max_workers: int = 4,
+        max_retries: int = 5,
+        backoff_factor: float = 0.5,
+        timeout: float = 30.0,
+        cache_dir=None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = ETagCache(cache_dir)
+        self.stats = {"requests": 0, "not_modified": 0}
+        self._stats_lock = threading.Lock()
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get_json(self, path: str, params: dict):
+        url = f"{self.base_url}/{path}?{urlencode(sorted(params.items()))}"
+        cached = self.cache.get(url)
+        headers = {"If-None-Match": cached["etag"]} if cached else {}
+        with self.session.get(url, headers=headers, timeout=self.timeout) as response:
+            self._count("requests")
+            if cached and response.status_code == 304:
+                self._count("not_modified")
+                return cached["body"]
+            response.raise_for_status()
+            body = response.json()
+            etag = response.headers.get("ETag")
+        if etag:
+            self.cache.put(url, etag, body)
+        return body
+
+    def iter_product_pages(self, page_size: int):
+        """
+        Sinh (skip, danh sách sản phẩm) cho từng trang. Trang đầu cho biết
+        `total`; các trang còn lại được tải song song (tối đa `max_workers`
+        request cùng lúc) và trả về theo thứ tự hoàn thành.
+        """
+        if page_size <= 0:
+            raise ValueError(f"page_size must be positive, got {page_size}")
+        first = self.get_json("products", {"limit": page_size, "skip": 0})
+        yield 0, first["products"]
+
+        skips = range(page_size, first["total"], page_size)
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix="products") as pool:
+            futures = {
+                pool.submit(self.get_json, "products", {"limit": page_size, "skip": skip}): skip
+                for skip in skips
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()["products"]
+
 
 # Tác vụ 1: Extract - Tương đương task "extract"
-# Op này không có đầu vào và trả về một danh sách (list) các sản phẩm.
-@op
-def extract_products() -> list:
-    """Tải dữ liệu sản phẩm từ API và trả về JSON."""
-    response = requests.get("https://dummyjson.com/products")
-    response.raise_for_status() # Báo lỗi nếu request thất bại
-    return response.json()["products"]
+# Op này không có đầu vào; mỗi trang sản phẩm là một output động (một batch)
+# được phát ra ngay khi tải xong, nên các bước sau xử lý từng batch.
+@op(
+    config_schema={
+        "base_url": Field(str, default_value="https://dummyjson.com", description="Đổi sang server stub khi test"),
+        "page_size": Field(int, default_value=30),
+        "max_workers": Field(int, default_value=4, description="Số request đồng thời tối đa"),
+        "max_retries": Field(int, default_value=5),
+        "cache_dir": Field(
+            str, default_value="", description="Thư mục cache ETag (mặc định $DAGSTER_HOME/storage/http_cache)"
+        ),
+    },
+    out=DynamicOut(list),
+)
+def extract_products(context):
+    """Tải tất cả các trang sản phẩm từ API, song song, và phát ra từng trang."""
+    config = context.op_config
+    cache_dir = config["cache_dir"] or (
+        Path(os.environ["DAGSTER_HOME"]) / "storage" / "http_cache" if os.getenv("DAGSTER_HOME") else None
+    )
+    client = ProductApiClient(
+        config["base_url"],
+        max_workers=config["max_workers"],
+        max_retries=config["max_retries"],
+        cache_dir=cache_dir,
+    )
+    pages = 0
+    for skip, products in client.iter_product_pages(config["page_size"]):
+        pages += 1
+        yield DynamicOutput(products, mapping_key=f"skip_{skip}")
+    context.log.info(
+        f"Fetched {pages} pages from {client.base_url}: {client.stats['requests']} requests, "
+        f"{client.stats['not_modified']} served from the ETag cache"
+    )
 
 # Tác vụ 2: Transform - Tương đương task "transform"
-# Op này nhận đầu vào là danh sách sản phẩm từ op trước đó.
+# Op này chạy một lần cho mỗi batch sản phẩm từ op trước đó.
 # Tham số `columns_to_keep` có thể được cấu hình qua config.
 @op(
     config_schema={"columns_to_keep": list},
@@ -21,7 +181,7 @@ def extract_products() -> list:
 def transform_products(context, products: list) -> list:
     """Lọc dữ liệu để chỉ giữ lại các cột cần thiết."""
     columns_to_keep = context.op_config["columns_to_keep"]
-    
+
     filtered_data = [
         {column: product.get(column, "N/A") for column in columns_to_keep}
         for product in products
@@ -29,37 +189,47 @@ def transform_products(context, products: list) -> list:
     return filtered_data
 
 # Tác vụ 3: Query - Tương đương task "query"
-# Op này nhận dữ liệu đã lọc và tính toán giá trung bình.
-@op(ins={"filtered_products": In(list)})
-def aggregate_average_price(filtered_products: list) -> pd.DataFrame:
+# Op này nhận các batch đã lọc và tính toán giá trung bình.
+@op(ins={"filtered_batches": In(list)})
+def aggregate_average_price(filtered_batches: list) -> pd.DataFrame:
     """
     Sử dụng Pandas để nhóm theo thương hiệu và tính giá trung bình.
+    Mỗi batch chỉ được gộp thành tổng/số lượng theo thương hiệu, rồi các
+    kết quả một phần được cộng lại, không ghép tất cả sản phẩm vào một DataFrame.
     Trả về một DataFrame của Pandas.
     """
-    if not filtered_products:
+    partials = []
+    for batch in filtered_batches:
+        if not batch:
+            continue
+        df = pd.DataFrame(batch)
+
+        # Chuyển đổi kiểu dữ liệu an toàn
+        df['price'] = pd.to_numeric(df['price'], errors='coerce')
+        df = df.dropna(subset=['price'])
+        partials.append(df.groupby('brand')['price'].agg(['sum', 'count']))
+
+    if not partials:
         return pd.DataFrame(columns=["brand", "avg_price"])
 
-    df = pd.DataFrame(filtered_products)
-    
-    # Chuyển đổi kiểu dữ liệu an toàn
-    df['price'] = pd.to_numeric(df['price'], errors='coerce')
-    df = df.dropna(subset=['price'])
-    
-    avg_price_df = df.groupby('brand')['price'].mean().round(2).reset_index()
-    avg_price_df = avg_price_df.rename(columns={'price': 'avg_price'})
+    totals = pd.concat(partials).groupby(level=0).sum()
+    avg_price_df = (totals['sum'] / totals['count']).round(2).rename('avg_price').rename_axis('brand').reset_index()
     avg_price_df = avg_price_df.sort_values(by='avg_price', ascending=False)
-    
+
     print("Báo cáo giá trung bình theo thương hiệu:")
     print(avg_price_df)
     return avg_price_df
 
 # Định nghĩa Job: Kết nối các op lại với nhau
-@job
+# Output giữa các op được lưu dạng Arrow (đọc bằng mmap) thay vì pickle,
+# kết quả giống hệt nhau giữa các run chỉ được lưu một lần (columnar_io.py).
+@job(resource_defs={"io_manager": columnar_io_manager})
 def getting_started_data_pipeline():
     """
     Định nghĩa luồng dữ liệu bằng cách gọi các op theo đúng thứ tự
-    và truyền dữ liệu giữa chúng.
+    và truyền dữ liệu giữa chúng: mỗi trang sản phẩm được lọc riêng,
+    sau đó các batch được gom lại để tính giá trung bình.
     """
-    raw_products = extract_products()
-    filtered_list = transform_products(raw_products)
-    aggregate_average_price(filtered_list)
\ No newline at end of file
+    product_pages = extract_products()
+    filtered_batches = product_pages.map(transform_products)
+    aggregate_average_price(filtered_batches.collect())
@@ -0,0 +1,230 @@
+"""
+Pool connection psycopg2 có giới hạn, an toàn giữa các luồng, dùng chung trong một process.
+
+- Tối đa `max_size` connection được mượn cùng lúc; luồng thứ `max_size + 1`
+  chờ tối đa `timeout` giây rồi báo PoolTimeout.
+- Connection rảnh quá `health_check_after` giây được kiểm tra bằng `SELECT 1`
+  trước khi cho mượn; connection hỏng bị đóng và thay bằng connection mới.
+- Connection sống quá `max_lifetime` giây bị đóng khi được trả về (hoặc khi
+  lấy ra), tránh giữ mãi một backend Postgres.
+- Connection trả về còn dở transaction được rollback; trạng thái không rõ
+  (mất kết nối giữa chừng) thì bị bỏ.
+
+`snapshot(since=...)` cho bộ đếm của một khoảng (một op, một lần backfill):
+`pool_stats_delta` trừ các bộ đếm cộng dồn, còn max_wait_seconds là lần chờ
+lâu nhất trong chính khoảng đó.
+
+`shared_pool()` giữ một pool cho mỗi DSN (và bộ tham số) trong process, để các
+op, asset và luồng backfill chạy cùng process dùng lại connection của nhau.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import psycopg2
+from psycopg2 import extensions
+
+
+@dataclass
+class PoolStats:
+    """Bộ đếm cộng dồn của một ConnectionPool."""
+    checkouts: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    timeouts: int = 0
+    connections_opened: int = 0
+    connections_recycled: int = 0  # đóng vì quá max_lifetime
+    health_check_failures: int = 0
+    connections_discarded: int = 0  # trả về trong trạng thái hỏng
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+# Số phần tử tối đa của ngăn xếp thời gian chờ (xem ConnectionPool._wait_peaks)
+WAIT_PEAKS_MAX = 1024
+
+
+class PoolTimeout(RuntimeError):
+    """Không mượn được connection trong thời gian chờ cho phép."""
+
+
+@dataclass
+class _Entry:
+    conn: object
+    created_at: float
+    last_used: float
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        dsn: str,
+        max_size: int = 8,
+        max_lifetime: float = 1800.0,
+        health_check_after: float = 30.0,
+        timeout: float = 60.0,
+    ):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self.stats = PoolStats()
+        # (số thứ tự lần mượn, thời gian chờ) với thời gian chờ giảm dần: lần chờ
+        # lâu nhất sau lần mượn thứ n là phần tử đầu tiên có số thứ tự > n
+        self._wait_peaks = deque(maxlen=WAIT_PEAKS_MAX)
+        self._idle = deque()
+        self._in_use = 0
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+
+    # --------------------------------------------------------------- checkout
+    @contextmanager
+    def connection(self):
+        """Mượn một connection; commit/rollback là việc của người gọi."""
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count(timeouts=1)
+            raise PoolTimeout(f"No connection available within {self.timeout}s (max_size={self.max_size})")
+        waited = time.monotonic() - started
+        try:
+            entry = self._take()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self.stats.checkouts += 1
+            self.stats.wait_seconds += waited
+            self.stats.max_wait_seconds = max(self.stats.max_wait_seconds, waited)
+            while self._wait_peaks and self._wait_peaks[-1][1] <= waited:
+                self._wait_peaks.pop()
+            self._wait_peaks.append((self.stats.checkouts, waited))
+        try:
+            yield entry.conn
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._give_back(entry)
+            self._slots.release()
+
+    def _take(self) -> _Entry:
+        while True:
+            with self._lock:
+                entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                conn = psycopg2.connect(self.dsn)
+                self._count(connections_opened=1)
+                now = time.monotonic()
+                return _Entry(conn, now, now)
+            now = time.monotonic()
+            if now - entry.created_at > self.max_lifetime:
+                self._close(entry, connections_recycled=1)
+                continue
+            if now - entry.last_used > self.health_check_after and not self._healthy(entry.conn):
+                self._close(entry, health_check_failures=1)
+                continue
+            return entry
+
+    def _give_back(self, entry: _Entry) -> None:
+        conn = entry.conn
+        if not conn.closed and conn.info.transaction_status not in (
+            extensions.TRANSACTION_STATUS_IDLE,
+            extensions.TRANSACTION_STATUS_UNKNOWN,
+        ):
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        if conn.closed or conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            self._close(entry, connections_discarded=1)
+            return
+        now = time.monotonic()
+        if now - entry.created_at > self.max_lifetime:
+            self._close(entry, connections_recycled=1)
+            return
+        entry.last_used = now
+        with self._lock:
+            self._idle.append(entry)
+
+    @staticmethod
+    def _healthy(conn) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close(self, entry: _Entry, **increments) -> None:
+        try:
+            entry.conn.close()
+        except psycopg2.Error:
+            pass
+        self._count(**increments)
+
+    def _count(self, **increments) -> None:
+        with self._lock:
+            for name, value in increments.items():
+                setattr(self.stats, name, getattr(self.stats, name) + value)
+
+    # ----------------------------------------------------------------- status
+    def snapshot(self, since: Optional[dict] = None) -> dict:
+        """
+        Bộ đếm cộng dồn cùng số connection đang mượn/đang rảnh. Với `since`
+        (một snapshot trước đó), max_wait_seconds chỉ tính các lần mượn sau nó.
+        """
+        with self._lock:
+            stats = self.stats.as_dict()
+            if since is not None:
+                stats["max_wait_seconds"] = next(
+                    (waited for number, waited in self._wait_peaks if number > since["checkouts"]), 0.0
+                )
+            return {**stats, "in_use": self._in_use, "idle": len(self._idle)}
+
+    def close(self) -> None:
+        """Đóng các connection đang rảnh (connection đang mượn đóng khi được trả)."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for entry in idle:
+            self._close(entry)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def shared_pool(dsn: str, **options) -> ConnectionPool:
+    """
+    Pool dùng chung cho `dsn` trong process hiện tại. Khóa gồm cả PID: process
+    con (fork) không dùng lại socket của process cha mà tạo pool riêng.
+    """
+    key = (os.getpid(), dsn, tuple(sorted(options.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(dsn, **options)
+        return pool
+
+
+def pool_stats_delta(before: dict, after: dict) -> dict:
+    """
+    Metadata `db_pool_*` cho phần việc nằm giữa hai lần snapshot(); `after`
+    phải được lấy bằng snapshot(since=before) để max_wait_seconds là của khoảng đó.
+    """
+    delta = {
+        f"db_pool_{name}": round(after[name] - before[name], 3)
+        for name in PoolStats.__dataclass_fields__
+        if name != "max_wait_seconds"
+    }
+    delta["db_pool_max_wait_seconds"] = round(after["max_wait_seconds"], 3)
+    delta["db_pool_idle"] = after["idle"]
+    return delta
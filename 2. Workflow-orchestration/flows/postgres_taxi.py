@@ -1,11 +1,21 @@
 import gzip
 import os
+import shutil
+import time
 from contextlib import contextmanager
+from datetime import date, timedelta
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 
-import psycopg2
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 import requests
+from psycopg2 import extensions
 from dagster import (
+    AssetKey,
+    AssetMaterialization,
     Config,
     ConfigurableResource,
     EnvVar,
@@ -16,36 +26,81 @@ from dagster import (
     # highlight-start
     MonthlyPartitionsDefinition,  # <<< THÊM VÀO
     # highlight-end
+    MultiPartitionsDefinition,
+    StaticPartitionsDefinition,
 )
 
+from copy_loader import copy_arrow
+from download_cache import DownloadCache, cache_from_env
+from pg_pool import ConnectionPool, pool_stats_delta, shared_pool
+from taxi_metrics import CountingReader, LoadMetrics, export_openmetrics
+from taxi_quality import (
+    BatchQualityChecker,
+    audit_row_count,
+    check_staging,
+    ensure_load_audit_table,
+    load_zone_ids,
+    read_load_audit,
+    record_load,
+    verify_row_count,
+)
+from taxi_schema import LayoutCache, conform, csv_header, csv_read_options, get_schema, resolve_layout
+
 # =====================================================================================
 # RESOURCE DEFINITION
 # =====================================================================================
 class PostgresConnectionResource(ConfigurableResource):
-    """Simple psycopg2 wrapper that exposes a context-managed connection."""
+    """
+    psycopg2 wrapper that hands out context-managed connections from a pool
+    shared by every op/asset (and thread) of the process using the same DSN.
+    """
     host: str
     port: int
     db_name: str
     user: str
     password: str
+    pool_max_size: int = 8
+    pool_max_lifetime_seconds: float = 1800.0
+    pool_health_check_seconds: float = 30.0  # connection rảnh lâu hơn thì ping trước khi dùng
+    pool_timeout_seconds: float = 60.0
 
-    @contextmanager
-    def get_connection(self):
-        conn = psycopg2.connect(
+    def get_pool(self) -> ConnectionPool:
+        dsn = extensions.make_dsn(
             host=self.host,
             port=self.port,
             dbname=self.db_name,
             user=self.user,
             password=self.password,
         )
-        try:
-            yield conn
-            conn.commit()
-        except Exception:
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
+        return shared_pool(
+            dsn,
+            max_size=self.pool_max_size,
+            max_lifetime=self.pool_max_lifetime_seconds,
+            health_check_after=self.pool_health_check_seconds,
+            timeout=self.pool_timeout_seconds,
+        )
+
+    def pool_stats(self, since: Optional[dict] = None) -> dict:
+        return self.get_pool().snapshot(since)
+
+    @contextmanager
+    def get_connection(self):
+        with self.get_pool().connection() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+# Resource kết nối tới database taxi, dùng chung cho các job nạp dữ liệu
+taxi_db_resource = PostgresConnectionResource(
+    host=EnvVar("POSTGRES_HOST"),
+    port=EnvVar.int("POSTGRES_PORT"),
+    db_name=EnvVar("POSTGRES_DB"),
+    user=EnvVar("POSTGRES_USER"),
+    password=EnvVar("POSTGRES_PASSWORD"),
+)
 
 # highlight-start
 # =====================================================================================
@@ -53,21 +108,205 @@ class PostgresConnectionResource(ConfigurableResource):
 # =====================================================================================
 monthly_partitions = MonthlyPartitionsDefinition(start_date="2019-01-01")
 # highlight-end
+taxi_types = StaticPartitionsDefinition(["green", "yellow"])
+# Mỗi partition của job là một cặp (loại taxi, tháng), vd. "2021-01-01|green"
+taxi_month_partitions = MultiPartitionsDefinition({"taxi": taxi_types, "month": monthly_partitions})
+
+
+def taxi_and_month(context) -> tuple:
+    """(loại taxi, "YYYY-MM") của partition taxi × tháng đang chạy."""
+    keys = context.partition_key.keys_by_dimension
+    return keys["taxi"], keys["month"][:7]
+
+
+def report_load_metrics(context, metrics: LoadMetrics, taxi: str, month: str) -> None:
+    """Ghi metrics của op thành AssetObservation trên `<taxi>_tripdata` và file OpenMetrics (nếu bật)."""
+    context.log_event(metrics.observation(taxi, month))
+    export_openmetrics(
+        metrics,
+        f"{context.job_name}_{context.op.name}_{taxi}_{month}",
+        {"job": context.job_name, "op": context.op.name, "taxi": taxi, "month": month},
+        log=context.log,
+    )
+
+
+def report_tripdata_materialization(context, taxi: str, month: str, metadata: Optional[dict] = None) -> None:
+    """
+    Ghi AssetMaterialization cho partition tháng của `<taxi>_tripdata` khi một op
+    job (không phải asset job) đã nạp tháng đó, để trạng thái asset và
+    taxi_dbt_automation_sensor (dbt của đúng tháng đó) không phụ thuộc vào
+    việc tháng được nạp bằng đường nào.
+    """
+    context.log_event(
+        AssetMaterialization(
+            asset_key=AssetKey(f"{taxi}_tripdata"),
+            partition=f"{month}-01",
+            metadata=metadata or {},
+        )
+    )
+
+
+# =====================================================================================
+# CONCURRENCY - Giới hạn số lần nạp đồng thời vào Postgres
+# =====================================================================================
+# Tag của run: QueuedRunCoordinator giới hạn số run mang tag này (dagster.yaml)
+POSTGRES_LOAD_TAG = "postgres_load"
+# Pool của op nạp: giới hạn số op COPY/merge chạy cùng lúc trên toàn instance
+POSTGRES_LOAD_POOL = "postgres_taxi_load"
+# Phải khớp với limit của tag POSTGRES_LOAD_TAG trong dagster.yaml
+TAXI_LOAD_CONCURRENCY = int(os.getenv("TAXI_LOAD_CONCURRENCY", "4"))
 
 
 # highlight-start
 # =====================================================================================
-# CONFIGURATION - Đơn giản hóa Config, chỉ cần loại taxi
+# CONFIGURATION - Loại taxi và tháng được lấy từ partition
 # =====================================================================================
 class TaxiConfig(Config):
-    """Định nghĩa loại taxi, năm và tháng sẽ được lấy từ partition."""
-    taxi: str = "green"
+    """Cách nạp một partition; loại taxi và tháng được lấy từ partition key."""
+    # "disk": giải nén ra DAGSTER_HOME/storage rồi mới COPY (file được giữ lại cho lần retry)
+    # "pipe": giải nén response HTTP trực tiếp vào COPY ... FROM STDIN, không ghi CSV ra đĩa
+    # "parquet": chuyển tháng sang Parquet có kiểu một lần (giữ ở DAGSTER_HOME/storage/parquet),
+    #            op load đọc memory-mapped và nạp từng record batch bằng binary COPY
+    transfer_mode: str = "disk"
+    # Bảng đích được phân vùng theo tháng pickup (PARTITION BY RANGE), mỗi tháng
+    # của monthly_partitions là một bảng con
+    partitioned_target: bool = False
+    # Chỉ dùng với partitioned_target: nạp lại tháng bằng cách thay cả bảng con
+    # (detach/drop/attach) thay vì merge từng dòng với ON CONFLICT
+    replace_partition: bool = False
 # highlight-end
 
 
 # =====================================================================================
 # OPS (TASKS) - Các hàm Python thực hiện công việc
 # =====================================================================================
+# Có thể trỏ sang một mirror/HTTP server local (ví dụ khi test)
+TAXI_DATA_BASE_URL = os.getenv(
+    "TAXI_DATA_BASE_URL", "https://github.com/DataTalksClub/nyc-tlc-data/releases/download"
+)
+
+
+def taxi_file_url(taxi: str, month: str) -> str:
+    """URL file .csv.gz của một tháng ("YYYY-MM") cho loại taxi."""
+    return f"{TAXI_DATA_BASE_URL}/{taxi}/{taxi}_tripdata_{month}.csv.gz"
+
+
+# Kích thước mỗi lần đọc/ghi khi giải nén: bộ nhớ dùng cố định, không phụ thuộc kích thước file
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+@contextmanager
+def open_taxi_stream(taxi: str, month: str, log=None):
+    """Mở file .csv.gz của một tháng dưới dạng stream CSV đã giải nén (đọc dần từ HTTP)."""
+    url = taxi_file_url(taxi, month)
+    if log:
+        log.info(f"Streaming partition {month} from {url}")
+    with requests.get(url, stream=True) as r:
+        r.raise_for_status()
+        with gzip.GzipFile(fileobj=r.raw) as gz:
+            yield gz
+
+
+@lru_cache(maxsize=None)
+def taxi_download_cache() -> DownloadCache:
+    """
+    Cache dùng chung cho mọi lần tải file .csv.gz trong process, mặc định ở
+    $DAGSTER_HOME/storage/download_cache (xem DOWNLOAD_CACHE_DIR/_MAX_GB).
+    """
+    return cache_from_env(Path(os.environ["DAGSTER_HOME"]) / "storage" / "download_cache")
+
+
+def download_taxi_file(taxi: str, month: str, dest_dir: Path, log=None, metrics: Optional[LoadMetrics] = None) -> Path:
+    """
+    Tải file .csv.gz của một tháng (qua download cache), giải nén vào `dest_dir` và trả về đường dẫn file CSV.
+    Thời gian/số byte của hai giai đoạn download và decompress được ghi vào `metrics` nếu có.
+    """
+    metrics = metrics or LoadMetrics()
+    filename = f"{taxi}_tripdata_{month}.csv"
+    local_path = dest_dir / filename
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # File chỉ xuất hiện dưới tên cuối cùng khi đã giải nén xong (rename ở dưới),
+    # nên một lần retry có thể dùng lại nó thay vì tải lại.
+    if local_path.exists():
+        if log:
+            log.info(f"Reusing {local_path} from a previous attempt")
+        return local_path
+
+    partial_path = local_path.with_name(filename + ".part")
+    if log:
+        log.info(f"Downloading for partition {month} from {taxi_file_url(taxi, month)} to {local_path}")
+    # File .csv.gz gốc nằm trong cache (không bị evict khi đang giải nén);
+    # chỉ bản giải nén là riêng của lần chạy này
+    started = time.perf_counter()
+    with taxi_download_cache().use(taxi_file_url(taxi, month), log=log) as fetched:
+        metrics.record("download", time.perf_counter() - started, nbytes=fetched.bytes_downloaded)
+        with metrics.stage("decompress") as stage:
+            with gzip.open(fetched.path, "rb") as gz, open(partial_path, "wb") as f_out:
+                shutil.copyfileobj(gz, f_out, STREAM_CHUNK_SIZE)
+            stage.bytes = partial_path.stat().st_size
+    partial_path.replace(local_path)
+
+    return local_path
+
+
+# Số dòng mỗi record batch khi đọc Parquet để COPY
+PARQUET_BATCH_ROWS = 64 * 1024
+
+
+@lru_cache(maxsize=None)
+def taxi_layout_cache() -> LayoutCache:
+    """Layout cột của từng phiên bản file nguồn, lưu ở $DAGSTER_HOME/storage/layouts."""
+    return LayoutCache(Path(os.environ["DAGSTER_HOME"]) / "storage" / "layouts")
+
+
+def convert_taxi_file_to_parquet(
+    taxi: str, month: str, dest_dir: Path, log=None, metrics: Optional[LoadMetrics] = None
+) -> Path:
+    """
+    Tải file .csv.gz của một tháng (qua download cache) và chuyển một lần sang
+    Parquet có kiểu của taxi_schema (nén zstd), đọc CSV theo từng block bằng
+    pyarrow.csv nên bộ nhớ không phụ thuộc kích thước file. File Parquet được giữ lại và dùng lại
+    cho tới khi file nguồn đổi (sha256 của nguồn nằm trong metadata của nó).
+    """
+    metrics = metrics or LoadMetrics()
+    local_path = dest_dir / f"{taxi}_tripdata_{month}.parquet"
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    # Object trong cache không bị evict khi đang được đọc
+    started = time.perf_counter()
+    with taxi_download_cache().use(taxi_file_url(taxi, month), log=log) as fetched:
+        metrics.record("download", time.perf_counter() - started, nbytes=fetched.bytes_downloaded)
+        version = (fetched.sha256 or "").encode()
+
+        if local_path.exists() and pq.read_schema(local_path).metadata.get(b"source_sha256") == version:
+            if log:
+                log.info(f"Reusing {local_path} (source unchanged)")
+            return local_path
+
+        schema = get_schema(taxi)
+        layout = taxi_layout_cache().get(schema, fetched.sha256, lambda: csv_header(fetched.path, "gzip"))
+        read_options, convert_options = csv_read_options(schema, layout)
+        partial_path = local_path.with_name(local_path.name + ".part")
+        if log:
+            log.info(f"Converting {taxi_file_url(taxi, month)} to {local_path}")
+        # Giải nén, parse CSV và ghi Parquet chạy xen kẽ nhau: tính chung là "convert"
+        with metrics.stage("convert") as stage:
+            stage.rows = 0
+            with pa.input_stream(str(fetched.path), compression="gzip") as raw, \
+                    pa_csv.open_csv(raw, read_options=read_options, convert_options=convert_options) as reader, \
+                    pq.ParquetWriter(partial_path, schema.arrow_schema().with_metadata({"source_sha256": version}),
+                                     compression="zstd") as writer:
+                for batch in reader:
+                    batch = conform(batch, schema, layout)
+                    writer.write_batch(batch)
+                    stage.rows += batch.num_rows
+            stage.bytes = fetched.size
+    partial_path.replace(local_path)
+    if log:
+        log.info(f"Wrote {stage.rows} rows to {local_path} in {stage.seconds:.1f}s")
+    return local_path
+
+
 @op(description="Tải và giải nén dữ liệu taxi từ URL dựa trên partition key")
 def extract_taxi_data(context: OpExecutionContext, config: TaxiConfig) -> Path:
     """
@@ -75,29 +314,396 @@ def extract_taxi_data(context: OpExecutionContext, config: TaxiConfig) -> Path:
     Ngày tháng giờ đây được lấy từ partition context.
     """
     # highlight-start
-    # context.partition_key sẽ là một chuỗi như "2025-10-01"
-    # Chúng ta chỉ cần lấy phần năm-tháng từ nó.
-    partition_date_str = context.partition_key[:7]  # Lấy "YYYY-MM"
+    # context.partition_key là một cặp như "2025-10-01|green"
+    taxi, partition_date_str = taxi_and_month(context)  # ("green", "YYYY-MM")
     # highlight-end
 
-    filename = f"{config.taxi}_tripdata_{partition_date_str}.csv"
-    url = f"https://github.com/DataTalksClub/nyc-tlc-data/releases/download/{config.taxi}/{filename}.gz"
-    
-    local_path = Path(os.environ["DAGSTER_HOME"]) / "storage" / filename
-    local_path.parent.mkdir(parents=True, exist_ok=True)
+    storage_dir = Path(os.environ["DAGSTER_HOME"]) / "storage"
+    if config.transfer_mode == "pipe":
+        # Không tải gì ở đây: op load sẽ stream thẳng từ URL vào COPY.
+        # Path trả về chỉ mang tên file (dùng cho cột filename).
+        context.log.info(f"Pipe mode: partition {partition_date_str} will be streamed during load")
+        return storage_dir / f"{taxi}_tripdata_{partition_date_str}.csv"
+    if config.transfer_mode not in ("disk", "parquet"):
+        raise ValueError(f"Unsupported transfer mode: {config.transfer_mode}")
 
-    context.log.info(f"Downloading for partition {partition_date_str} from {url} to {local_path}")
+    cache = taxi_download_cache()
+    before = cache.stats.as_dict()
+    metrics = LoadMetrics()
+    if config.transfer_mode == "parquet":
+        file_path = convert_taxi_file_to_parquet(
+            taxi, partition_date_str, storage_dir / "parquet", log=context.log, metrics=metrics
+        )
+    else:
+        file_path = download_taxi_file(taxi, partition_date_str, storage_dir, log=context.log, metrics=metrics)
+    after = cache.stats.as_dict()
+    context.log.info(
+        f"Download cache: {after['hits']} hits / {after['misses']} misses in this process, "
+        f"{after['bytes_downloaded']} bytes downloaded"
+    )
+    context.add_output_metadata({
+        **{f"download_cache_{name}": after[name] - before[name] for name in after},
+        **metrics.to_metadata(),
+    })
+    report_load_metrics(context, metrics, taxi, partition_date_str)
+    return file_path
+
+
+def _month_bounds(month: str):
+    """"YYYY-MM" -> (ngày đầu tháng, ngày đầu tháng sau) dạng ISO."""
+    start = date.fromisoformat(f"{month}-01")
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start.isoformat(), end.isoformat()
 
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(local_path, "wb") as f_out:
-            with gzip.GzipFile(fileobj=r.raw) as gz:
-                f_out.write(gz.read())
-    
-    return local_path
 
+def month_partition_name(table_name: str, month: str) -> str:
+    """Tên bảng con của một tháng, vd. public.green_tripdata_2021_01."""
+    return f"{table_name}_{month.replace('-', '_')}"
 
-@op(description="Nạp dữ liệu vào Staging table và biến đổi trong PostgreSQL")
+
+def _ensure_month_partitions(cursor, table_name: str, pickup_col: str, months, log) -> None:
+    """
+    Đảm bảo bảng đích là bảng phân vùng và có đủ bảng con cho `months`.
+
+    Bảng con mới được tạo rời, nhận các dòng cùng tháng đang nằm trong
+    partition DEFAULT, rồi mới ATTACH (nếu không, ATTACH sẽ lỗi khi DEFAULT
+    đã chứa dòng thuộc tháng đó).
+    """
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s));", (table_name,))
+    if not cursor.fetchone()[0]:
+        raise ValueError(
+            f"{table_name} already exists as a regular table; drop or migrate it before enabling partitioned_target"
+        )
+    default_partition = f"{table_name}_default"
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {default_partition} PARTITION OF {table_name} DEFAULT;")
+
+    def missing_months():
+        cursor.execute(
+            "SELECT c.oid::regclass::text FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s);",
+            (table_name,),
+        )
+        existing = {name if "." in name else f"public.{name}" for (name,) in cursor.fetchall()}
+        return [m for m in months if month_partition_name(table_name, m) not in existing]
+
+    if not missing_months():
+        return
+
+    # Tạo bảng con lần lượt giữa các lần nạp song song. Đọc lại danh sách sau
+    # khi có khóa: lần nạp giữ khóa trước có thể vừa ATTACH chính các tháng đó.
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (table_name,))
+    missing = missing_months()
+    if not missing:
+        return
+    if log:
+        log.info(f"Creating {len(missing)} monthly partition(s) of {table_name}...")
+    for month in missing:
+        child = month_partition_name(table_name, month)
+        lower, upper = _month_bounds(month)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {child} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);")
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {default_partition}
+                WHERE {pickup_col} >= %(lower)s AND {pickup_col} < %(upper)s
+                RETURNING *
+            )
+            INSERT INTO {child} SELECT * FROM moved;
+            """,
+            {"lower": lower, "upper": upper},
+        )
+        cursor.execute(
+            f"ALTER TABLE {table_name} ATTACH PARTITION {child} FOR VALUES FROM (%(lower)s) TO (%(upper)s);",
+            {"lower": lower, "upper": upper},
+        )
+
+
+def _ensure_raw_indexes(cursor, table_name: str, pickup_col: str, log) -> None:
+    """
+    Index hỗ trợ các model staging của dbt: lọc theo tháng pickup và khử trùng
+    lặp theo (pickup, vendorid) mà không phải sắp xếp lại toàn bộ lịch sử.
+    Với bảng phân vùng, index trên bảng cha được tạo cho mọi bảng con.
+    """
+    index_name = f"{table_name.split('.')[-1]}_pickup_vendor_idx"
+    cursor.execute("SELECT to_regclass(%s) IS NULL;", (f"public.{index_name}",))
+    if not cursor.fetchone()[0]:
+        return
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (index_name,))
+    if log:
+        log.info(f"Creating index {index_name} on {table_name} ({pickup_col}, vendorid)...")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({pickup_col}, vendorid);")
+
+
+def _swap_month_partition(cursor, table_name, child, pickup_col, insert_sql, params, log) -> int:
+    """
+    Nạp lại một tháng bằng cách dựng bảng con mới rồi hoán đổi với bảng cũ.
+    Trả về số dòng của bảng con mới.
+    """
+    new_child = f"{child}_new"
+    short_name = child.split(".")[-1]
+    if log:
+        log.info(f"Rebuilding partition {child} and swapping it in...")
+    cursor.execute(f"DROP TABLE IF EXISTS {new_child};")
+    cursor.execute(f"CREATE TABLE {new_child} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);")
+    cursor.execute(f"ALTER TABLE {new_child} ADD PRIMARY KEY (unique_row_id, {pickup_col});")
+    # CHECK trùng với ràng buộc partition giúp ATTACH không phải quét lại bảng
+    cursor.execute(
+        f"ALTER TABLE {new_child} ADD CONSTRAINT {short_name}_bounds "
+        f"CHECK ({pickup_col} IS NOT NULL AND {pickup_col} >= %(lower)s AND {pickup_col} < %(upper)s);",
+        params,
+    )
+    cursor.execute(insert_sql, params)
+    rows = cursor.rowcount
+
+    cursor.execute(f"ALTER TABLE {table_name} DETACH PARTITION {child};")
+    cursor.execute(f"DROP TABLE {child};")
+    cursor.execute(f"ALTER TABLE {new_child} RENAME TO {short_name};")
+    cursor.execute(
+        f"ALTER TABLE {table_name} ATTACH PARTITION {child} FOR VALUES FROM (%(lower)s) TO (%(upper)s);", params
+    )
+    cursor.execute(f"ALTER TABLE {child} DROP CONSTRAINT {short_name}_bounds;")
+    return rows
+
+
+def _csv_copy_sql(schema, staging_table_name: str, reader) -> str:
+    """
+    Đọc dòng header từ `reader` rồi tạo câu COPY CSV với danh sách cột theo
+    thứ tự của file (file cũ/mới có thể đổi thứ tự hoặc thiếu cột; cột thiếu
+    là NULL). COPY không bỏ qua được cột thừa: file như vậy phải nạp qua Parquet.
+    """
+    header = reader.readline().decode("utf-8").strip().split(",")
+    layout = resolve_layout(schema, header)
+    if layout.extra:
+        raise ValueError(
+            f"CSV has columns not in the {schema.name} registry {layout.extra}; "
+            "load it with transfer_mode=\"parquet\""
+        )
+    return f"COPY {staging_table_name} ({','.join(layout.mapping.values())}) FROM STDIN WITH (FORMAT csv)"
+
+
+def load_taxi_file(
+    conn,
+    taxi: str,
+    file_path: Path,
+    log,
+    stream=None,
+    partitioned: bool = False,
+    replace_partition: bool = False,
+    metrics: Optional[LoadMetrics] = None,
+    verify: bool = True,
+) -> int:
+    """
+    Thực hiện toàn bộ logic ELT trong PostgreSQL cho một file CSV trên một
+    connection có sẵn. Trả về số dòng mới được merge vào bảng chính.
+
+    Nếu có `stream` (CSV đã giải nén, kể cả dòng header), dữ liệu được COPY
+    trực tiếp từ stream đó; `file_path` khi ấy chỉ dùng để lấy tên file.
+    Cột của CSV được COPY theo thứ tự trong header của file (_csv_copy_sql).
+    File `.parquet` (xem convert_taxi_file_to_parquet) được nạp theo từng
+    record batch bằng binary COPY, không parse lại CSV.
+
+    Thời gian, số dòng và số byte của các giai đoạn prepare (DDL), copy và
+    merge, cùng số dòng insert / bỏ qua vì trùng, được ghi vào `metrics`.
+
+    Mỗi lần nạp cũng được kiểm tra mà không quét lại bảng chính (taxi_quality.py):
+    kiểm tra chất lượng trên từng record batch (Parquet) hoặc một lần trên bảng
+    staging (CSV), số dòng của tháng được ghi vào `load_audit` cùng transaction,
+    rồi tổng đó được so với `pg_class.reltuples` của bảng đích.
+    `verify=False` bỏ qua cả ba bước (vd. khi chỉ cần dữ liệu cho benchmark).
+
+    Với `partitioned=True`, bảng đích là bảng PARTITION BY RANGE theo tháng
+    pickup: merge chỉ chạm vào bảng con của tháng đang nạp, còn các dòng lệch
+    tháng được định tuyến qua bảng cha. `replace_partition=True` thay toàn bộ
+    bảng con của tháng bằng dữ liệu mới (detach/drop/attach).
+    """
+    # Lấy tên file từ đối tượng Path; bản Parquet vẫn mang tên file CSV gốc
+    filename = file_path.with_suffix(".csv").name if file_path.suffix == ".parquet" else file_path.name
+    table_name = f"public.{taxi}_tripdata"
+    # Staging riêng cho từng partition (vd. public.green_tripdata_2021_01_staging):
+    # các tháng khác nhau có thể nạp song song mà không đụng nhau.
+    staging_table_name = f"public.{file_path.stem.replace('-', '_')}_staging"
+
+    schema = get_schema(taxi)
+    pickup_col = schema.pickup_column
+    columns = schema.column_names
+    column_defs = schema.column_defs()
+    create_table_ddl = f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                unique_row_id text PRIMARY KEY, filename text, {column_defs}
+            );
+        """
+
+    if replace_partition and not partitioned:
+        raise ValueError("replace_partition requires partitioned=True")
+    month = file_path.stem.rsplit("_", 1)[-1]  # "YYYY-MM"
+
+    # Tạo câu lệnh SQL động
+    # Staging chỉ chứa các cột dữ liệu thô: unique_row_id và filename được tính
+    # ngay trong câu INSERT ... SELECT lúc merge, không cần UPDATE lại staging.
+    # UNLOGGED: dữ liệu staging chỉ sống trong một lần nạp nên không cần ghi WAL.
+    create_staging_table_ddl = (
+        create_table_ddl
+        .replace("CREATE TABLE IF NOT EXISTS", "CREATE UNLOGGED TABLE")
+        .replace(table_name, staging_table_name)
+        .replace("unique_row_id text PRIMARY KEY, filename text, ", "")
+    )
+    columns_str = ",".join(columns)
+
+    if partitioned:
+        # Khóa chính của bảng phân vùng phải chứa cột phân vùng
+        create_table_ddl = (
+            create_table_ddl
+            .replace("unique_row_id text PRIMARY KEY", "unique_row_id text")
+            .rstrip().removesuffix(");")
+            + f", PRIMARY KEY (unique_row_id, {pickup_col})) PARTITION BY RANGE ({pickup_col});"
+        )
+        conflict_target = f"unique_row_id, {pickup_col}"
+    else:
+        conflict_target = "unique_row_id"
+
+    unique_row_id_expr = schema.row_hash_sql()
+
+    # ORDER BY: các partition merge song song luôn khóa khóa chính theo cùng thứ
+    # tự, nên các dòng trùng giữa hai tháng không gây deadlock.
+    def merge_sql(target, where="TRUE"):
+        return f"""
+            INSERT INTO {target} (unique_row_id, filename, {columns_str})
+            SELECT {unique_row_id_expr}, %(filename)s, {columns_str}
+            FROM {staging_table_name}
+            WHERE {where}
+            ORDER BY 1
+            ON CONFLICT ({conflict_target}) DO NOTHING;
+        """
+
+    in_month = f"{pickup_col} >= %(lower)s AND {pickup_col} < %(upper)s"
+    lower, upper = _month_bounds(month)
+    merge_params = {"filename": filename, "lower": lower, "upper": upper}
+    metrics = metrics if metrics is not None else LoadMetrics()
+
+    with conn.cursor() as cursor, metrics.stage("prepare"):
+        # Hai lần nạp cùng một partition vẫn phải chạy lần lượt (khóa đến hết
+        # transaction); các partition khác nhau không chờ nhau.
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (staging_table_name,))
+
+        if log:
+            log.info(f"Creating tables for {taxi} taxi...")
+        cursor.execute("SELECT to_regclass(%s) IS NULL;", (table_name,))
+        if cursor.fetchone()[0]:
+            # Chỉ lần nạp đầu tiên: các partition đang nạp song song chờ nhau
+            # tạo bảng chính để tránh xung đột CREATE TABLE trong catalog.
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (table_name,))
+        cursor.execute(create_table_ddl)
+        if partitioned:
+            months = [key[:7] for key in monthly_partitions.get_partition_keys()]
+            _ensure_month_partitions(cursor, table_name, pickup_col, sorted(set(months + [month])), log)
+        _ensure_raw_indexes(cursor, table_name, pickup_col, log)
+        if verify:
+            ensure_load_audit_table(cursor)
+        # Staging được tạo và xóa trong cùng transaction với merge: nếu lần nạp
+        # lỗi, ROLLBACK cũng xóa luôn staging.
+        cursor.execute(f"DROP TABLE IF EXISTS {staging_table_name};")
+        cursor.execute(create_staging_table_ddl)
+
+    with conn.cursor() as cursor:
+        checker = None
+        with metrics.stage("copy") as stage:
+            if stream is not None:
+                if log:
+                    log.info(f"Copying streamed {filename} to {staging_table_name}...")
+                reader = CountingReader(stream)
+                cursor.copy_expert(_csv_copy_sql(schema, staging_table_name, reader), reader, size=STREAM_CHUNK_SIZE)
+                stage.rows, stage.bytes = cursor.rowcount, reader.bytes_read
+            elif file_path.suffix == ".parquet":
+                if log:
+                    log.info(f"Copying record batches of {file_path} to {staging_table_name} (binary COPY)...")
+                parquet_file = pq.ParquetFile(file_path, memory_map=True)
+                staging_columns = [name.lower() for name in columns]
+                stage.rows, stage.bytes = 0, 0
+                checker = BatchQualityChecker(schema, load_zone_ids()) if verify else None
+                check_seconds = 0.0
+                for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_ROWS, columns=columns):
+                    if checker is not None:
+                        started = time.perf_counter()
+                        checker.check(batch)
+                        check_seconds += time.perf_counter() - started
+                    stage.rows += copy_arrow(cursor, batch, staging_table_name, staging_columns, fmt="binary")
+                    stage.bytes += batch.nbytes
+            else:
+                if log:
+                    log.info(f"Copying data from {file_path} to {staging_table_name}...")
+                with open(file_path, "rb") as f:
+                    reader = CountingReader(f)
+                    cursor.copy_expert(_csv_copy_sql(schema, staging_table_name, reader), reader, size=STREAM_CHUNK_SIZE)
+                stage.rows, stage.bytes = cursor.rowcount, reader.bytes_read
+        if checker is not None:
+            # Kiểm tra chạy xen kẽ với COPY: tách thời gian của nó ra khỏi giai đoạn copy
+            stage.seconds -= check_seconds
+            metrics.quality = checker.report
+            metrics.record("check", check_seconds, rows=metrics.quality.rows)
+        elif verify:
+            # COPY CSV không đi qua Python: chạy cùng các kiểm tra một lần trên staging
+            with metrics.stage("check") as check_stage:
+                metrics.quality = check_staging(cursor, schema, staging_table_name, load_zone_ids())
+                check_stage.rows = metrics.quality.rows
+        if log:
+            log.info(f"Copy complete: {stage.rows} rows in {stage.seconds:.1f}s.")
+        if log and metrics.quality is not None:
+            log.info(f"Data quality: {metrics.quality.summary()}")
+
+        # unique_row_id được tính ngay trong câu INSERT ... SELECT nên thời gian
+        # hash nằm trong giai đoạn merge.
+        if log:
+            log.info("Merging data into main table (computing unique_row_id and filename)...")
+        with metrics.stage("merge") as stage:
+            if not partitioned:
+                cursor.execute(merge_sql(table_name), merge_params)
+                merged_rows = cursor.rowcount
+            else:
+                child = month_partition_name(table_name, month)
+                if replace_partition:
+                    merged_rows = _swap_month_partition(
+                        cursor, table_name, child, pickup_col, merge_sql(f"{child}_new", in_month), merge_params, log
+                    )
+                    # Các dòng lệch tháng của lần nạp trước nằm trong DEFAULT
+                    cursor.execute(f"DELETE FROM {table_name}_default WHERE filename = %(filename)s;", merge_params)
+                else:
+                    cursor.execute(merge_sql(child, in_month), merge_params)
+                    merged_rows = cursor.rowcount
+                # Dòng có pickup ngoài tháng của file: để Postgres định tuyến qua bảng cha
+                cursor.execute(
+                    merge_sql(table_name, f"{pickup_col} IS NOT NULL AND NOT ({in_month})"), merge_params
+                )
+                merged_rows += cursor.rowcount
+            stage.rows = metrics.stages["copy"].rows
+        if log:
+            log.info(f"Merge complete. {merged_rows} rows affected in {stage.seconds:.1f}s.")
+        metrics.rows_inserted = merged_rows
+        if stage.rows is not None and stage.rows >= 0:
+            metrics.rows_skipped = max(stage.rows - merged_rows, 0)
+
+        cursor.execute(f"DROP TABLE {staging_table_name};")
+        if not verify:
+            return merged_rows
+
+        # Số dòng của tháng: thay hẳn khi dựng lại bảng con, ngược lại cộng thêm số dòng mới
+        month_rows = merged_rows
+        if not replace_partition:
+            previous = read_load_audit(cursor, table_name, month)
+            month_rows += previous[0] if previous else 0
+        record_load(cursor, table_name, month, month_rows, metrics.quality, source=filename)
+        with metrics.stage("verify"):
+            analyze = [month_partition_name(table_name, month), f"{table_name}_default"] if partitioned else [table_name]
+            metrics.row_count = verify_row_count(cursor, table_name, audit_row_count(cursor, table_name), analyze)
+        check = metrics.row_count
+        message = f"{table_name}: {check.catalog_rows} rows in pg_class.reltuples, {check.audit_rows} in load_audit"
+        if log and check.matches:
+            log.info(message)
+        elif log:
+            log.warning(f"{message} (months loaded before load_audit existed are not counted)")
+        return merged_rows
+
+
+@op(description="Nạp dữ liệu vào Staging table và biến đổi trong PostgreSQL", pool=POSTGRES_LOAD_POOL)
 def load_and_transform_in_postgres(
     context: OpExecutionContext,
     config: TaxiConfig,
@@ -107,107 +713,26 @@ def load_and_transform_in_postgres(
     """
     Thực hiện toàn bộ logic ELT trong PostgreSQL.
     """
-    # highlight-start
-    filename = file_path.name  # Lấy tên file từ đối tượng Path
-    # highlight-end
-    table_name = f"public.{config.taxi}_tripdata"
-    staging_table_name = f"{table_name}_staging"
-
-    # --- Logic điều kiện để chọn đúng câu lệnh SQL ---
-    if config.taxi == "yellow":
-        # Cấu trúc cho Yellow Taxi
-        pickup_col = "tpep_pickup_datetime"
-        dropoff_col = "tpep_dropoff_datetime"
-        columns = [
-            "VendorID", "tpep_pickup_datetime", "tpep_dropoff_datetime", "passenger_count",
-            "trip_distance", "RatecodeID", "store_and_fwd_flag", "PULocationID",
-            "DOLocationID", "payment_type", "fare_amount", "extra", "mta_tax",
-            "tip_amount", "tolls_amount", "improvement_surcharge", "total_amount",
-            "congestion_surcharge"
-        ]
-        create_table_ddl = f"""
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                unique_row_id text PRIMARY KEY, filename text, VendorID text, 
-                tpep_pickup_datetime timestamp, tpep_dropoff_datetime timestamp, 
-                passenger_count integer, trip_distance double precision, RatecodeID text, 
-                store_and_fwd_flag text, PULocationID text, DOLocationID text, 
-                payment_type integer, fare_amount double precision, extra double precision, 
-                mta_tax double precision, tip_amount double precision, tolls_amount double precision, 
-                improvement_surcharge double precision, total_amount double precision, 
-                congestion_surcharge double precision
-            );
-        """
-    elif config.taxi == "green":
-        # Cấu trúc cho Green Taxi
-        pickup_col = "lpep_pickup_datetime"
-        dropoff_col = "lpep_dropoff_datetime"
-        columns = [
-            "VendorID", "lpep_pickup_datetime", "lpep_dropoff_datetime",
-            "store_and_fwd_flag", "RatecodeID", "PULocationID", "DOLocationID",
-            "passenger_count", "trip_distance", "fare_amount", "extra", "mta_tax",
-            "tip_amount", "tolls_amount", "ehail_fee", "improvement_surcharge",
-            "total_amount", "payment_type", "trip_type", "congestion_surcharge"
-        ]
-        create_table_ddl = f"""
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                unique_row_id text PRIMARY KEY, filename text, VendorID text, 
-                lpep_pickup_datetime timestamp, lpep_dropoff_datetime timestamp, 
-                store_and_fwd_flag text, RatecodeID text, PULocationID text, DOLocationID text, 
-                passenger_count integer, trip_distance double precision, fare_amount double precision, 
-                extra double precision, mta_tax double precision, tip_amount double precision, 
-                tolls_amount double precision, ehail_fee double precision, 
-                improvement_surcharge double precision, total_amount double precision, 
-                payment_type integer, trip_type integer, congestion_surcharge double precision
-            );
-        """
-    else:
-        raise ValueError(f"Unsupported taxi type: {config.taxi}")
-    
-    # Tạo câu lệnh SQL động
-    create_staging_table_ddl = create_table_ddl.replace(table_name, staging_table_name).replace(" PRIMARY KEY", "")
-    columns_str = ",".join(columns)
-    
-    update_staging_sql = f"""
-        UPDATE {staging_table_name}
-        SET 
-            unique_row_id = md5(
-                COALESCE(CAST(VendorID AS text), '') ||
-                COALESCE(CAST({pickup_col} AS text), '') || 
-                COALESCE(CAST({dropoff_col} AS text), '') || 
-                COALESCE(PULocationID, '') || 
-                COALESCE(DOLocationID, '') || 
-                COALESCE(CAST(fare_amount AS text), '') || 
-                COALESCE(CAST(trip_distance AS text), '')
-            ),
-            filename = '{filename}';
-    """
-    
-    merge_sql = f"""
-        INSERT INTO {table_name}
-        SELECT * FROM {staging_table_name}
-        ON CONFLICT (unique_row_id) DO NOTHING;
-    """
-    
+    target_options = {
+        "partitioned": config.partitioned_target,
+        "replace_partition": config.replace_partition,
+    }
+    taxi, month = taxi_and_month(context)
+    metrics = LoadMetrics()
+    pool_before = db.pool_stats()
     with db.get_connection() as conn:
-        with conn.cursor() as cursor:
-            context.log.info(f"Creating tables for {config.taxi} taxi...")
-            cursor.execute(create_table_ddl)
-            cursor.execute(create_staging_table_ddl)
-
-            context.log.info(f"Truncating staging table {staging_table_name}...")
-            cursor.execute(f"TRUNCATE TABLE {staging_table_name};")
-
-            context.log.info(f"Copying data from {file_path} to {staging_table_name}...")
-            with open(file_path, "r") as f:
-                next(f)
-                cursor.copy_expert(f"COPY {staging_table_name} ({columns_str}) FROM STDIN WITH CSV", f)
-            
-            context.log.info("Adding unique_row_id and filename...")
-            cursor.execute(update_staging_sql)
-
-            context.log.info("Merging data into main table...")
-            cursor.execute(merge_sql)
-            context.log.info(f"Merge complete. {cursor.rowcount} rows affected.")
+        if config.transfer_mode == "pipe":
+            with open_taxi_stream(taxi, month, log=context.log) as stream:
+                load_taxi_file(conn, taxi, file_path, context.log, stream=stream, metrics=metrics, **target_options)
+        else:
+            load_taxi_file(conn, taxi, file_path, context.log, metrics=metrics, **target_options)
+    context.add_output_metadata({
+        **pool_stats_delta(pool_before, db.pool_stats(since=pool_before)),
+        **metrics.to_metadata(),
+    })
+    report_load_metrics(context, metrics, taxi, month)
+    report_tripdata_materialization(context, taxi, month, {"job": context.job_name})
+
 
 # =====================================================================================
 # JOB - Kết nối các op thành một pipeline
@@ -215,17 +740,10 @@ def load_and_transform_in_postgres(
 @job(
     description="Pipeline tải dữ liệu taxi NYC và nạp vào PostgreSQL, hỗ trợ partitions.",
     # highlight-start
-    partitions_def=monthly_partitions,  # <<< GẮN ĐỊNH NGHĨA PARTITIONS VÀO JOB
+    partitions_def=taxi_month_partitions,  # <<< GẮN ĐỊNH NGHĨA PARTITIONS VÀO JOB (taxi × tháng)
     # highlight-end
-    resource_defs={
-        "db": PostgresConnectionResource(
-            host=EnvVar("POSTGRES_HOST"),
-            port=EnvVar.int("POSTGRES_PORT"),
-            db_name=EnvVar("POSTGRES_DB"),
-            user=EnvVar("POSTGRES_USER"),
-            password=EnvVar("POSTGRES_PASSWORD"),
-        )
-    },
+    resource_defs={"db": taxi_db_resource},
+    tags={POSTGRES_LOAD_TAG: "taxi"},
 )
 def postgres_taxi_pipeline():
     """Định nghĩa luồng công việc: extract -> load_and_transform."""
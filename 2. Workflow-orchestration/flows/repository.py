@@ -1,47 +1,57 @@
-from dagster import repository, schedule, RunRequest, ScheduleEvaluationContext
+from dagster import (
+    AssetKey,
+    RunRequest,
+    ScheduleEvaluationContext,
+    repository,
+    schedule,
+)
 
 # Import các job từ các file tương ứng
 from getting_started_data_pipeline import getting_started_data_pipeline
-from postgres_taxi import postgres_taxi_pipeline
+from postgres_taxi import monthly_partitions, postgres_taxi_pipeline
+from taxi_backfill import postgres_taxi_backfill, taxi_missing_partitions_sensor
 from dbt_pipeline import dbt_pipeline
+from duckdb_revenue import duckdb_revenue_pipeline
+from taxi_assets import taxi_assets, taxi_dbt_automation_sensor, taxi_tripdata_assets_job
 
 # =============================================================================
 # LỊCH TRÌNH (SCHEDULES)
 # =============================================================================
 
+def taxi_month_run_request(taxi: str, context: ScheduleEvaluationContext) -> RunRequest:
+    """
+    RunRequest materialize asset `<taxi>_tripdata` cho tháng trọn vẹn gần nhất
+    tại thời điểm chạy. Tháng hiện tại chưa phải là partition (chưa kết thúc),
+    nên lịch ngày 1 nạp tháng vừa qua; taxi_dbt_automation_sensor sau đó chạy
+    dbt cho đúng tháng đó.
+    """
+    # context.scheduled_execution_time tương đương với trigger.date của Kestra
+    dt = context.scheduled_execution_time
+    month_key = monthly_partitions.get_partition_keys(current_time=dt)[-1]
+    return RunRequest(
+        run_key=f"{taxi}_{month_key[:7].replace('-', '_')}",
+        partition_key=month_key,
+        asset_selection=[AssetKey(f"{taxi}_tripdata")],
+    )
+
+
 # Tương đương với trigger `yellow_schedule` của Kestra
 @schedule(
-    job=postgres_taxi_pipeline,
+    job=taxi_tripdata_assets_job,
     cron_schedule="0 10 1 * *",  # Chạy lúc 10:00 AM ngày 1 hàng tháng
     execution_timezone="Asia/Ho_Chi_Minh",
 )
 def yellow_taxi_monthly_schedule(context: ScheduleEvaluationContext):
     """
     Lịch trình này chạy hàng tháng để tải dữ liệu yellow taxi.
-    Nó tự động xác định năm và tháng dựa trên ngày chạy.
+    Tháng được xác định từ ngày chạy và truyền qua partition key.
     """
-    # context.scheduled_execution_time tương đương với trigger.date của Kestra
-    dt = context.scheduled_execution_time
-    
-    # Định dạng lại ngày tháng để lấy năm và tháng
-    run_key = f"yellow_{dt.strftime('%Y_%m')}"
-    year = dt.strftime("%Y")
-    month = dt.strftime("%m")
-
-    # Tạo run_config động để truyền vào job
-    run_config = {
-        "ops": {
-            "extract_taxi_data": {"config": {"taxi": "yellow", "year": year, "month": month}},
-            "load_and_transform_in_postgres": {"config": {"taxi": "yellow", "year": year, "month": month}},
-        }
-    }
-    
-    return RunRequest(run_key=run_key, run_config=run_config)
+    return taxi_month_run_request("yellow", context)
 
 
 # Tương đương với trigger `green_schedule` của Kestra
 @schedule(
-    job=postgres_taxi_pipeline,
+    job=taxi_tripdata_assets_job,
     cron_schedule="0 9 1 * *",  # Chạy lúc 9:00 AM ngày 1 hàng tháng
     execution_timezone="Asia/Ho_Chi_Minh",
 )
@@ -49,20 +59,7 @@ def green_taxi_monthly_schedule(context: ScheduleEvaluationContext):
     """
     Lịch trình này chạy hàng tháng để tải dữ liệu green taxi.
     """
-    dt = context.scheduled_execution_time
-    
-    run_key = f"green_{dt.strftime('%Y_%m')}"
-    year = dt.strftime("%Y")
-    month = dt.strftime("%m")
-
-    run_config = {
-        "ops": {
-            "extract_taxi_data": {"config": {"taxi": "green", "year": year, "month": month}},
-            "load_and_transform_in_postgres": {"config": {"taxi": "green", "year": year, "month": month}},
-        }
-    }
-    
-    return RunRequest(run_key=run_key, run_config=run_config)
+    return taxi_month_run_request("green", context)
 
 
 # =============================================================================
@@ -76,8 +73,16 @@ def zoomcamp_repository():
     return [
         getting_started_data_pipeline, 
         postgres_taxi_pipeline,
+        postgres_taxi_backfill,
         # Thêm 2 schedule vào đây để Dagster nhận diện
         yellow_taxi_monthly_schedule,
         green_taxi_monthly_schedule,
         dbt_pipeline,
+        # Tính dm_monthly_zone_revenue cục bộ bằng DuckDB trên Parquet (tùy chọn)
+        duckdb_revenue_pipeline,
+        taxi_missing_partitions_sensor,
+        # Phiên bản asset: tháng taxi -> fact_trips/dm_monthly_zone_revenue của tháng đó
+        *taxi_assets,
+        taxi_tripdata_assets_job,
+        taxi_dbt_automation_sensor,
     ]
\ No newline at end of file
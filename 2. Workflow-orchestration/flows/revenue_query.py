@@ -0,0 +1,209 @@
+"""
+Truy vấn doanh thu taxi từ các bảng rollup dbt (models/rollups), không quét fact_trips.
+
+Bốn rollup, từ thô đến mịn:
+
+    rollup_monthly_borough_revenue  tháng × borough × service_type × payment_type
+    rollup_monthly_zone_revenue     tháng × zone    × service_type × payment_type
+    rollup_daily_borough_revenue    ngày  × borough × service_type × payment_type
+    rollup_daily_zone_revenue       ngày  × zone    × service_type × payment_type
+
+Mỗi truy vấn được trả lời từ rollup thô nhất còn đủ chi tiết: cần `day` (group
+by theo ngày, hoặc khoảng thời gian không tròn tháng) thì dùng rollup ngày,
+cần `zone` (group by hoặc lọc theo zone) thì dùng rollup zone. Kết quả được
+giữ trong một cache LRU trong bộ nhớ (có TTL, vì rollup được cập nhật mỗi lần
+nạp tháng), nên các truy vấn lặp lại của dashboard không chạm tới Postgres.
+
+    service = RevenueQueryService(db)  # db: PostgresConnectionResource
+    service.query(group_by=["month", "borough"], filters={"service_type": "Green"},
+                  start="2021-01", end="2021-04").frame
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Optional, Sequence
+
+import pandas as pd
+from psycopg2 import sql
+
+
+@dataclass(frozen=True)
+class Rollup:
+    table: str
+    time_grain: str  # "month" | "day"
+    location_grain: str  # "borough" | "zone"
+
+    def can_answer(self, needs_day: bool, needs_zone: bool) -> bool:
+        return (self.time_grain == "day" or not needs_day) and (self.location_grain == "zone" or not needs_zone)
+
+
+# Thô trước: rollup đầu tiên trả lời được truy vấn là rollup ít dòng nhất
+ROLLUPS = (
+    Rollup("rollup_monthly_borough_revenue", "month", "borough"),
+    Rollup("rollup_monthly_zone_revenue", "month", "zone"),
+    Rollup("rollup_daily_borough_revenue", "day", "borough"),
+    Rollup("rollup_daily_zone_revenue", "day", "zone"),
+)
+
+# Chiều truy vấn -> cột trong rollup
+DIMENSIONS = {
+    "day": "revenue_day",
+    "month": "revenue_month",
+    "service_type": "service_type",
+    "borough": "revenue_borough",
+    "zone": "revenue_zone",
+    "payment_type": "payment_type",
+    "payment_type_description": "payment_type_description",
+}
+
+# Measure -> biểu thức tổng hợp lại trên rollup (trung bình = tổng / số chuyến có giá trị)
+MEASURES = {
+    **{name: f"sum({name})" for name in (
+        "revenue_fare",
+        "revenue_extra",
+        "revenue_mta_tax",
+        "revenue_tip_amount",
+        "revenue_tolls_amount",
+        "revenue_ehail_fee",
+        "revenue_improvement_surcharge",
+        "revenue_total_amount",
+        "total_trips",
+    )},
+    "avg_passenger_count": "sum(passenger_count_sum) / nullif(sum(passenger_count_trips), 0)",
+    "avg_trip_distance": "sum(trip_distance_sum) / nullif(sum(trip_distance_trips), 0)",
+}
+
+
+def _parse_bound(value: Optional[str]) -> Optional[date]:
+    """"YYYY-MM" hoặc "YYYY-MM-DD" -> date (ngày đầu tháng với dạng tháng)."""
+    if value is None:
+        return None
+    return date.fromisoformat(value if len(value) > 7 else f"{value}-01")
+
+
+def choose_rollup(group_by: Sequence[str], filters: Dict[str, tuple], start: Optional[date], end: Optional[date]) -> Rollup:
+    needs_day = "day" in group_by or "day" in filters or any(b is not None and b.day != 1 for b in (start, end))
+    needs_zone = "zone" in group_by or "zone" in filters
+    return next(rollup for rollup in ROLLUPS if rollup.can_answer(needs_day, needs_zone))
+
+
+@dataclass
+class RevenueResult:
+    rollup: str
+    frame: pd.DataFrame
+    cached: bool
+    seconds: float
+
+
+class LRUCache:
+    """Cache LRU an toàn giữa các luồng, tối đa `max_entries` mục, mỗi mục sống `ttl_seconds`."""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RevenueQueryService:
+    """
+    `db` là một PostgresConnectionResource (hoặc object bất kỳ có
+    `get_connection()` trả về context manager của một connection psycopg2).
+    """
+
+    def __init__(self, db, schema: Optional[str] = None, max_entries: int = 256, ttl_seconds: float = 300.0):
+        self.db = db
+        self.schema = schema or os.getenv("DBT_SCHEMA", "public")
+        self.cache = LRUCache(max_entries, ttl_seconds)
+
+    def build_sql(self, rollup: Rollup, group_by, measures, filters, start, end):
+        columns = [sql.SQL("{} AS {}").format(sql.Identifier(DIMENSIONS[d]), sql.Identifier(d)) for d in group_by]
+        columns += [sql.SQL(MEASURES[m] + " AS {}").format(sql.Identifier(m)) for m in measures]
+        time_column = sql.Identifier("revenue_day" if rollup.time_grain == "day" else "revenue_month")
+        where, params = [], []
+        for dimension, values in filters.items():
+            where.append(sql.SQL("{} = ANY(%s)").format(sql.Identifier(DIMENSIONS[dimension])))
+            params.append(list(values))
+        if start is not None:
+            where.append(sql.SQL("{} >= %s").format(time_column))
+            params.append(start)
+        if end is not None:
+            where.append(sql.SQL("{} < %s").format(time_column))
+            params.append(end)
+        query = sql.SQL("SELECT {} FROM {}.{}").format(
+            sql.SQL(", ").join(columns), sql.Identifier(self.schema), sql.Identifier(rollup.table)
+        )
+        if where:
+            query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(where)
+        if group_by:
+            positions = sql.SQL(", ").join(sql.SQL(str(i)) for i in range(1, len(group_by) + 1))
+            query += sql.SQL(" GROUP BY {} ORDER BY {}").format(positions, positions)
+        return query, params
+
+    def query(
+        self,
+        group_by: Sequence[str] = ("month",),
+        measures: Sequence[str] = ("revenue_total_amount", "total_trips"),
+        filters: Optional[Dict[str, object]] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ) -> RevenueResult:
+        """
+        Doanh thu nhóm theo `group_by`, lọc theo `filters` (chiều -> một giá trị
+        hoặc list giá trị) và khoảng pickup [start, end) ("YYYY-MM" hoặc "YYYY-MM-DD").
+        """
+        unknown = [d for d in list(group_by) + list(filters or {}) if d not in DIMENSIONS]
+        unknown += [m for m in measures if m not in MEASURES]
+        if unknown:
+            raise ValueError(f"Unsupported dimensions/measures: {', '.join(unknown)}")
+        normalized = {
+            dimension: tuple(sorted(value if isinstance(value, (list, tuple, set)) else [value], key=str))
+            for dimension, value in (filters or {}).items()
+        }
+        start_date, end_date = _parse_bound(start), _parse_bound(end)
+        key = (tuple(group_by), tuple(measures), tuple(sorted(normalized.items())), start_date, end_date)
+
+        started = time.perf_counter()
+        cached = self.cache.get(key)
+        if cached is not None:
+            rollup, frame = cached
+            return RevenueResult(rollup, frame.copy(), True, time.perf_counter() - started)
+
+        rollup = choose_rollup(group_by, normalized, start_date, end_date)
+        query, params = self.build_sql(rollup, list(group_by), list(measures), normalized, start_date, end_date)
+        with self.db.get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(query, params)
+            frame = pd.DataFrame(cursor.fetchall(), columns=[c.name for c in cursor.description])
+        self.cache.put(key, (rollup.table, frame))
+        return RevenueResult(rollup.table, frame.copy(), False, time.perf_counter() - started)
+
+    def invalidate(self) -> None:
+        """Bỏ toàn bộ kết quả đã cache (vd. ngay sau khi rollup được cập nhật)."""
+        self.cache.clear()
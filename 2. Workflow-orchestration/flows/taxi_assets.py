@@ -0,0 +1,225 @@
+import os
+from pathlib import Path
+
+from dagster import (
+    AssetExecutionContext,
+    AssetSelection,
+    AutomationCondition,
+    AutomationConditionSensorDefinition,
+    DefaultSensorStatus,
+    MaterializeResult,
+    ResourceParam,
+    asset,
+    define_asset_job,
+    with_resources,
+)
+from dagster_dbt import DbtCliResource
+
+from dbt_pipeline import dbt_resource, run_dbt
+from pg_pool import pool_stats_delta
+from postgres_taxi import (
+    POSTGRES_LOAD_POOL,
+    POSTGRES_LOAD_TAG,
+    PostgresConnectionResource,
+    TaxiConfig,
+    convert_taxi_file_to_parquet,
+    download_taxi_file,
+    load_taxi_file,
+    monthly_partitions,
+    open_taxi_stream,
+    taxi_db_resource,
+)
+from taxi_metrics import LoadMetrics, export_openmetrics
+
+
+# Tính lại đúng tháng của model dbt khi tháng đó của một asset phía trên vừa được
+# materialize. Khác với AutomationCondition.eager(), điều kiện này không giới hạn
+# ở tháng mới nhất, nên backfill các tháng cũ cũng kéo theo dbt của các tháng đó.
+# dim_zones không phân vùng: lần materialize của nó không được tính là "tháng nào
+# cũng đổi" (nếu không mọi tháng sẽ bị tính lại), nhưng các tháng phải chờ tới khi
+# nó tồn tại.
+month_updated_condition = (
+    AutomationCondition.any_deps_updated().ignore(AssetSelection.assets("dim_zones")).since_last_handled()
+    & ~AutomationCondition.any_deps_missing().allow(AssetSelection.assets("dim_zones"))
+    & ~AutomationCondition.any_deps_in_progress()
+    & ~AutomationCondition.in_progress()
+)
+
+# Dựng asset không phân vùng khi nó chưa tồn tại (vd. database mới). Khác với
+# AutomationCondition.on_missing(), điều kiện này cũng áp dụng cho asset đã thiếu
+# từ trước khi sensor được bật; một lần chạy lỗi không được thử lại tự động.
+missing_condition = (
+    AutomationCondition.missing()
+    & ~AutomationCondition.any_deps_missing()
+    & ~AutomationCondition.in_progress()
+    & ~AutomationCondition.execution_failed()
+)
+
+
+# =====================================================================================
+# ASSETS - Bảng taxi thô (mỗi partition là một tháng)
+# =====================================================================================
+def build_tripdata_asset(taxi: str):
+    @asset(
+        name=f"{taxi}_tripdata",
+        partitions_def=monthly_partitions,
+        group_name="taxi_raw",
+        kinds={"postgres"},
+        pool=POSTGRES_LOAD_POOL,
+        description=f"Bảng public.{taxi}_tripdata, nạp theo từng tháng từ file .csv.gz của DataTalksClub.",
+    )
+    def tripdata(
+        context: AssetExecutionContext,
+        config: TaxiConfig,
+        db: ResourceParam[PostgresConnectionResource],
+    ) -> MaterializeResult:
+        month = context.partition_key[:7]
+        storage_dir = Path(os.environ["DAGSTER_HOME"]) / "storage"
+        target_options = {
+            "partitioned": config.partitioned_target,
+            "replace_partition": config.replace_partition,
+        }
+        metrics = LoadMetrics()
+        target_options["metrics"] = metrics
+        pool_before = db.pool_stats()
+        with db.get_connection() as conn:
+            if config.transfer_mode == "pipe":
+                file_path = storage_dir / f"{taxi}_tripdata_{month}.csv"
+                with open_taxi_stream(taxi, month, log=context.log) as stream:
+                    rows = load_taxi_file(conn, taxi, file_path, context.log, stream=stream, **target_options)
+            elif config.transfer_mode == "disk":
+                file_path = download_taxi_file(taxi, month, storage_dir, log=context.log, metrics=metrics)
+                rows = load_taxi_file(conn, taxi, file_path, context.log, **target_options)
+            elif config.transfer_mode == "parquet":
+                file_path = convert_taxi_file_to_parquet(
+                    taxi, month, storage_dir / "parquet", log=context.log, metrics=metrics
+                )
+                rows = load_taxi_file(conn, taxi, file_path, context.log, **target_options)
+            else:
+                raise ValueError(f"Unsupported transfer mode: {config.transfer_mode}")
+        export_openmetrics(
+            metrics, f"{taxi}_tripdata_{month}", {"asset": f"{taxi}_tripdata", "taxi": taxi, "month": month},
+            log=context.log,
+        )
+        return MaterializeResult(metadata={
+            "rows_merged": rows,
+            "source_file": file_path.name,
+            **pool_stats_delta(pool_before, db.pool_stats(since=pool_before)),
+            **metrics.to_metadata(),
+        })
+
+    return tripdata
+
+
+green_tripdata = build_tripdata_asset("green")
+yellow_tripdata = build_tripdata_asset("yellow")
+
+
+# =====================================================================================
+# ASSETS - Bảng zone (không phân vùng), fact_trips join với dim_zones
+# =====================================================================================
+@asset(
+    group_name="taxi_dbt",
+    kinds={"dbt", "postgres"},
+    automation_condition=missing_condition,
+    description="Seed dbt taxi_zone_lookup (seeds/taxi_zone_lookup.csv).",
+)
+def taxi_zone_lookup(context: AssetExecutionContext, dbt: ResourceParam[DbtCliResource]) -> MaterializeResult:
+    return MaterializeResult(metadata=run_dbt(context, dbt, select="taxi_zone_lookup"))
+
+
+@asset(
+    deps=[taxi_zone_lookup],
+    group_name="taxi_dbt",
+    kinds={"dbt", "postgres"},
+    automation_condition=AutomationCondition.eager() | missing_condition,
+    description="dim_zones, dựng lại mỗi khi seed taxi_zone_lookup thay đổi.",
+)
+def dim_zones(context: AssetExecutionContext, dbt: ResourceParam[DbtCliResource]) -> MaterializeResult:
+    return MaterializeResult(metadata=run_dbt(context, dbt, select="dim_zones"))
+
+
+# =====================================================================================
+# ASSETS - Model dbt (chỉ tính lại tháng của partition)
+# =====================================================================================
+@asset(
+    partitions_def=monthly_partitions,
+    deps=[green_tripdata, yellow_tripdata, dim_zones],
+    group_name="taxi_dbt",
+    kinds={"dbt", "postgres"},
+    automation_condition=month_updated_condition,
+    description="stg_*_tripdata và fact_trips cho tháng pickup của partition (dbt incremental).",
+)
+def fact_trips(context: AssetExecutionContext, dbt: ResourceParam[DbtCliResource]) -> MaterializeResult:
+    metadata = run_dbt(
+        context,
+        dbt,
+        select="stg_green_tripdata stg_yellow_tripdata fact_trips",
+        changed_months=[context.partition_key[:7]],
+        is_test_run=False,
+    )
+    return MaterializeResult(metadata=metadata)
+
+
+@asset(
+    partitions_def=monthly_partitions,
+    deps=[fact_trips],
+    group_name="taxi_dbt",
+    kinds={"dbt", "postgres"},
+    automation_condition=month_updated_condition,
+    description="dm_monthly_zone_revenue cho tháng pickup của partition (dbt incremental).",
+)
+def dm_monthly_zone_revenue(context: AssetExecutionContext, dbt: ResourceParam[DbtCliResource]) -> MaterializeResult:
+    metadata = run_dbt(
+        context,
+        dbt,
+        select="dm_monthly_zone_revenue",
+        changed_months=[context.partition_key[:7]],
+        is_test_run=False,
+    )
+    return MaterializeResult(metadata=metadata)
+
+
+@asset(
+    partitions_def=monthly_partitions,
+    deps=[fact_trips],
+    group_name="taxi_dbt",
+    kinds={"dbt", "postgres"},
+    automation_condition=month_updated_condition,
+    description="Các rollup doanh thu (ngày/tháng × zone/borough) cho tháng pickup của partition, dùng bởi revenue_query.py.",
+)
+def revenue_rollups(context: AssetExecutionContext, dbt: ResourceParam[DbtCliResource]) -> MaterializeResult:
+    metadata = run_dbt(
+        context,
+        dbt,
+        select="rollups",
+        changed_months=[context.partition_key[:7]],
+        is_test_run=False,
+    )
+    return MaterializeResult(metadata=metadata)
+
+
+# Gắn resource giống resource_defs của các job
+taxi_assets = with_resources(
+    [green_tripdata, yellow_tripdata, taxi_zone_lookup, dim_zones, fact_trips, dm_monthly_zone_revenue, revenue_rollups],
+    {"db": taxi_db_resource, "dbt": dbt_resource},
+)
+
+
+# =====================================================================================
+# JOB & SENSOR
+# =====================================================================================
+taxi_tripdata_assets_job = define_asset_job(
+    name="taxi_tripdata_assets_job",
+    selection=[green_tripdata, yellow_tripdata],
+    partitions_def=monthly_partitions,
+    tags={POSTGRES_LOAD_TAG: "taxi"},
+    description="Materialize một tháng của bảng taxi thô; dbt phía sau được sensor tự động kích hoạt.",
+)
+
+taxi_dbt_automation_sensor = AutomationConditionSensorDefinition(
+    name="taxi_dbt_automation_sensor",
+    target=[taxi_zone_lookup, dim_zones, fact_trips, dm_monthly_zone_revenue, revenue_rollups],
+    default_status=DefaultSensorStatus.RUNNING,
+    description="Đánh giá automation condition của các asset dbt theo từng tháng.",
+)
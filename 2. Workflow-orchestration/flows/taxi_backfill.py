@@ -0,0 +1,320 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import pandas as pd
+from dagster import (
+    AssetKey,
+    Config,
+    DagsterRunStatus,
+    DefaultSensorStatus,
+    Failure,
+    MetadataValue,
+    OpExecutionContext,
+    ResourceParam,
+    RunRequest,
+    RunsFilter,
+    SensorEvaluationContext,
+    SkipReason,
+    job,
+    op,
+    sensor,
+)
+
+from pg_pool import pool_stats_delta
+from postgres_taxi import (
+    POSTGRES_LOAD_TAG,
+    TAXI_LOAD_CONCURRENCY,
+    PostgresConnectionResource,
+    download_taxi_file,
+    load_taxi_file,
+    monthly_partitions,
+    report_tripdata_materialization,
+    taxi_db_resource,
+    taxi_types,
+)
+from taxi_assets import taxi_tripdata_assets_job
+
+
+# =====================================================================================
+# ENGINE - Tải/giải nén song song, nạp Postgres bằng một pool nhỏ hơn
+# =====================================================================================
+@dataclass
+class PartitionTiming:
+    """Thời gian xử lý của một partition tháng trong backfill."""
+    month: str
+    download_seconds: float = 0.0
+    wait_seconds: float = 0.0  # thời gian file nằm chờ một connection nạp
+    load_seconds: float = 0.0
+    rows_merged: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class BackfillReport:
+    taxi: str
+    partitions: List[PartitionTiming] = field(default_factory=list)
+    total_seconds: float = 0.0
+
+    @property
+    def succeeded(self) -> List[PartitionTiming]:
+        return [p for p in self.partitions if p.error is None]
+
+    @property
+    def failed(self) -> List[PartitionTiming]:
+        return [p for p in self.partitions if p.error is not None]
+
+    @property
+    def months_per_hour(self) -> float:
+        if self.total_seconds <= 0:
+            return 0.0
+        return len(self.succeeded) * 3600 / self.total_seconds
+
+    def to_markdown(self) -> str:
+        lines = [
+            "| month | download (s) | wait (s) | load (s) | rows merged | error |",
+            "|---|---|---|---|---|---|",
+        ]
+        for p in sorted(self.partitions, key=lambda p: p.month):
+            lines.append(
+                f"| {p.month} | {p.download_seconds:.1f} | {p.wait_seconds:.1f} | "
+                f"{p.load_seconds:.1f} | {p.rows_merged} | {p.error or ''} |"
+            )
+        return "\n".join(lines)
+
+
+def month_range(start_month: str, end_month: str) -> List[str]:
+    """Danh sách "YYYY-MM" từ start_month đến end_month (bao gồm cả hai đầu)."""
+    return [d.strftime("%Y-%m") for d in pd.date_range(f"{start_month}-01", f"{end_month}-01", freq="MS")]
+
+
+def run_backfill(
+    db: PostgresConnectionResource,
+    taxi: str,
+    months: List[str],
+    work_dir: Path,
+    download_workers: int = 4,
+    load_workers: int = 2,
+    max_pending_files: int = 0,
+    partitioned: bool = False,
+    log=None,
+) -> BackfillReport:
+    """
+    Backfill nhiều tháng cho một loại taxi.
+
+    - Tải và giải nén bằng một pool `download_workers` luồng.
+    - Nạp vào Postgres bằng `load_workers` luồng, mỗi luồng mượn connection từ
+      pool dùng chung của `db` (connection được dùng lại giữa các tháng).
+    - Backpressure: tối đa `max_pending_files` file đã giải nén được tồn tại
+      trên đĩa cùng lúc (mặc định 2 × load_workers). Luồng tải phải chờ một
+      slot trống trước khi bắt đầu; slot được trả lại khi file đã nạp xong và
+      bị xóa.
+    - `partitioned=True`: nạp vào bảng đích phân vùng theo tháng (xem
+      load_taxi_file); mỗi tháng chỉ merge vào bảng con của nó.
+    """
+    max_pending_files = max_pending_files or 2 * load_workers
+    pending_slots = threading.BoundedSemaphore(max_pending_files)
+    timings = {month: PartitionTiming(month) for month in months}
+    report = BackfillReport(taxi=taxi, partitions=list(timings.values()))
+
+    def download(month: str) -> Path:
+        pending_slots.acquire()
+        started = time.perf_counter()
+        try:
+            path = download_taxi_file(taxi, month, work_dir, log=log)
+        except Exception:
+            pending_slots.release()
+            raise
+        timings[month].download_seconds = time.perf_counter() - started
+        return path
+
+    def load(month: str, path: Path, queued_at: float) -> None:
+        timing = timings[month]
+        try:
+            with db.get_connection() as conn:
+                started = time.perf_counter()
+                timing.wait_seconds = started - queued_at
+                timing.rows_merged = load_taxi_file(conn, taxi, path, log, partitioned=partitioned)
+            timing.load_seconds = time.perf_counter() - started
+        finally:
+            path.unlink(missing_ok=True)
+            pending_slots.release()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(load_workers, thread_name_prefix="load") as load_pool, \
+            ThreadPoolExecutor(download_workers, thread_name_prefix="download") as download_pool:
+        downloads = {download_pool.submit(download, month): month for month in months}
+        loads = {}
+        for future in as_completed(downloads):
+            month = downloads[future]
+            try:
+                path = future.result()
+            except Exception as e:
+                timings[month].error = f"download: {e}"
+                if log:
+                    log.error(f"Download failed for {month}: {e}")
+                continue
+            loads[load_pool.submit(load, month, path, time.perf_counter())] = month
+
+        for future in as_completed(loads):
+            month = loads[future]
+            try:
+                future.result()
+            except Exception as e:
+                timings[month].error = f"load: {e}"
+                if log:
+                    log.error(f"Load failed for {month}: {e}")
+            else:
+                if log:
+                    t = timings[month]
+                    log.info(
+                        f"{month}: download {t.download_seconds:.1f}s, wait {t.wait_seconds:.1f}s, "
+                        f"load {t.load_seconds:.1f}s, {t.rows_merged} rows merged"
+                    )
+
+    report.total_seconds = time.perf_counter() - started
+    return report
+
+
+# =====================================================================================
+# CONFIGURATION
+# =====================================================================================
+class BackfillConfig(Config):
+    """Khoảng tháng cần backfill ("YYYY-MM") và kích thước các pool."""
+    taxi: str = "green"
+    start_month: str = "2019-01"
+    end_month: str = "2019-12"
+    download_workers: int = 4
+    load_workers: int = 2
+    max_pending_files: int = 0  # 0 = 2 × load_workers
+    partitioned_target: bool = False
+
+
+# =====================================================================================
+# OP & JOB
+# =====================================================================================
+@op(description="Backfill song song nhiều tháng dữ liệu taxi vào PostgreSQL")
+def backfill_taxi_partitions(
+    context: OpExecutionContext,
+    config: BackfillConfig,
+    db: ResourceParam[PostgresConnectionResource],
+):
+    months = month_range(config.start_month, config.end_month)
+    valid_months = {key[:7] for key in monthly_partitions.get_partition_keys()}
+    unknown = [m for m in months if m not in valid_months]
+    if unknown:
+        raise Failure(f"Months outside monthly_partitions: {', '.join(unknown)}")
+
+    if config.load_workers > db.pool_max_size:
+        context.log.warning(
+            f"load_workers={config.load_workers} > pool_max_size={db.pool_max_size}: "
+            "extra load threads will wait for a pooled connection"
+        )
+    context.log.info(
+        f"Backfilling {len(months)} {config.taxi} months with {config.download_workers} download "
+        f"and {config.load_workers} load workers"
+    )
+    pool_before = db.pool_stats()
+    report = run_backfill(
+        db,
+        config.taxi,
+        months,
+        Path(os.environ["DAGSTER_HOME"]) / "storage" / "backfill" / config.taxi,
+        download_workers=config.download_workers,
+        load_workers=config.load_workers,
+        max_pending_files=config.max_pending_files,
+        partitioned=config.partitioned_target,
+        log=context.log,
+    )
+
+    context.log.info(
+        f"Backfill finished: {len(report.succeeded)}/{len(months)} months in {report.total_seconds:.1f}s "
+        f"({report.months_per_hour:.1f} months/hour)"
+    )
+    for partition in report.succeeded:
+        report_tripdata_materialization(
+            context, config.taxi, partition.month,
+            {"job": context.job_name, "rows_merged": partition.rows_merged},
+        )
+    metadata = {
+        "months_loaded": len(report.succeeded),
+        "months_failed": len(report.failed),
+        "rows_merged": sum(p.rows_merged for p in report.partitions),
+        "total_seconds": round(report.total_seconds, 1),
+        "months_per_hour": round(report.months_per_hour, 2),
+        "partitions": MetadataValue.md(report.to_markdown()),
+        **pool_stats_delta(pool_before, db.pool_stats(since=pool_before)),
+    }
+    if report.failed:
+        raise Failure(
+            f"{len(report.failed)} month(s) failed: {', '.join(p.month for p in report.failed)}",
+            metadata=metadata,
+        )
+    context.add_output_metadata(metadata)
+
+
+@job(
+    description="Backfill nhiều tháng taxi cùng lúc với pool tải/giải nén và pool nạp Postgres riêng.",
+    resource_defs={"db": taxi_db_resource},
+    tags={POSTGRES_LOAD_TAG: "taxi"},
+)
+def postgres_taxi_backfill():
+    backfill_taxi_partitions()
+
+
+# =====================================================================================
+# SENSOR - Chạy các partition taxi × tháng còn thiếu, tối đa TAXI_LOAD_CONCURRENCY run
+# =====================================================================================
+ACTIVE_RUN_STATUSES = [
+    DagsterRunStatus.QUEUED,
+    DagsterRunStatus.NOT_STARTED,
+    DagsterRunStatus.STARTING,
+    DagsterRunStatus.STARTED,
+]
+
+
+def missing_taxi_partitions(instance) -> List[Tuple[str, str]]:
+    """
+    Các cặp (tháng, taxi) mà asset `<taxi>_tripdata` chưa có, tháng cũ trước.
+    Trạng thái lấy từ asset nên tháng đã nạp bằng asset job, postgres_taxi_pipeline
+    hay postgres_taxi_backfill đều được tính. Tháng đang nạp hoặc có lần
+    materialize lỗi không được tính là thiếu (để không retry vô hạn một file
+    hỏng); chạy lại chúng bằng tay.
+    """
+    month_keys = monthly_partitions.get_partition_keys()
+    missing = []
+    for taxi in taxi_types.get_partition_keys():
+        status = instance.get_status_by_partition(AssetKey(f"{taxi}_tripdata"), month_keys, monthly_partitions) or {}
+        missing += [(month, taxi) for month in month_keys if status.get(month) is None]
+    return sorted(missing)
+
+
+@sensor(
+    job=taxi_tripdata_assets_job,
+    minimum_interval_seconds=60,
+    default_status=DefaultSensorStatus.STOPPED,
+    description=(
+        "Backfill các partition taxi × tháng còn thiếu, giữ số run nạp Postgres đang chạy/đợi "
+        "không vượt quá TAXI_LOAD_CONCURRENCY."
+    ),
+)
+def taxi_missing_partitions_sensor(context: SensorEvaluationContext):
+    active = context.instance.get_runs_count(
+        RunsFilter(tags={POSTGRES_LOAD_TAG: "taxi"}, statuses=ACTIVE_RUN_STATUSES)
+    )
+    free_slots = TAXI_LOAD_CONCURRENCY - active
+    if free_slots <= 0:
+        return SkipReason(f"{active} taxi load runs in flight (limit {TAXI_LOAD_CONCURRENCY})")
+
+    missing = missing_taxi_partitions(context.instance)
+    if not missing:
+        return SkipReason("Every taxi × month partition has been loaded")
+    context.log.info(f"{len(missing)} partitions missing; launching {min(free_slots, len(missing))}")
+    return [
+        RunRequest(partition_key=month, asset_selection=[AssetKey(f"{taxi}_tripdata")])
+        for month, taxi in missing[:free_slots]
+    ]
@@ -0,0 +1,195 @@
+"""
+Đo thời gian và khối lượng của từng giai đoạn khi nạp một tháng taxi.
+
+Mỗi giai đoạn (download, decompress, convert, prepare, copy, merge) ghi lại
+số giây, số dòng và số byte đã xử lý; cùng với số dòng được insert / bị bỏ
+qua vì trùng unique_row_id, kết quả kiểm tra chất lượng và kiểm tra số dòng
+theo catalog (taxi_quality.py). Kết quả được chuyển thành:
+
+- metadata Dagster (`to_metadata`): số cho từng giai đoạn + bảng markdown,
+- AssetObservation trên asset `<taxi>_tripdata` của partition tháng
+  (`observation`), để vẽ thông lượng theo thời gian cho từng partition,
+- văn bản OpenMetrics (`to_openmetrics`), ghi ra `$TAXI_METRICS_DIR` nếu biến
+  môi trường này được đặt (vd. cho textfile collector của node_exporter).
+"""
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional
+
+from dagster import AssetKey, AssetObservation, MetadataValue
+
+from taxi_quality import QualityReport, RowCountCheck
+
+
+@dataclass
+class StageMetrics:
+    name: str
+    seconds: float = 0.0
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+
+    @property
+    def rows_per_sec(self) -> Optional[float]:
+        return self.rows / self.seconds if self.rows is not None and self.seconds > 0 else None
+
+    @property
+    def bytes_per_sec(self) -> Optional[float]:
+        return self.bytes / self.seconds if self.bytes is not None and self.seconds > 0 else None
+
+
+@dataclass
+class LoadMetrics:
+    """Các giai đoạn của một lần nạp (theo thứ tự chạy), số dòng insert/bỏ qua và kết quả kiểm tra."""
+    stages: Dict[str, StageMetrics] = field(default_factory=dict)
+    rows_inserted: Optional[int] = None
+    rows_skipped: Optional[int] = None
+    quality: Optional[QualityReport] = None
+    row_count: Optional[RowCountCheck] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Đo thời gian của khối lệnh; số dòng/byte được gán vào StageMetrics trả về."""
+        stage = self.stages.setdefault(name, StageMetrics(name))
+        started = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds += time.perf_counter() - started
+
+    def record(self, name: str, seconds: float, rows: Optional[int] = None, nbytes: Optional[int] = None) -> None:
+        stage = self.stages.setdefault(name, StageMetrics(name))
+        stage.seconds += seconds
+        if rows is not None:
+            stage.rows = (stage.rows or 0) + rows
+        if nbytes is not None:
+            stage.bytes = (stage.bytes or 0) + nbytes
+
+    # ---------------------------------------------------------------- export
+    def to_metadata(self) -> dict:
+        metadata = {}
+        for stage in self.stages.values():
+            metadata[f"{stage.name}_seconds"] = MetadataValue.float(round(stage.seconds, 3))
+            if stage.rows_per_sec is not None:
+                metadata[f"{stage.name}_rows_per_sec"] = MetadataValue.float(round(stage.rows_per_sec, 1))
+            if stage.bytes_per_sec is not None:
+                metadata[f"{stage.name}_bytes_per_sec"] = MetadataValue.float(round(stage.bytes_per_sec, 1))
+        if self.rows_inserted is not None:
+            metadata["rows_inserted"] = MetadataValue.int(self.rows_inserted)
+        if self.rows_skipped is not None:
+            metadata["rows_skipped_duplicates"] = MetadataValue.int(self.rows_skipped)
+        if self.quality is not None:
+            metadata["dq_rows_checked"] = MetadataValue.int(self.quality.rows)
+            rates = self.quality.violation_rates()
+            for name, count in self.quality.violations.items():
+                metadata[f"dq_{name}"] = MetadataValue.int(count)
+                metadata[f"dq_{name}_rate"] = MetadataValue.float(round(rates.get(name, 0.0), 6))
+            null_rates = {name: rate for name, rate in self.quality.null_rates().items() if rate > 0}
+            if null_rates:
+                metadata["dq_null_rates"] = MetadataValue.json({k: round(v, 6) for k, v in null_rates.items()})
+        if self.row_count is not None:
+            for name, value in self.row_count.as_dict().items():
+                if value is not None:
+                    metadata[name] = MetadataValue.bool(value) if isinstance(value, bool) else MetadataValue.int(value)
+        if self.stages:
+            metadata["stages"] = MetadataValue.md(self.to_markdown())
+        return metadata
+
+    def to_markdown(self) -> str:
+        lines = ["| stage | seconds | rows | rows/s | bytes | bytes/s |", "|---|---|---|---|---|---|"]
+        for s in self.stages.values():
+            lines.append(
+                f"| {s.name} | {s.seconds:.3f} | {_fmt(s.rows)} | {_fmt(s.rows_per_sec)} "
+                f"| {_fmt(s.bytes)} | {_fmt(s.bytes_per_sec)} |"
+            )
+        return "\n".join(lines)
+
+    def observation(self, taxi: str, month: str) -> AssetObservation:
+        """AssetObservation trên asset `<taxi>_tripdata`, partition của tháng ("YYYY-MM")."""
+        return AssetObservation(
+            asset_key=AssetKey(f"{taxi}_tripdata"),
+            partition=f"{month}-01",
+            metadata=self.to_metadata(),
+        )
+
+    def to_openmetrics(self, labels: Dict[str, str]) -> str:
+        base = ",".join(_label(key, value) for key, value in sorted(labels.items()))
+        series = {
+            "taxi_load_stage_seconds": [(s.name, s.seconds) for s in self.stages.values()],
+            "taxi_load_stage_rows": [(s.name, s.rows) for s in self.stages.values() if s.rows is not None],
+            "taxi_load_stage_bytes": [(s.name, s.bytes) for s in self.stages.values() if s.bytes is not None],
+        }
+        lines = []
+        for metric, values in series.items():
+            if not values:
+                continue
+            lines.append(f"# TYPE {metric} gauge")
+            lines += [f'{metric}{{{base},{_label("stage", name)}}} {value}' for name, value in values]
+        rows = [("inserted", self.rows_inserted), ("skipped", self.rows_skipped)]
+        rows = [(kind, value) for kind, value in rows if value is not None]
+        if rows:
+            lines.append("# TYPE taxi_load_rows gauge")
+            lines += [f'taxi_load_rows{{{base},{_label("kind", kind)}}} {value}' for kind, value in rows]
+        if self.quality is not None:
+            lines.append("# TYPE taxi_load_quality_violations gauge")
+            lines += [
+                f'taxi_load_quality_violations{{{base},{_label("check", name)}}} {count}'
+                for name, count in self.quality.violations.items()
+            ]
+            lines.append("# TYPE taxi_load_null_values gauge")
+            lines += [f'taxi_load_null_values{{{base},{_label("column", name)}}} {count}' for name, count in self.quality.nulls.items()]
+        if self.row_count is not None:
+            counts = [("audit", self.row_count.audit_rows), ("catalog", self.row_count.catalog_rows)]
+            counts = [(source, value) for source, value in counts if value is not None]
+            if counts:
+                lines.append("# TYPE taxi_table_rows gauge")
+                lines += [f'taxi_table_rows{{{base},{_label("source", source)}}} {value}' for source, value in counts]
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _label(key: str, value) -> str:
+    """Một nhãn OpenMetrics `key="value"`, escape \\, " và xuống dòng trong giá trị."""
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'{key}="{escaped}"'
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return ""
+    return f"{value:,.0f}" if isinstance(value, float) else f"{value:,}"
+
+
+def export_openmetrics(metrics: LoadMetrics, name: str, labels: Dict[str, str], log=None) -> Optional[Path]:
+    """Ghi `<TAXI_METRICS_DIR>/<name>.prom` (ghi đè nguyên tử); không làm gì nếu biến chưa đặt."""
+    directory = os.environ.get("TAXI_METRICS_DIR")
+    if not directory:
+        return None
+    path = Path(directory) / f"{name}.prom"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(metrics.to_openmetrics(labels))
+    tmp.replace(path)
+    if log:
+        log.info(f"Wrote OpenMetrics to {path}")
+    return path
+
+
+class CountingReader:
+    """Bọc một file-like object nhị phân, đếm số byte đã đọc (dùng cho stream COPY)."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self._raw.readline(size)
+        self.bytes_read += len(data)
+        return data
@@ -0,0 +1,260 @@
+"""
+Kiểm tra một lần nạp taxi mà không quét lại toàn bộ bảng.
+
+Hai phần:
+
+- Kiểm tra chất lượng theo batch (`BatchQualityChecker`): chạy trên từng
+  RecordBatch Arrow ngay lúc nạp, bằng pyarrow.compute (vector hóa, không lặp
+  từng dòng). Số NULL của mỗi cột lấy thẳng từ `null_count` của Arrow; các
+  vi phạm: fare/total âm, dropoff trước pickup, PU/DO LocationID không có trong
+  `taxi_zone_lookup` (seed của dbt). Với dữ liệu nạp bằng COPY CSV (Python không
+  thấy từng dòng), cùng các kiểm tra đó chạy một lần trên bảng staging của lần
+  nạp (`check_staging`), không chạm vào bảng chính.
+- Kiểm tra số dòng từ catalog: bảng `load_audit` ghi số dòng của từng partition
+  (tháng hoặc file) ngay trong transaction nạp; sau khi nạp, `verify_row_count`
+  so tổng đó với `pg_class.reltuples` (sau ANALYZE, lấy mẫu chứ không đếm) thay
+  cho `SELECT COUNT(*)`.
+
+Module này không phụ thuộc Dagster và được dùng chung bởi các flow và
+`1. Docker-sql/ingest_data.py`, `test_connection.py`.
+"""
+import json
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from taxi_schema import TaxiSchema
+
+LOAD_AUDIT_TABLE = "load_audit"
+ZONE_LOOKUP_CSV = Path(__file__).resolve().parent / "dbt_project" / "seeds" / "taxi_zone_lookup.csv"
+# Chênh lệch tương đối chấp nhận được giữa reltuples (ước lượng) và số dòng đã ghi
+ROW_COUNT_TOLERANCE = 0.02
+
+
+@lru_cache(maxsize=None)
+def load_zone_ids(path: Optional[str] = None) -> Optional[Tuple[str, ...]]:
+    """LocationID của taxi_zone_lookup.csv (dạng text như cột thô); None nếu không có file."""
+    import pyarrow.csv as pa_csv
+
+    path = Path(path) if path else ZONE_LOOKUP_CSV
+    if not path.exists():
+        return None
+    table = pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(column_types={"locationid": pa.string()}))
+    return tuple(table.column("locationid").to_pylist())
+
+
+# =====================================================================================
+# KẾT QUẢ - Số dòng, số NULL theo cột, số vi phạm theo kiểm tra
+# =====================================================================================
+@dataclass
+class QualityReport:
+    rows: int = 0
+    nulls: Dict[str, int] = field(default_factory=dict)
+    violations: Dict[str, int] = field(default_factory=dict)
+
+    def add(self, other: "QualityReport") -> None:
+        self.rows += other.rows
+        for name, count in other.nulls.items():
+            self.nulls[name] = self.nulls.get(name, 0) + count
+        for name, count in other.violations.items():
+            self.violations[name] = self.violations.get(name, 0) + count
+
+    def null_rates(self) -> Dict[str, float]:
+        return {name: count / self.rows for name, count in self.nulls.items()} if self.rows else {}
+
+    def violation_rates(self) -> Dict[str, float]:
+        return {name: count / self.rows for name, count in self.violations.items()} if self.rows else {}
+
+    def as_dict(self) -> dict:
+        return {"rows": self.rows, "nulls": dict(self.nulls), "violations": dict(self.violations)}
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "QualityReport":
+        data = data or {}
+        return cls(data.get("rows", 0), dict(data.get("nulls", {})), dict(data.get("violations", {})))
+
+    def summary(self) -> str:
+        """Một dòng tóm tắt: các vi phạm và các cột có NULL (tỷ lệ %)."""
+        parts = [f"{self.rows} rows checked"]
+        rates = self.violation_rates()
+        parts += [f"{name} {count} ({rates[name]:.2%})" for name, count in self.violations.items() if count]
+        null_rates = self.null_rates()
+        nulls = [f"{name} {null_rates[name]:.2%}" for name, count in self.nulls.items() if count]
+        if nulls:
+            parts.append("nulls: " + ", ".join(nulls))
+        return "; ".join(parts)
+
+
+# =====================================================================================
+# KIỂM TRA - Định nghĩa một lần, chạy trên Arrow hoặc dịch sang SQL cho staging
+# =====================================================================================
+@dataclass(frozen=True)
+class Check:
+    name: str
+    arrow: Callable[[pa.RecordBatch], pa.Array]  # mask boolean, True = vi phạm
+    sql: str  # điều kiện tương đương trong FILTER (WHERE ...)
+
+
+def _find_column(schema: TaxiSchema, name: str) -> Optional[str]:
+    """Tên cột trong registry, so khớp không phân biệt hoa/thường (fhv viết PUlocationID)."""
+    return next((column for column in schema.column_names if column.lower() == name.lower()), None)
+
+
+def build_checks(schema: TaxiSchema, zone_ids: Optional[Tuple[str, ...]] = None) -> Tuple[Check, ...]:
+    checks = []
+    for column, name in (("fare_amount", "negative_fare"), ("total_amount", "negative_total")):
+        column = _find_column(schema, column)
+        if column:
+            checks.append(Check(name, lambda b, c=column: pc.less(b.column(c), 0), f"{column} < 0"))
+    pickup, dropoff = schema.pickup_column, schema.dropoff_column
+    checks.append(Check(
+        "dropoff_before_pickup",
+        lambda b: pc.less(b.column(dropoff), b.column(pickup)),
+        f"{dropoff} < {pickup}",
+    ))
+    if zone_ids:
+        value_set = pa.array(zone_ids, pa.string())
+        for column, name in (("PULocationID", "unknown_pickup_location"), ("DOLocationID", "unknown_dropoff_location")):
+            column = _find_column(schema, column)
+            if column:
+                checks.append(Check(
+                    name,
+                    # is_in trả về False cho NULL: NULL đã được đếm riêng trong nulls
+                    lambda b, c=column: pc.and_(pc.is_valid(b.column(c)), pc.invert(pc.is_in(b.column(c), value_set))),
+                    f"{column} IS NOT NULL AND NOT ({column} = ANY(%(zone_ids)s))",
+                ))
+    return tuple(checks)
+
+
+class BatchQualityChecker:
+    """
+    Chạy các kiểm tra trên từng batch đã được ép về schema của registry và
+    cộng dồn vào `report` (truyền report cũ vào để tiếp tục sau khi resume).
+    """
+
+    def __init__(self, schema: TaxiSchema, zone_ids: Optional[Tuple[str, ...]] = None,
+                 report: Optional[QualityReport] = None):
+        self.schema = schema
+        self.checks = build_checks(schema, zone_ids)
+        self.report = report if report is not None else QualityReport()
+
+    def check(self, batch) -> QualityReport:
+        """Kiểm tra một RecordBatch/Table; trả về kết quả của riêng batch đó."""
+        result = QualityReport(
+            rows=batch.num_rows,
+            nulls={name: batch.column(name).null_count for name in self.schema.column_names},
+            violations={check.name: pc.sum(check.arrow(batch)).as_py() or 0 for check in self.checks},
+        )
+        self.report.add(result)
+        return result
+
+
+def check_staging(cursor, schema: TaxiSchema, table_name: str,
+                  zone_ids: Optional[Tuple[str, ...]] = None) -> QualityReport:
+    """Cùng các kiểm tra của BatchQualityChecker, chạy bằng một câu aggregate trên bảng staging."""
+    checks = build_checks(schema, zone_ids)
+    columns = schema.column_names
+    expressions = ["count(*)"]
+    expressions += [f"count(*) - count({name})" for name in columns]
+    expressions += [f"count(*) FILTER (WHERE {check.sql})" for check in checks]
+    cursor.execute(f"SELECT {', '.join(expressions)} FROM {table_name};", {"zone_ids": list(zone_ids or ())})
+    row = cursor.fetchone()
+    return QualityReport(
+        rows=row[0],
+        nulls=dict(zip(columns, row[1:1 + len(columns)])),
+        violations=dict(zip((check.name for check in checks), row[1 + len(columns):])),
+    )
+
+
+# =====================================================================================
+# CATALOG - load_audit và reltuples thay cho COUNT(*)
+# =====================================================================================
+def ensure_load_audit_table(cursor) -> None:
+    cursor.execute("SELECT to_regclass(%s) IS NULL;", (LOAD_AUDIT_TABLE,))
+    if not cursor.fetchone()[0]:
+        return
+    # Các lần nạp song song chờ nhau tạo bảng để tránh xung đột CREATE TABLE trong catalog
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (LOAD_AUDIT_TABLE,))
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {LOAD_AUDIT_TABLE} ("
+        "table_name text NOT NULL, partition text NOT NULL, source text, row_count bigint NOT NULL, "
+        "quality jsonb, loaded_at timestamptz NOT NULL DEFAULT now(), PRIMARY KEY (table_name, partition));"
+    )
+
+
+def read_load_audit(cursor, table_name: str, partition: str) -> Optional[Tuple[int, QualityReport]]:
+    """(row_count, quality) đã ghi của một partition, hoặc None."""
+    cursor.execute(
+        f"SELECT row_count, quality FROM {LOAD_AUDIT_TABLE} WHERE table_name = %s AND partition = %s;",
+        (table_name, partition),
+    )
+    row = cursor.fetchone()
+    return None if row is None else (row[0], QualityReport.from_dict(row[1]))
+
+
+def record_load(cursor, table_name: str, partition: str, row_count: int,
+                quality: Optional[QualityReport] = None, source: Optional[str] = None) -> None:
+    """Ghi (ghi đè) số dòng và kết quả kiểm tra của một partition trong transaction của lần nạp."""
+    cursor.execute(
+        f"INSERT INTO {LOAD_AUDIT_TABLE} (table_name, partition, source, row_count, quality) "
+        "VALUES (%s, %s, %s, %s, %s) ON CONFLICT (table_name, partition) DO UPDATE SET "
+        "source = EXCLUDED.source, row_count = EXCLUDED.row_count, quality = EXCLUDED.quality, loaded_at = now();",
+        (table_name, partition, source, row_count, json.dumps(quality.as_dict()) if quality else None),
+    )
+
+
+def audit_row_count(cursor, table_name: str) -> Optional[int]:
+    """Tổng row_count của mọi partition đã ghi cho bảng, None nếu chưa có."""
+    cursor.execute(f"SELECT sum(row_count) FROM {LOAD_AUDIT_TABLE} WHERE table_name = %s;", (table_name,))
+    total = cursor.fetchone()[0]
+    return None if total is None else int(total)
+
+
+def catalog_row_estimate(cursor, relation: str) -> Optional[int]:
+    """
+    Số dòng ước lượng từ pg_class.reltuples, cộng trên mọi bảng lá nếu là bảng
+    phân vùng. None nếu có bảng lá chứa dữ liệu mà chưa từng được ANALYZE.
+    """
+    # pg_partition_tree không trả về gì cho bảng thường: bảng thường chính là bảng lá duy nhất
+    cursor.execute(
+        "SELECT sum(CASE WHEN c.reltuples >= 0 THEN c.reltuples ELSE 0 END)::bigint, "
+        "bool_or(c.reltuples < 0 AND c.relpages > 0) FROM pg_class c WHERE c.relkind = 'r' "
+        "AND (c.oid = to_regclass(%(relation)s) "
+        "OR c.oid IN (SELECT relid FROM pg_partition_tree(to_regclass(%(relation)s))));",
+        {"relation": relation},
+    )
+    estimate, unknown = cursor.fetchone()
+    return None if estimate is None or unknown else int(estimate)
+
+
+@dataclass
+class RowCountCheck:
+    relation: str
+    audit_rows: Optional[int]
+    catalog_rows: Optional[int]
+    tolerance: float = ROW_COUNT_TOLERANCE
+
+    @property
+    def matches(self) -> bool:
+        if self.audit_rows is None or self.catalog_rows is None:
+            return False
+        return abs(self.catalog_rows - self.audit_rows) <= self.tolerance * max(self.audit_rows, 1)
+
+    def as_dict(self) -> dict:
+        return {"audit_rows": self.audit_rows, "catalog_rows": self.catalog_rows, "row_count_matches": self.matches}
+
+
+def verify_row_count(cursor, relation: str, audit_rows: Optional[int], analyze=(),
+                     tolerance: float = ROW_COUNT_TOLERANCE) -> RowCountCheck:
+    """
+    So số dòng theo load_audit với reltuples của `relation`. Các bảng trong
+    `analyze` (thường là bảng/bảng con vừa nạp) được ANALYZE trước: ANALYZE chỉ
+    đọc một mẫu cố định, không phụ thuộc kích thước bảng.
+    """
+    for name in analyze:
+        cursor.execute(f"ANALYZE {name};")
+    return RowCountCheck(relation, audit_rows, catalog_row_estimate(cursor, relation), tolerance)
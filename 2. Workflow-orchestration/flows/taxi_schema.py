@@ -0,0 +1,254 @@
+"""
+Schema registry cho dữ liệu chuyến đi green / yellow / fhv.
+
+Một nguồn duy nhất cho tên cột, kiểu Postgres và kiểu Arrow của từng loại taxi:
+
+- DDL của bảng thô và bảng staging (postgres_taxi.py, ingest_data.py),
+- kiểu cột khi đọc CSV bằng pyarrow.csv (không phải đoán kiểu),
+- binary COPY: batch đã được ép về schema Arrow của registry nên kiểu gửi đi
+  luôn khớp bảng đích.
+
+Cột ít giá trị phân biệt (store_and_fwd_flag, mã base của fhv) được giữ dạng
+dictionary trong Arrow.
+
+Layout của một file nguồn (thứ tự cột trong file, cột nào thiếu, cột nào thừa)
+được tính một lần cho mỗi phiên bản file (sha256) rồi cache lại.
+"""
+import json
+import threading
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Kiểu Postgres -> kiểu Arrow
+ARROW_TYPES = {
+    "text": pa.string(),
+    "timestamp": pa.timestamp("us"),
+    "integer": pa.int32(),
+    "double precision": pa.float64(),
+}
+# pyarrow.csv chỉ hỗ trợ dictionary với index int32
+CATEGORICAL_ARROW_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+
+@dataclass(frozen=True)
+class Column:
+    name: str
+    pg_type: str
+    categorical: bool = False
+
+    @property
+    def arrow_type(self) -> pa.DataType:
+        return CATEGORICAL_ARROW_TYPE if self.categorical else ARROW_TYPES[self.pg_type]
+
+
+@dataclass(frozen=True)
+class TaxiSchema:
+    name: str
+    columns: Tuple[Column, ...]
+    pickup_column: str
+    dropoff_column: str
+    # Các cột tạo nên unique_row_id của một chuyến đi
+    row_hash_columns: Tuple[str, ...]
+
+    @property
+    def column_names(self) -> List[str]:
+        return [column.name for column in self.columns]
+
+    def column_defs(self) -> str:
+        """"col type, col type, ..." dùng trong CREATE TABLE."""
+        return ", ".join(f"{column.name} {column.pg_type}" for column in self.columns)
+
+    def arrow_schema(self) -> pa.Schema:
+        return pa.schema([(column.name, column.arrow_type) for column in self.columns])
+
+    def row_hash_sql(self) -> str:
+        """Biểu thức md5 tính unique_row_id từ row_hash_columns."""
+        parts = " ||\n                ".join(
+            f"COALESCE(CAST({name} AS text), '')" for name in self.row_hash_columns
+        )
+        return f"md5(\n                {parts}\n            )"
+
+
+_TRIP_HASH = ("VendorID", "{pickup}", "{dropoff}", "PULocationID", "DOLocationID", "fare_amount", "trip_distance")
+
+
+def _trip_schema(name: str, prefix: str, columns: List[Column]) -> TaxiSchema:
+    pickup, dropoff = f"{prefix}_pickup_datetime", f"{prefix}_dropoff_datetime"
+    return TaxiSchema(
+        name=name,
+        columns=tuple(columns),
+        pickup_column=pickup,
+        dropoff_column=dropoff,
+        row_hash_columns=tuple(c.format(pickup=pickup, dropoff=dropoff) for c in _TRIP_HASH),
+    )
+
+
+# Cột theo thứ tự trong file CSV của DataTalksClub
+SCHEMAS = {
+    "yellow": _trip_schema("yellow", "tpep", [
+        Column("VendorID", "text"), Column("tpep_pickup_datetime", "timestamp"),
+        Column("tpep_dropoff_datetime", "timestamp"), Column("passenger_count", "integer"),
+        Column("trip_distance", "double precision"), Column("RatecodeID", "text"),
+        Column("store_and_fwd_flag", "text", categorical=True), Column("PULocationID", "text"),
+        Column("DOLocationID", "text"), Column("payment_type", "integer"),
+        Column("fare_amount", "double precision"), Column("extra", "double precision"),
+        Column("mta_tax", "double precision"), Column("tip_amount", "double precision"),
+        Column("tolls_amount", "double precision"), Column("improvement_surcharge", "double precision"),
+        Column("total_amount", "double precision"), Column("congestion_surcharge", "double precision"),
+    ]),
+    "green": _trip_schema("green", "lpep", [
+        Column("VendorID", "text"), Column("lpep_pickup_datetime", "timestamp"),
+        Column("lpep_dropoff_datetime", "timestamp"), Column("store_and_fwd_flag", "text", categorical=True),
+        Column("RatecodeID", "text"), Column("PULocationID", "text"), Column("DOLocationID", "text"),
+        Column("passenger_count", "integer"), Column("trip_distance", "double precision"),
+        Column("fare_amount", "double precision"), Column("extra", "double precision"),
+        Column("mta_tax", "double precision"), Column("tip_amount", "double precision"),
+        Column("tolls_amount", "double precision"), Column("ehail_fee", "double precision"),
+        Column("improvement_surcharge", "double precision"), Column("total_amount", "double precision"),
+        Column("payment_type", "integer"), Column("trip_type", "integer"),
+        Column("congestion_surcharge", "double precision"),
+    ]),
+    "fhv": TaxiSchema(
+        name="fhv",
+        columns=(
+            Column("dispatching_base_num", "text", categorical=True), Column("pickup_datetime", "timestamp"),
+            Column("dropOff_datetime", "timestamp"), Column("PUlocationID", "text"),
+            Column("DOlocationID", "text"), Column("SR_Flag", "integer"),
+            Column("Affiliated_base_number", "text", categorical=True),
+        ),
+        pickup_column="pickup_datetime",
+        dropoff_column="dropOff_datetime",
+        row_hash_columns=(
+            "dispatching_base_num", "pickup_datetime", "dropOff_datetime", "PUlocationID", "DOlocationID",
+        ),
+    ),
+}
+
+
+def get_schema(taxi: str) -> TaxiSchema:
+    try:
+        return SCHEMAS[taxi]
+    except KeyError:
+        raise ValueError(f"Unsupported taxi type: {taxi}") from None
+
+
+def schema_for_file(name: str) -> TaxiSchema:
+    """Schema theo tiền tố tên file, vd. "green_tripdata_2021-01.parquet" -> green."""
+    return get_schema(Path(name).name.split("_", 1)[0])
+
+
+# =====================================================================================
+# LAYOUT - Cột của một file nguồn cụ thể so với registry
+# =====================================================================================
+@dataclass
+class FileLayout:
+    source_columns: List[str]  # tên cột trong file, theo thứ tự của file
+    mapping: Dict[str, str]  # tên trong file -> tên trong registry (so khớp không phân biệt hoa/thường)
+    missing: List[str] = field(default_factory=list)  # cột của registry không có trong file
+    extra: List[str] = field(default_factory=list)  # cột của file không có trong registry (bị bỏ)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def resolve_layout(schema: TaxiSchema, source_columns: List[str]) -> FileLayout:
+    by_lower = {name.lower(): name for name in schema.column_names}
+    mapping = {name: by_lower[name.lower()] for name in source_columns if name.lower() in by_lower}
+    return FileLayout(
+        source_columns=list(source_columns),
+        mapping=mapping,
+        missing=[name for name in schema.column_names if name not in mapping.values()],
+        extra=[name for name in source_columns if name not in mapping],
+    )
+
+
+class LayoutCache:
+    """
+    Layout theo (schema, phiên bản file). Giữ trong bộ nhớ và, nếu có `root`,
+    ghi ra `<root>/<schema>-<version>.json` để process sau dùng lại.
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root else None
+        self._layouts = {}
+        self._lock = threading.Lock()
+
+    def get(self, schema: TaxiSchema, version: str, read_columns: Callable[[], List[str]]) -> FileLayout:
+        key = (schema.name, version)
+        with self._lock:
+            layout = self._layouts.get(key)
+        if layout is not None:
+            return layout
+        path = self.root / f"{schema.name}-{version}.json" if self.root and version else None
+        if path is not None and path.exists():
+            layout = FileLayout(**json.loads(path.read_text()))
+        else:
+            layout = resolve_layout(schema, read_columns())
+            if path is not None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(".json.tmp")
+                tmp.write_text(json.dumps(layout.as_dict()))
+                tmp.replace(path)
+        if version:
+            with self._lock:
+                self._layouts[key] = layout
+        return layout
+
+
+# =====================================================================================
+# READERS - Đọc theo schema của registry
+# =====================================================================================
+def csv_header(path, compression: Optional[str] = None) -> List[str]:
+    """Tên cột ở dòng đầu của một file CSV (có thể nén gzip)."""
+    with pa.input_stream(str(path), compression=compression) as stream:
+        line = b""
+        while not line.endswith(b"\n"):
+            chunk = stream.read(4096)
+            if not chunk:
+                break
+            line += chunk
+    return line.split(b"\n", 1)[0].decode("utf-8").strip().split(",")
+
+
+def csv_read_options(schema: TaxiSchema, layout: FileLayout, block_size: int = 16 * 1024 * 1024):
+    """ReadOptions/ConvertOptions của pyarrow.csv với kiểu cột tường minh theo layout."""
+    import pyarrow.csv as pa_csv
+
+    types = {column.name: column.arrow_type for column in schema.columns}
+    read_options = pa_csv.ReadOptions(
+        column_names=layout.source_columns, skip_rows=1, block_size=block_size
+    )
+    convert_options = pa_csv.ConvertOptions(
+        column_types={source: types[target] for source, target in layout.mapping.items()},
+        include_columns=list(layout.mapping),
+        strings_can_be_null=True,  # giống COPY CSV: trường rỗng là NULL
+    )
+    return read_options, convert_options
+
+
+def conform(data, schema: TaxiSchema, layout: FileLayout):
+    """
+    Đổi một RecordBatch/Table của file nguồn về đúng schema Arrow của registry:
+    đổi tên theo layout, thêm cột thiếu (NULL), bỏ cột thừa, ép kiểu.
+    """
+    arrays = []
+    source_by_target = {target: source for source, target in layout.mapping.items()}
+    for column in schema.columns:
+        source = source_by_target.get(column.name)
+        if source is None:
+            arrays.append(pa.nulls(data.num_rows, column.arrow_type))
+            continue
+        array = data.column(source)
+        if array.type != column.arrow_type:
+            if column.categorical:
+                array = pc.dictionary_encode(array.cast(pa.string())).cast(column.arrow_type)
+            else:
+                array = array.cast(column.arrow_type)
+        arrays.append(array)
+    build = pa.Table.from_arrays if isinstance(data, pa.Table) else pa.RecordBatch.from_arrays
+    return build(arrays, schema=schema.arrow_schema())
+
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Throughput / memory benchmark of the ingestion paths of this repository.
+
+Synthetic green-taxi trips of a configurable size are generated once (Parquet
+for ingest_data.py, .csv.gz in the DataTalksClub layout for the Dagster ops)
+and served by a local HTTP stand-in. Each path then runs in its own
+subprocess against the given Postgres database:
+
+- ingest_data          `1. Docker-sql/ingest_data.py` main(), full read
+- ingest_data_stream   same, --streaming
+- etl                  `1. Docker-sql/etl/etl.py` main() with --synthetic_rows
+- dagster_disk / dagster_pipe / dagster_parquet
+                       extract_taxi_data -> load_and_transform_in_postgres
+                       (postgres_taxi_pipeline) with that transfer_mode
+
+For each path the report records rows/s, peak RSS of the worker process,
+bytes served over HTTP, WAL generated (pg_current_wal_lsn before/after) and
+the size of the target table, together with the git commit, so two reports
+can be compared:
+
+    python benchmarks/ingest_benchmark.py --host=localhost --port=5432 \
+        --db=bench_db --user=pipeline_user --password=pipeline_pass \
+        --rows=500000 --output=bench-$(git rev-parse --short HEAD).json \
+        --baseline=bench-previous.json
+
+The tables the paths write to (bench_ingest_green, social_media_posts,
+green_tripdata) are DROPPED before each run: point it at a scratch database.
+"""
+
+import argparse
+import http.server
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from time import time
+
+import numpy as np
+import pandas as pd
+import psycopg2
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DOCKER_SQL_DIR = REPO_ROOT / "1. Docker-sql"
+FLOWS_DIR = REPO_ROOT / "2. Workflow-orchestration" / "flows"
+
+MONTH = "2021-01"
+INGEST_TABLE = "bench_ingest_green"
+
+# path -> table it writes to
+PATHS = {
+    "ingest_data": INGEST_TABLE,
+    "ingest_data_stream": INGEST_TABLE,
+    "etl": "social_media_posts",
+    "dagster_disk": "green_tripdata",
+    "dagster_pipe": "green_tripdata",
+    "dagster_parquet": "green_tripdata",
+}
+
+
+# =====================================================================================
+# SYNTHETIC DATA
+# =====================================================================================
+def synthetic_green_trips(rows, seed=42):
+    """Arrow table of `rows` green trips in MONTH, typed like the schema registry."""
+    sys.path.insert(0, str(FLOWS_DIR))
+    from taxi_schema import get_schema
+
+    rng = np.random.default_rng(seed)
+    pickup = pd.Timestamp(f"{MONTH}-01") + pd.to_timedelta(rng.integers(0, 28 * 86_400, rows), unit="s")
+    duration = pd.to_timedelta(rng.integers(60, 3_600, rows), unit="s")
+    fare = np.round(rng.gamma(2.0, 7.0, rows), 2)
+    tip = np.round(fare * rng.choice([0, 0.1, 0.2], rows), 2)
+    data = {
+        "VendorID": rng.choice(["1", "2"], rows),
+        "lpep_pickup_datetime": pickup,
+        "lpep_dropoff_datetime": pickup + duration,
+        "store_and_fwd_flag": rng.choice(["N", "Y"], rows, p=[0.99, 0.01]),
+        "RatecodeID": rng.choice(["1", "5"], rows),
+        "PULocationID": rng.integers(1, 266, rows).astype(str),
+        "DOLocationID": rng.integers(1, 266, rows).astype(str),
+        "passenger_count": rng.integers(1, 6, rows).astype("int32"),
+        "trip_distance": np.round(rng.gamma(2.0, 1.5, rows), 2),
+        "fare_amount": fare,
+        "extra": rng.choice([0.0, 0.5, 1.0], rows),
+        "mta_tax": np.full(rows, 0.5),
+        "tip_amount": tip,
+        "tolls_amount": np.zeros(rows),
+        "ehail_fee": np.full(rows, np.nan),
+        "improvement_surcharge": np.full(rows, 0.3),
+        "total_amount": np.round(fare + tip + 0.8, 2),
+        "payment_type": rng.integers(1, 3, rows).astype("int32"),
+        "trip_type": np.ones(rows, dtype="int32"),
+        "congestion_surcharge": np.zeros(rows),
+    }
+    schema = get_schema("green").arrow_schema()
+    arrays = [pa.array(data[field.name]).cast(field.type) for field in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_sources(table, directory):
+    """Write the Parquet and .csv.gz copies served by the HTTP stand-in."""
+    (directory / "green").mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, directory / f"green_tripdata_{MONTH}.parquet")
+    df = table.to_pandas()
+    df.to_csv(directory / "green" / f"green_tripdata_{MONTH}.csv.gz", index=False, compression="gzip")
+
+
+# =====================================================================================
+# HTTP STAND-IN
+# =====================================================================================
+class CountingHandler(http.server.SimpleHTTPRequestHandler):
+    bytes_sent = 0
+    lock = threading.Lock()
+
+    def copyfile(self, source, outputfile):
+        while chunk := source.read(1024 * 1024):
+            outputfile.write(chunk)
+            with CountingHandler.lock:
+                CountingHandler.bytes_sent += len(chunk)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(directory):
+    handler = lambda *args, **kwargs: CountingHandler(*args, directory=str(directory), **kwargs)  # noqa: E731
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# =====================================================================================
+# WORKER - one path, run in a fresh subprocess
+# =====================================================================================
+def prepare_worker(path, config):
+    """Import and configure one ingestion path; return a callable that runs it."""
+    if path.startswith("ingest_data"):
+        sys.path.insert(0, str(DOCKER_SQL_DIR))
+        import ingest_data
+
+        params = argparse.Namespace(
+            user=config["user"], password=config["password"], host=config["host"], port=config["port"],
+            db=config["db"], table_name=INGEST_TABLE, taxi="green",
+            url=f"{config['base_url']}/green_tripdata_{MONTH}.parquet",
+            streaming=path == "ingest_data_stream", batch_size=config["batch_size"],
+            cache_dir=config["work_dir"] + "/ingest_cache", cache_max_gb=1, copy_format=config["copy_format"],
+            restart=True,
+        )
+        return lambda: ingest_data.main(params)
+
+    if path == "etl":
+        sys.path.insert(0, str(DOCKER_SQL_DIR / "etl"))
+        import etl
+
+        os.environ["PGPORT"] = str(config["port"])
+        params = argparse.Namespace(
+            host=config["host"], db=config["db"], user=config["user"], password=config["password"],
+            method="copy", page_size=config["batch_size"], upsert=False,
+            synthetic_rows=config["rows"], csv=None,
+        )
+        return lambda: etl.main(params)
+
+    os.environ.update({
+        "POSTGRES_HOST": config["host"], "POSTGRES_PORT": str(config["port"]),
+        "POSTGRES_DB": config["db"], "POSTGRES_USER": config["user"],
+        "POSTGRES_PASSWORD": config["password"],
+        "TAXI_DATA_BASE_URL": config["base_url"],
+        "DAGSTER_HOME": config["work_dir"] + "/dagster_home",
+    })
+    Path(os.environ["DAGSTER_HOME"]).mkdir(parents=True, exist_ok=True)
+    sys.path.insert(0, str(FLOWS_DIR))
+    from dagster import DagsterInstance, MultiPartitionKey
+    from postgres_taxi import postgres_taxi_pipeline
+
+    op_config = {"config": {"transfer_mode": path.removeprefix("dagster_")}}
+
+    def run():
+        with DagsterInstance.ephemeral() as instance:
+            postgres_taxi_pipeline.execute_in_process(
+                partition_key=MultiPartitionKey({"taxi": "green", "month": f"{MONTH}-01"}),
+                run_config={"ops": {"extract_taxi_data": op_config, "load_and_transform_in_postgres": op_config}},
+                instance=instance,
+            )
+    return run
+
+
+def worker_main(path, config_json):
+    """Run one path; print its timing (imports excluded) and peak RSS as JSON."""
+    config = json.loads(config_json)
+    # The paths print progress; keep stdout for the JSON result
+    real_stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        run = prepare_worker(path, config)
+        started = time()
+        run()
+        seconds = time() - started
+    finally:
+        sys.stdout = real_stdout
+    # ru_maxrss is KB on Linux
+    print(json.dumps({"seconds": seconds, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+# =====================================================================================
+# HARNESS
+# =====================================================================================
+def connect(params):
+    return psycopg2.connect(
+        host=params.host, port=params.port, dbname=params.db, user=params.user, password=params.password
+    )
+
+
+def wal_lsn(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_current_wal_lsn()")
+        return cur.fetchone()[0]
+
+
+def wal_bytes(conn, before, after):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_wal_lsn_diff(%s, %s)", (after, before))
+        return int(cur.fetchone()[0])
+
+
+def table_stats(conn, table):
+    """(rows, total bytes incl. indexes and partitions) of a public table."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s)", (f"public.{table}",))
+        if cur.fetchone()[0] is None:
+            return 0, 0
+        # pg_partition_tree is empty for a regular table
+        cur.execute(
+            "SELECT COALESCE((SELECT sum(pg_total_relation_size(relid)) FROM pg_partition_tree(%(t)s::regclass) "
+            "WHERE isleaf), pg_total_relation_size(%(t)s::regclass))",
+            {"t": f"public.{table}"},
+        )
+        size = int(cur.fetchone()[0])
+        cur.execute(f"SELECT count(*) FROM public.{table}")
+        return cur.fetchone()[0], size
+
+
+def drop_table(conn, table):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS public.{table} CASCADE")
+
+
+def git_info():
+    def git(*args):
+        try:
+            return subprocess.run(
+                ["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+def run_path(conn, path, config, run_dir):
+    """Run one path in a subprocess with cold caches (its own work dir)."""
+    table = PATHS[path]
+    drop_table(conn, table)
+    run_dir.mkdir(parents=True)
+    config = {**config, "work_dir": str(run_dir)}
+    http_before = CountingHandler.bytes_sent
+    lsn_before = wal_lsn(conn)
+    completed = subprocess.run(
+        [sys.executable, __file__, "--worker", path, "--worker_config", json.dumps(config)],
+        capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        return {"path": path, "error": completed.stderr.strip().splitlines()[-1:]}
+    worker = json.loads(completed.stdout.strip().splitlines()[-1])
+    rows, table_bytes = table_stats(conn, table)
+    return {
+        "path": path,
+        "rows": rows,
+        "seconds": round(worker["seconds"], 3),
+        "rows_per_sec": round(rows / worker["seconds"]) if worker["seconds"] > 0 else None,
+        "peak_rss_mb": round(worker["peak_rss_mb"], 1),
+        "http_bytes": CountingHandler.bytes_sent - http_before,
+        "wal_bytes": wal_bytes(conn, lsn_before, wal_lsn(conn)),
+        "table_bytes": table_bytes,
+    }
+
+
+def print_results(results, baseline=None):
+    base = {r["path"]: r for r in (baseline or {}).get("results", []) if "error" not in r}
+    print(f"\n{'path':<20} {'rows':>9} {'s':>8} {'rows/s':>10} {'RSS MB':>8} {'HTTP MB':>8} {'WAL MB':>8} {'vs base':>8}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['path']:<20} ERROR {' '.join(r['error'])}")
+            continue
+        delta = ""
+        if r["path"] in base and base[r["path"]].get("rows_per_sec"):
+            delta = f"{r['rows_per_sec'] / base[r['path']]['rows_per_sec'] - 1:+.0%}"
+        print(
+            f"{r['path']:<20} {r['rows']:>9} {r['seconds']:>8.2f} {r['rows_per_sec'] or 0:>10,} "
+            f"{r['peak_rss_mb']:>8.1f} {r['http_bytes'] / 1e6:>8.1f} {r['wal_bytes'] / 1e6:>8.1f} {delta:>8}"
+        )
+
+
+def main(params):
+    with tempfile.TemporaryDirectory(prefix="ingest_bench_") as work_dir:
+        work_dir = Path(work_dir)
+        print(f"Generating {params.rows} synthetic trips...")
+        write_sources(synthetic_green_trips(params.rows, params.seed), work_dir / "http")
+        server, base_url = start_http_server(work_dir / "http")
+
+        conn = connect(params)
+        conn.autocommit = True
+        config = {
+            "host": params.host, "port": params.port, "db": params.db, "user": params.user,
+            "password": params.password, "rows": params.rows, "batch_size": params.batch_size,
+            "copy_format": params.copy_format, "base_url": base_url,
+        }
+        results = []
+        try:
+            for path in params.paths:
+                for attempt in range(params.repeat):
+                    print(f"Running {path} ({attempt + 1}/{params.repeat})...")
+                    results.append(run_path(conn, path, config, work_dir / "runs" / f"{path}-{attempt}"))
+            with conn.cursor() as cur:
+                cur.execute("SHOW server_version")
+                server_version = cur.fetchone()[0]
+        finally:
+            conn.close()
+            server.shutdown()
+
+    report = {
+        "git": git_info(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "postgres": server_version,
+        "rows": params.rows,
+        "batch_size": params.batch_size,
+        "copy_format": params.copy_format,
+        "results": results,
+    }
+    baseline = json.loads(Path(params.baseline).read_text()) if params.baseline else None
+    print_results(results, baseline)
+    if params.output:
+        Path(params.output).write_text(json.dumps(report, indent=2))
+        print(f"\nReport written to {params.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ingestion paths on synthetic taxi data')
+
+    parser.add_argument('--host', default='localhost', help='host for postgres')
+    parser.add_argument('--port', type=int, default=5432, help='port for postgres')
+    parser.add_argument('--db', help='scratch database (its benchmark tables are dropped)')
+    parser.add_argument('--user', default='pipeline_user', help='user name for postgres')
+    parser.add_argument('--password', default='pipeline_pass', help='password for postgres')
+    parser.add_argument('--rows', type=int, default=200_000, help='synthetic rows per path')
+    parser.add_argument('--seed', type=int, default=42, help='seed of the synthetic data')
+    parser.add_argument('--paths', nargs='+', choices=list(PATHS), default=list(PATHS), help='paths to run')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per path')
+    parser.add_argument('--batch_size', type=int, default=100_000, help='batch / page size of ingest_data and etl')
+    parser.add_argument('--copy_format', choices=['csv', 'binary'], default='csv', help='COPY format of ingest_data')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='earlier JSON report to compare rows/s against')
+    parser.add_argument('--worker', choices=list(PATHS), help=argparse.SUPPRESS)
+    parser.add_argument('--worker_config', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.worker:
+        worker_main(args.worker, args.worker_config)
+    elif not args.db:
+        parser.error('--db is required (use a scratch database: benchmark tables are dropped)')
+    else:
+        main(args)